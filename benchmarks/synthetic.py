@@ -0,0 +1,239 @@
+'''Synthetic APT captures for exercising and benchmarking the decoder
+
+Generates float32 samples at 4160 samples/s the way the apt_rx flowgraph
+writes them: Sync A/B bursts, space marks with minute markers, telemetry
+wedges and two image channels, with configurable noise, clock drift and
+signal dropouts. A detached GNU Radio header with a SyncA tagged segment
+per line can be written alongside, as the file_meta_sink does. The same
+pass can also be written as the FM modulated IQ recording the replay
+flowgraph demodulates.
+
+Usage:
+    python benchmarks/synthetic.py capture.dat 15 --noise 0.05 --drift 50
+'''
+from __future__ import division
+
+import argparse
+import numpy as np
+import os.path
+import pmt
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import p
+
+from gnuradio.blocks import parse_file_metadata
+
+################################################################################
+# Function Definitions
+################################################################################
+def telemetry_wedges(lines, channel_a=2, channel_b=4):
+    '''Builds the telemetry wedge values of every line of both frames
+
+    Args:
+        lines: Number of lines
+        channel_a: AVHRR channel number sent in frame A
+        channel_b: AVHRR channel number sent in frame B
+
+    Returns:
+        A (wedges_a, wedges_b) tuple of per line values in 0-1.
+    '''
+    ramp = [(wedge + 1) / 8 for wedge in range(8)]
+    thermistors = [0.30, 0.31, 0.32, 0.33]
+    frame_a = ramp + [0.0] + thermistors + [0.40, 0.05, ramp[channel_a - 1]]
+    frame_b = ramp + [0.0] + thermistors + [0.40, 0.35, ramp[channel_b - 1]]
+    wedge = (np.arange(lines) // p.TLM_WEDGE_LINES) % p.TLM_WEDGES
+    return np.array(frame_a)[wedge], np.array(frame_b)[wedge]
+
+def earth_scene(lines, width, rng):
+    '''Builds smooth cloud and land fields for the image channels
+
+    Args:
+        lines: Number of lines
+        width: Pixels per line
+        rng: numpy RandomState
+
+    Returns:
+        A (visible, infrared) tuple of (lines, width) float32 arrays in 0-1.
+    '''
+    y = np.linspace(0, 1, lines, dtype=np.float32)[:, np.newaxis]
+    x = np.linspace(0, 1, width, dtype=np.float32)[np.newaxis, :]
+    clouds = np.zeros((lines, width), dtype=np.float32)
+    for scale in (3, 7, 17, 41):
+        phase = rng.rand(2) * 2 * np.pi
+        clouds += np.sin(scale * 2 * np.pi * x + phase[0]) * np.sin(scale * lines / 1000 * y + phase[1]) / scale
+    clouds = np.clip(clouds * 2, 0, 1)
+    land = (np.sin(9 * x + 5 * y) > 0.3).astype(np.float32)
+    visible = 0.1 + 0.2 * land + 0.7 * clouds
+    infrared = 0.3 + 0.1 * land + 0.6 * clouds
+    return visible, infrared
+
+def synthesize_apt(minutes, noise=0.05, drift_ppm=0.0, dropouts=0, lead_in=0.5, seed=0):
+    '''Generates a synthetic demodulated APT capture
+
+    Args:
+        minutes: Length of the pass in minutes
+        noise: Standard deviation of the added noise (full scale is 0.8)
+        drift_ppm: Sample clock error, stretching the lines by this much
+        dropouts: Number of spans of 1-10 s where the signal is lost
+        lead_in: Seconds of noise before the first line
+        seed: Random seed
+
+    Returns:
+        A (samples, line_starts, synced) tuple. samples is the float32
+        capture, line_starts the sample position each line starts at and
+        synced whether each line's Sync A made it through.
+    '''
+    rng = np.random.RandomState(seed)
+    lines = int(minutes * 60 * p.LINES_PER_SECOND)
+    frame = np.empty((lines, p.FULL_LINE_WIDTH), dtype=np.float32)
+
+    visible, infrared = earth_scene(lines, p.IMAGE_WIDTH, rng)
+    wedges_a, wedges_b = telemetry_wedges(lines)
+    minute_marks = (np.arange(lines) % (60 * p.LINES_PER_SECOND)) < 2
+    frame[:, p.SYNC_RANGE['A'][0]:p.SYNC_RANGE['A'][1]] = p.SYNC_A_PATTERN
+    frame[:, p.SYNC_RANGE['B'][0]:p.SYNC_RANGE['B'][1]] = p.SYNC_B_PATTERN
+    frame[:, p.SPACE_MARK_RANGE['A'][0]:p.SPACE_MARK_RANGE['A'][1]] = np.where(minute_marks, 1.0, 0.0)[:, np.newaxis]
+    frame[:, p.SPACE_MARK_RANGE['B'][0]:p.SPACE_MARK_RANGE['B'][1]] = np.where(minute_marks, 0.0, 1.0)[:, np.newaxis]
+    frame[:, p.IMAGE_RANGE['A'][0]:p.IMAGE_RANGE['A'][1]] = visible
+    frame[:, p.IMAGE_RANGE['B'][0]:p.IMAGE_RANGE['B'][1]] = infrared
+    frame[:, p.TLM_FRAME_RANGE['A'][0]:p.TLM_FRAME_RANGE['A'][1]] = wedges_a[:, np.newaxis]
+    frame[:, p.TLM_FRAME_RANGE['B'][0]:p.TLM_FRAME_RANGE['B'][1]] = wedges_b[:, np.newaxis]
+    frame = 0.1 + 0.8 * frame
+
+    lead_in_samples = int(lead_in * p.SAMPLE_RATE)
+    samples = np.concatenate((rng.rand(lead_in_samples).astype(np.float32) * 0.5, frame.ravel()))
+    line_starts = lead_in_samples + np.arange(lines) * p.FULL_LINE_WIDTH
+
+    if drift_ppm:
+        stretch = 1 + drift_ppm * 1e-6
+        positions = np.arange(int(len(samples) / stretch)) * stretch
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+        line_starts = line_starts / stretch
+
+    synced = np.ones(lines, dtype=bool)
+    for _ in range(dropouts):
+        start = rng.randint(0, len(samples))
+        length = int(rng.uniform(1, 10) * p.SAMPLE_RATE)
+        samples[start:start + length] = rng.rand(len(samples[start:start + length])) * 0.5
+        synced[(line_starts + p.SYNC_WIDTH > start) & (line_starts < start + length)] = False
+
+    samples += (rng.randn(len(samples)) * noise).astype(np.float32)
+    return samples, line_starts, synced
+
+def write_gnuradio_header(handle, nitems, rx_rate, rx_time, extras=None):
+    '''Writes one header chunk the way file_meta_sink does for a float stream
+
+    Args:
+        handle: Binary file handle of the .hdr file
+        nitems: Number of samples in the segment
+        rx_rate: Sample rate of the segment
+        rx_time: Time of the first sample in seconds
+        extras: Dict of extra tags (name to PMT) for the segment
+    '''
+    extra = pmt.make_dict()
+    for key, value in sorted((extras or {}).items()):
+        extra = pmt.dict_add(extra, pmt.intern(key), value)
+    extra_str = pmt.serialize_str(extra) if extras else b''
+
+    header = pmt.make_dict()
+    header = pmt.dict_add(header, pmt.intern('version'), pmt.from_long(METADATA_VERSION))
+    header = pmt.dict_add(header, pmt.intern('rx_rate'), pmt.from_double(rx_rate))
+    header = pmt.dict_add(header, pmt.intern('rx_time'), pmt.make_tuple(pmt.from_uint64(int(rx_time)),
+                                                                         pmt.from_double(rx_time % 1)))
+    header = pmt.dict_add(header, pmt.intern('size'), pmt.from_long(p.BYTES_PER_FLOAT))
+    header = pmt.dict_add(header, pmt.intern('type'), pmt.from_long(GR_FILE_FLOAT))
+    header = pmt.dict_add(header, pmt.intern('cplx'), pmt.PMT_F)
+    header = pmt.dict_add(header, pmt.intern('strt'), pmt.from_uint64(parse_file_metadata.HEADER_LENGTH + len(extra_str)))
+    header = pmt.dict_add(header, pmt.intern('bytes'), pmt.from_uint64(nitems * p.BYTES_PER_FLOAT))
+
+    handle.write(pmt.serialize_str(header).ljust(parse_file_metadata.HEADER_LENGTH, b'\0'))
+    handle.write(extra_str)
+
+def write_capture(data_file, minutes, header=True, **options):
+    '''Writes a synthetic capture, and optionally its detached header
+
+    The header has a segment of noise before the first line and then one
+    segment per line, tagged SyncA when its sync made it through.
+
+    Args:
+        data_file: Path of the .dat file to write
+        minutes: Length of the pass in minutes
+        header: Also write <data_file>.hdr
+        options: Passed on to synthesize_apt
+
+    Returns:
+        The (samples, line_starts, synced) tuple from synthesize_apt.
+    '''
+    samples, line_starts, synced = synthesize_apt(minutes, **options)
+    samples.tofile(data_file)
+
+    if header:
+        boundaries = np.concatenate(([0], np.rint(line_starts).astype(np.int64), [len(samples)]))
+        tagged = np.concatenate(([False], synced))
+        with open(data_file + '.hdr', 'wb') as handle:
+            for start, end, sync in zip(boundaries[:-1], boundaries[1:], tagged):
+                extras = {'SyncA': pmt.PMT_T} if sync else None
+                write_gnuradio_header(handle, int(end - start), float(p.SAMPLE_RATE), start / p.SAMPLE_RATE, extras)
+
+    return samples, line_starts, synced
+
+def write_recording(iq_file, minutes, processing_rate=256000, deviation=17000, subcarrier=2400, **options):
+    '''Writes a synthetic pass as the complex IQ recording apt_replay reads
+
+    The capture amplitude modulates the APT subcarrier, which frequency
+    modulates a carrier at 0 Hz, as the satellite transmits it. The
+    recording is built a second at a time so long passes fit in memory.
+
+    Args:
+        iq_file: Path of the complex64 recording to write
+        minutes: Length of the pass in minutes
+        processing_rate: Sample rate of the recording
+        deviation: FM deviation in Hz of a full scale subcarrier
+        subcarrier: AM subcarrier frequency in Hz
+        options: Passed on to synthesize_apt
+
+    Returns:
+        The (samples, line_starts, synced) tuple from synthesize_apt.
+    '''
+    samples, line_starts, synced = synthesize_apt(minutes, **options)
+    envelope = np.clip(samples, 0.0, 1.0)
+    length = int(len(samples) * processing_rate / p.SAMPLE_RATE)
+
+    phase = 0.0
+    with open(iq_file, 'wb') as handle:
+        for start in range(0, length, processing_rate):
+            times = np.arange(start, min(start + processing_rate, length)) / processing_rate
+            modulation = np.interp(times * p.SAMPLE_RATE, np.arange(len(envelope)), envelope) * np.cos(2 * np.pi * subcarrier * times)
+            phases = phase + 2 * np.pi * deviation * np.cumsum(modulation) / processing_rate
+            phase = phases[-1]
+            np.exp(1j * phases).astype(np.complex64).tofile(handle)
+
+    return samples, line_starts, synced
+
+################################################################################
+# Define some constants
+################################################################################
+METADATA_VERSION = 0
+GR_FILE_FLOAT = 5
+
+################################################################################
+# Command Line
+################################################################################
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic APT capture')
+    parser.add_argument('output_file', help='Capture (.dat) file to write')
+    parser.add_argument('minutes', type=float, help='Length of the pass in minutes')
+    parser.add_argument('--noise', type=float, default=0.05, help='Noise standard deviation (full scale is 0.8)')
+    parser.add_argument('--drift', type=float, default=0.0, help='Sample clock error in ppm')
+    parser.add_argument('--dropouts', type=int, default=0, help='Number of 1-10 s signal dropouts')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--no-header', action='store_true', default=False, help='Do not write a detached header')
+    args = parser.parse_args()
+
+    write_capture(args.output_file, args.minutes, header=not args.no_header, noise=args.noise,
+                  drift_ppm=args.drift, dropouts=args.dropouts, seed=args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''CPU cost of the apt_replay front end decimation chains
+
+Needs GNU Radio 3.7 and the apt_am_demod hier block generated from
+grc_files/apt_am_demod.grc, and is skipped without them. Run from the top
+of the repository with:
+    python -m pytest benchmarks/test_replay.py
+Both chains demodulate the same synthetic one minute IQ recording. The
+flowgraph runs on its own threads, so besides the wall time each result
+saves the user plus system CPU time of the whole process per replay as
+extra_info cpu_s, and that over the wall time as cpu_percent, which are the
+comparison between the chains. Each replay is decoded to check the chain
+still demodulates rather than just running faster.
+'''
+from __future__ import division
+
+import os
+import pytest
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'grc_files'))
+
+apt_replay = pytest.importorskip('apt_replay')
+
+import p
+import synthetic
+
+################################################################################
+# Fixtures
+################################################################################
+@pytest.fixture(scope='session')
+def recording(tmpdir_factory):
+    iq_file = str(tmpdir_factory.mktemp('recording').join('n19_north_256k.dat'))
+    _, line_starts, _ = synthetic.write_recording(iq_file, RECORDING_MINUTES, processing_rate=PROCESSING_RATE, noise=0.05)
+    return {'iq_file': iq_file, 'lines': len(line_starts)}
+
+################################################################################
+# Benchmarks
+################################################################################
+@pytest.mark.parametrize('decimation_chain', ['fir', 'polyphase'])
+def test_replay(benchmark, recording, decimation_chain, tmpdir):
+    benchmark.group = 'replay flowgraph'
+    output_file = str(tmpdir.join('n19_north.dat'))
+    usage = []
+
+    def replay():
+        tb = apt_replay.apt_replay(input_file=recording['iq_file'], output_file=output_file,
+                                   processing_rate=PROCESSING_RATE, decimation_chain=decimation_chain)
+        start, start_wall = resource.getrusage(resource.RUSAGE_SELF), time.time()
+        tb.run()
+        end, end_wall = resource.getrusage(resource.RUSAGE_SELF), time.time()
+        usage.append(((end.ru_utime - start.ru_utime) + (end.ru_stime - start.ru_stime), end_wall - start_wall))
+
+    benchmark.pedantic(replay, rounds=3)
+    cpu_s, wall_s = min(usage)
+    benchmark.extra_info['cpu_s'] = cpu_s
+    benchmark.extra_info['cpu_percent'] = 100 * cpu_s / wall_s
+
+    samples = p.load_samples(output_file)
+    assert abs(len(samples) / p.SAMPLE_RATE - RECORDING_MINUTES * 60) < 1
+    assert len(p.detect_syncs(samples)) >= 0.9 * recording['lines']
+
+################################################################################
+# Define some constants
+################################################################################
+PROCESSING_RATE = 256000
+RECORDING_MINUTES = 1
@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''The apt_rx demodulator chain as a hier block, for the headless flowgraphs
+
+This module is maintained by hand, it is not generated by GRC. It holds
+the chain of apt_rx_rtl.grc from the Doppler translating filter to the
+apt_am_demod hier block, without any Qt sinks, so that apt_replay.py and
+apt_live.py run the same filters as apt_rx. A change to that chain in
+apt_rx_rtl.grc is made here as well.
+
+The input is complex IQ at the processing rate centred on the downlink, the
+output the 4160 samples/s float stream of apt_am_demod.
+'''
+
+import os
+import sys
+sys.path.append(os.environ.get('GRC_HIER_PATH', os.path.expanduser('~/.grc_gnuradio')))
+
+from apt_am_demod import apt_am_demod  # grc-generated hier_block
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import filter
+from gnuradio import gr
+from gnuradio.filter import firdes
+import math
+
+
+class apt_chain(gr.hier_block2):
+
+    def __init__(self, processing_rate=256000, decimation_chain='fir', max_doppler=3000, doppler_offset=0):
+        gr.hier_block2.__init__(
+            self, "APT Demodulator Chain",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex*1),
+            gr.io_signature(1, 1, gr.sizeof_float*1),
+        )
+
+        ##################################################
+        # Parameters
+        ##################################################
+        self.processing_rate = processing_rate
+        self.decimation_chain = decimation_chain
+        self.max_doppler = max_doppler
+        self.doppler_offset = doppler_offset
+
+        ##################################################
+        # Variables
+        ##################################################
+        self.fsk_deviation_hz = fsk_deviation_hz = 17000
+        self.am_carrier = am_carrier = 2400
+        self.rail_level = rail_level = 0.5
+        self.fm_bandwidth = fm_bandwidth = (2 * (fsk_deviation_hz + am_carrier)) + max_doppler
+        self.demod_rate = demod_rate = processing_rate // (4 if decimation_chain == 'polyphase' else 2)
+        self.channel_decimation = channel_decimation = 2 if decimation_chain == 'polyphase' else 1
+        self.front_end_taps = front_end_taps = firdes.low_pass(1, processing_rate, processing_rate / 4, processing_rate / 4, firdes.WIN_HAMMING, 6.76) if decimation_chain == 'polyphase' else firdes.low_pass(1, processing_rate, 60e3, 15e3, firdes.WIN_HAMMING, 6.76)
+        self.channel_taps = channel_taps = firdes.low_pass(1, processing_rate // 2, (fm_bandwidth / 2) + 5e3, 10e3, firdes.WIN_HAMMING, 6.76) if decimation_chain == 'polyphase' else firdes.low_pass(1, processing_rate // 2, fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76)
+
+        ##################################################
+        # Blocks
+        ##################################################
+        self.low_pass_filter_0_0 = filter.fir_filter_ccf(channel_decimation, channel_taps)
+        self.freq_xlating_fir_filter_xxx_0 = filter.freq_xlating_fir_filter_ccf(2, front_end_taps, doppler_offset, processing_rate)
+        self.blocks_float_to_complex_0 = blocks.float_to_complex(1)
+        self.blocks_complex_to_float_0 = blocks.complex_to_float(1)
+        self.apt_am_demod_0 = apt_am_demod(
+            parameter_apt_gain=1,
+            parameter_samp_rate=demod_rate,
+        )
+        self.analog_rail_ff_0_0 = analog.rail_ff(-rail_level, rail_level)
+        self.analog_rail_ff_0 = analog.rail_ff(-rail_level, rail_level)
+        self.analog_quadrature_demod_cf_0 = analog.quadrature_demod_cf(demod_rate/(2*math.pi*fsk_deviation_hz/8.0))
+        self.analog_agc3_xx_0 = analog.agc3_cc(0.25, 0.5, 0.9, 1.0, 1)
+        self.analog_agc3_xx_0.set_max_gain(1)
+
+        ##################################################
+        # Connections
+        ##################################################
+        self.connect((self, 0), (self.freq_xlating_fir_filter_xxx_0, 0))
+        self.connect((self.analog_agc3_xx_0, 0), (self.blocks_complex_to_float_0, 0))
+        self.connect((self.analog_quadrature_demod_cf_0, 0), (self.apt_am_demod_0, 0))
+        self.connect((self.analog_rail_ff_0, 0), (self.blocks_float_to_complex_0, 0))
+        self.connect((self.analog_rail_ff_0_0, 0), (self.blocks_float_to_complex_0, 1))
+        self.connect((self.apt_am_demod_0, 0), (self, 0))
+        self.connect((self.blocks_complex_to_float_0, 0), (self.analog_rail_ff_0, 0))
+        self.connect((self.blocks_complex_to_float_0, 1), (self.analog_rail_ff_0_0, 0))
+        self.connect((self.blocks_float_to_complex_0, 0), (self.low_pass_filter_0_0, 0))
+        self.connect((self.freq_xlating_fir_filter_xxx_0, 0), (self.analog_agc3_xx_0, 0))
+        self.connect((self.low_pass_filter_0_0, 0), (self.analog_quadrature_demod_cf_0, 0))
+
+    def get_processing_rate(self):
+        return self.processing_rate
+
+    def get_decimation_chain(self):
+        return self.decimation_chain
+
+    def get_max_doppler(self):
+        return self.max_doppler
+
+    def get_demod_rate(self):
+        return self.demod_rate
+
+    def get_doppler_offset(self):
+        return self.doppler_offset
+
+    def set_doppler_offset(self, doppler_offset):
+        self.doppler_offset = doppler_offset
+        self.freq_xlating_fir_filter_xxx_0.set_center_freq(self.doppler_offset)
+
+    def samples_read(self):
+        '''Number of input samples the chain has consumed, its position in the recording'''
+        return self.freq_xlating_fir_filter_xxx_0.nitems_read(0)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''NOAA APT live receiver, the apt_rx demodulator fed from an RTL-SDR
+
+This script is maintained by hand, it is not generated by GRC. It runs the
+shared demodulator chain of apt_chain.py with no Qt sinks, for unattended
+captures started by scheduler.py.
+
+Usage:
+    python2 apt_live.py -s NOAA-19 -g 49.6 -o noaa19_north_20160331_1326.dat [-c polyphase]
+        [-t weather.txt --station-lat 38.9 --station-lon -77.0]
+
+The tuner sits a quarter of the RTL-SDR sample rate below the downlink to
+keep the DC spike out of the channel, and a translating filter brings the
+downlink to 0 Hz at the processing rate the chain expects. With a TLE file
+the Doppler shift is tracked from the wall clock, which is the sample clock
+for a live source. The output is the 4160 samples/s float stream and
+detached SyncA tagged header that p.py decodes. The flowgraph runs until it
+is interrupted or terminated, and closes the capture first.
+'''
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apt_chain import apt_chain
+from gnuradio import blocks
+from gnuradio import eng_notation
+from gnuradio import filter
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from gnuradio.filter import firdes
+from optparse import OptionParser
+import orbit
+import osmosdr
+import signal
+import threading
+import time
+
+# R820T tuner gains in dB, the steps osmosdr sets on an RTL-SDR
+VALID_GAINS = [0.0, 0.9, 1.4, 2.7, 3.7, 7.7, 8.7, 12.5, 14.4, 15.7, 16.6, 19.7, 20.7, 22.9, 25.4, 28.0, 29.7, 32.8, 33.8, 36.4, 37.2, 38.6, 40.2, 42.1, 43.4, 43.9, 44.5, 48.0, 49.6]
+
+
+class apt_live(gr.top_block):
+
+    def __init__(self, output_file='capture.dat', satellite_name='NOAA-19', rf_gain=49.6, ppm_correction=0.0, decimation_chain='fir',
+                 tle_file='', station_lat=0.0, station_lon=0.0, station_alt=0.0):
+        gr.top_block.__init__(self, "NOAA APT Live Receiver")
+
+        ##################################################
+        # Parameters
+        ##################################################
+        self.output_file = output_file
+        self.satellite_name = satellite_name
+        self.rf_gain = rf_gain
+        self.ppm_correction = ppm_correction
+        self.decimation_chain = decimation_chain
+        self.tle_file = tle_file
+        self.station_lat = station_lat
+        self.station_lon = station_lon
+        self.station_alt = station_alt
+
+        ##################################################
+        # Variables
+        ##################################################
+        self.doppler_predictor = doppler_predictor = orbit.doppler_predictor(tle_file, satellite_name, station_lat, station_lon, station_alt) if tle_file else None
+        self.doppler_offset = doppler_offset = doppler_predictor(time.time()) if tle_file else 0
+        self.satellite_frequency = satellite_frequency = orbit.APT_FREQUENCIES[satellite_name]
+        self.rf_samp_rate = rf_samp_rate = 2.048e6
+        self.tuner_frequency = tuner_frequency = satellite_frequency - (rf_samp_rate / 4)
+        self.processing_rate = processing_rate = 256000
+        self.max_doppler = max_doppler = 500 if tle_file else 3000
+        self.baud_rate = baud_rate = 4160
+
+        ##################################################
+        # Blocks
+        ##################################################
+        self.rtlsdr_source_0 = osmosdr.source( args="numchan=" + str(1) + " " + '' )
+        self.rtlsdr_source_0.set_sample_rate(rf_samp_rate)
+        self.rtlsdr_source_0.set_center_freq(tuner_frequency, 0)
+        self.rtlsdr_source_0.set_freq_corr(ppm_correction, 0)
+        self.rtlsdr_source_0.set_dc_offset_mode(0, 0)
+        self.rtlsdr_source_0.set_iq_balance_mode(0, 0)
+        self.rtlsdr_source_0.set_gain_mode(False, 0)
+        self.rtlsdr_source_0.set_gain(rf_gain, 0)
+        self.rtlsdr_source_0.set_if_gain(0, 0)
+        self.rtlsdr_source_0.set_bb_gain(0, 0)
+        self.rtlsdr_source_0.set_antenna('', 0)
+        self.rtlsdr_source_0.set_bandwidth(0, 0)
+        self.freq_xlating_fir_filter_xxx_0 = filter.freq_xlating_fir_filter_ccf(int(rf_samp_rate // processing_rate), firdes.low_pass(1, rf_samp_rate, (processing_rate // 2), (processing_rate // 4)), satellite_frequency - tuner_frequency, rf_samp_rate)
+        self.blocks_file_meta_sink_0 = blocks.file_meta_sink(gr.sizeof_float*1, output_file, baud_rate, 1, blocks.GR_FILE_FLOAT, False, baud_rate * (60 * 20), "", True)
+        self.blocks_file_meta_sink_0.set_unbuffered(False)
+        self.apt_chain_0 = apt_chain(
+            processing_rate=processing_rate,
+            decimation_chain=decimation_chain,
+            max_doppler=max_doppler,
+            doppler_offset=doppler_offset,
+        )
+
+        ##################################################
+        # Connections
+        ##################################################
+        self.connect((self.apt_chain_0, 0), (self.blocks_file_meta_sink_0, 0))
+        self.connect((self.freq_xlating_fir_filter_xxx_0, 0), (self.apt_chain_0, 0))
+        self.connect((self.rtlsdr_source_0, 0), (self.freq_xlating_fir_filter_xxx_0, 0))
+
+        ##################################################
+        # Doppler tracking
+        ##################################################
+        def _doppler_offset_probe():
+            while True:
+                self.set_doppler_offset(self.doppler_predictor(time.time()))
+                time.sleep(1.0 / (10))
+        if tle_file:
+            _doppler_offset_thread = threading.Thread(target=_doppler_offset_probe)
+            _doppler_offset_thread.daemon = True
+            _doppler_offset_thread.start()
+
+    def get_output_file(self):
+        return self.output_file
+
+    def get_satellite_name(self):
+        return self.satellite_name
+
+    def get_rf_gain(self):
+        return self.rf_gain
+
+    def set_rf_gain(self, rf_gain):
+        self.rf_gain = rf_gain
+        self.rtlsdr_source_0.set_gain(self.rf_gain, 0)
+
+    def get_decimation_chain(self):
+        return self.decimation_chain
+
+    def get_tle_file(self):
+        return self.tle_file
+
+    def get_doppler_offset(self):
+        return self.doppler_offset
+
+    def set_doppler_offset(self, doppler_offset):
+        self.doppler_offset = doppler_offset
+        self.apt_chain_0.set_doppler_offset(self.doppler_offset)
+
+
+def argument_parser():
+    parser = OptionParser(usage="%prog: [options]", option_class=eng_option)
+    parser.add_option(
+        "-o", "--output-file", dest="output_file", type="string", default='capture.dat',
+        help="Set demodulated APT output file, with a detached .hdr [default=%default]")
+    parser.add_option(
+        "-s", "--satellite-name", dest="satellite_name", type="choice", choices=sorted(orbit.APT_FREQUENCIES), default='NOAA-19',
+        help="Set satellite to receive [default=%default]")
+    parser.add_option(
+        "-g", "--rf-gain", dest="rf_gain", type="choice", choices=[str(gain) for gain in VALID_GAINS], default='49.6',
+        help="Set RF gain in dB, one of the tuner's gain steps [default=%default]")
+    parser.add_option(
+        "-p", "--ppm-correction", dest="ppm_correction", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set RTL-SDR frequency correction in ppm [default=%default]")
+    parser.add_option(
+        "-c", "--decimation-chain", dest="decimation_chain", type="choice", choices=['fir', 'polyphase'], default='fir',
+        help="Set front end filters: 'fir' (one decimate by 2 stage) or 'polyphase' (two decimate by 2 stages with wide transition bands) [default=%default]")
+    parser.add_option(
+        "-t", "--tle-file", dest="tle_file", type="string", default='',
+        help="Set TLE file to track Doppler from, narrowing the FM filter (none to tune once) [default=%default]")
+    parser.add_option(
+        "", "--station-lat", dest="station_lat", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set station latitude in degrees [default=%default]")
+    parser.add_option(
+        "", "--station-lon", dest="station_lon", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set station longitude in degrees (east positive) [default=%default]")
+    parser.add_option(
+        "", "--station-alt", dest="station_alt", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set station altitude in metres [default=%default]")
+    return parser
+
+
+def main(top_block_cls=apt_live, options=None):
+    if options is None:
+        options, _ = argument_parser().parse_args()
+
+    tb = top_block_cls(output_file=options.output_file, satellite_name=options.satellite_name, rf_gain=float(options.rf_gain),
+                       ppm_correction=options.ppm_correction, decimation_chain=options.decimation_chain, tle_file=options.tle_file,
+                       station_lat=options.station_lat, station_lon=options.station_lon, station_alt=options.station_alt)
+
+    def sig_handler(sig=None, frame=None):
+        tb.stop()
+        tb.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+
+    tb.start()
+    while True:
+        signal.pause()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''NOAA APT offline replay, the apt_rx demodulator for IQ recordings
+
+This script is maintained by hand, it is not generated by GRC. It runs the
+shared demodulator chain of apt_chain.py without the throttle or any Qt
+sinks, re-demodulating an IQ recording as fast as the CPU allows.
+
+Usage:
+    python2 apt_replay.py -i noaa-19_256k.dat -o n19_north.dat [-c polyphase]
+        [-t weather.txt -s NOAA-19 --station-lat 38.9 --station-lon -77.0]
+
+The output is the 4160 samples/s float stream and detached SyncA tagged
+header that p.py decodes, the same as apt_rx writes live. The CPU cost of
+the two front end decimation chains is compared on this flowgraph by
+benchmarks/test_replay.py. With a TLE file the Doppler shift is tracked
+from the recording's own timeline (its start time plus the samples read so
+far), so the correction follows the pass however fast it replays.
+'''
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apt_chain import apt_chain
+from gnuradio import blocks
+from gnuradio import eng_notation
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import orbit
+import threading
+import time
+
+
+class apt_replay(gr.top_block):
+
+    def __init__(self, input_file='capture_256k.dat', output_file='capture.dat', processing_rate=256000, decimation_chain='fir',
+                 tle_file='', satellite_name='NOAA-19', station_lat=0.0, station_lon=0.0, station_alt=0.0, start_time=0.0):
+        gr.top_block.__init__(self, "NOAA APT Offline Replay")
+
+        ##################################################
+        # Parameters
+        ##################################################
+        self.input_file = input_file
+        self.output_file = output_file
+        self.processing_rate = processing_rate
+        self.decimation_chain = decimation_chain
+        self.tle_file = tle_file
+        self.satellite_name = satellite_name
+        self.station_lat = station_lat
+        self.station_lon = station_lon
+        self.station_alt = station_alt
+        self.start_time = start_time
+
+        ##################################################
+        # Variables
+        ##################################################
+        self.doppler_predictor = doppler_predictor = orbit.doppler_predictor(tle_file, satellite_name, station_lat, station_lon, station_alt) if tle_file else None
+        self.doppler_offset = doppler_offset = doppler_predictor(start_time) if tle_file else 0
+        self.max_doppler = max_doppler = 500 if tle_file else 3000
+        self.baud_rate = baud_rate = 4160
+
+        ##################################################
+        # Blocks
+        ##################################################
+        self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, input_file, False)
+        self.blocks_file_meta_sink_0 = blocks.file_meta_sink(gr.sizeof_float*1, output_file, baud_rate, 1, blocks.GR_FILE_FLOAT, False, baud_rate * (60 * 20), "", True)
+        self.blocks_file_meta_sink_0.set_unbuffered(False)
+        self.apt_chain_0 = apt_chain(
+            processing_rate=processing_rate,
+            decimation_chain=decimation_chain,
+            max_doppler=max_doppler,
+            doppler_offset=doppler_offset,
+        )
+
+        ##################################################
+        # Connections
+        ##################################################
+        self.connect((self.apt_chain_0, 0), (self.blocks_file_meta_sink_0, 0))
+        self.connect((self.blocks_file_source_0, 0), (self.apt_chain_0, 0))
+
+        ##################################################
+        # Doppler tracking
+        ##################################################
+        def _doppler_offset_probe():
+            while True:
+                position = self.apt_chain_0.samples_read() / float(processing_rate)
+                self.set_doppler_offset(self.doppler_predictor(start_time + position))
+                time.sleep(1.0 / (100))
+        if tle_file:
+            _doppler_offset_thread = threading.Thread(target=_doppler_offset_probe)
+            _doppler_offset_thread.daemon = True
+            _doppler_offset_thread.start()
+
+    def get_input_file(self):
+        return self.input_file
+
+    def get_output_file(self):
+        return self.output_file
+
+    def get_processing_rate(self):
+        return self.processing_rate
+
+    def get_decimation_chain(self):
+        return self.decimation_chain
+
+    def get_tle_file(self):
+        return self.tle_file
+
+    def get_satellite_name(self):
+        return self.satellite_name
+
+    def get_start_time(self):
+        return self.start_time
+
+    def get_doppler_offset(self):
+        return self.doppler_offset
+
+    def set_doppler_offset(self, doppler_offset):
+        self.doppler_offset = doppler_offset
+        self.apt_chain_0.set_doppler_offset(self.doppler_offset)
+
+
+def argument_parser():
+    parser = OptionParser(usage="%prog: [options]", option_class=eng_option)
+    parser.add_option(
+        "-i", "--input-file", dest="input_file", type="string", default='capture_256k.dat',
+        help="Set complex IQ recording to replay [default=%default]")
+    parser.add_option(
+        "-o", "--output-file", dest="output_file", type="string", default='capture.dat',
+        help="Set demodulated APT output file, with a detached .hdr [default=%default]")
+    parser.add_option(
+        "-r", "--processing-rate", dest="processing_rate", type="eng_float", default=eng_notation.num_to_str(256000),
+        help="Set sample rate of the recording [default=%default]")
+    parser.add_option(
+        "-c", "--decimation-chain", dest="decimation_chain", type="choice", choices=['fir', 'polyphase'], default='fir',
+        help="Set front end filters: 'fir' (one decimate by 2 stage) or 'polyphase' (two decimate by 2 stages with wide transition bands) [default=%default]")
+    parser.add_option(
+        "-t", "--tle-file", dest="tle_file", type="string", default='',
+        help="Set TLE file to track Doppler from, narrowing the FM filter (none for no tracking) [default=%default]")
+    parser.add_option(
+        "-s", "--satellite-name", dest="satellite_name", type="choice", choices=sorted(orbit.APT_FREQUENCIES), default='NOAA-19',
+        help="Set satellite recorded [default=%default]")
+    parser.add_option(
+        "", "--station-lat", dest="station_lat", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set station latitude in degrees [default=%default]")
+    parser.add_option(
+        "", "--station-lon", dest="station_lon", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set station longitude in degrees (east positive) [default=%default]")
+    parser.add_option(
+        "", "--station-alt", dest="station_alt", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set station altitude in metres [default=%default]")
+    parser.add_option(
+        "", "--start-time", dest="start_time", type="string", default='',
+        help="Set UTC start of the recording as YYYY-MM-DDTHH:MM:SS (default: its modification time less its length)")
+    return parser
+
+
+def main(top_block_cls=apt_replay, options=None):
+    if options is None:
+        options, _ = argument_parser().parse_args()
+    if not os.path.isfile(options.input_file):
+        sys.stderr.write('Recording {} not found\n'.format(options.input_file))
+        sys.exit(1)
+
+    recording = os.path.getsize(options.input_file) / (gr.sizeof_gr_complex * options.processing_rate)
+    start_time = orbit.recording_start(options.input_file, options.processing_rate, options.start_time, gr.sizeof_gr_complex)
+
+    tb = top_block_cls(input_file=options.input_file, output_file=options.output_file,
+                       processing_rate=int(options.processing_rate), decimation_chain=options.decimation_chain,
+                       tle_file=options.tle_file, satellite_name=options.satellite_name, station_lat=options.station_lat,
+                       station_lon=options.station_lon, station_alt=options.station_alt, start_time=start_time)
+    start = time.time()
+    tb.start()
+    tb.wait()
+
+    elapsed = time.time() - start
+    print 'Replayed {:.0f} s of recording in {:.1f} s ({:.0f}x real time)'.format(
+        recording, elapsed, recording / max(elapsed, 1e-6))
+
+
+if __name__ == '__main__':
+    main()
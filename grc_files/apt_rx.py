@@ -4,6 +4,7 @@
 # GNU Radio Python Flow Graph
 # Title: NOAA APT Satellite Receiver
 # Author: Brian McLaughlin
+# Description: Run with the repository on PYTHONPATH so the Doppler variables can import orbit.py
 # Generated: Thu Mar 31 13:26:49 2016
 ##################################################
 import threading
@@ -36,12 +37,14 @@ from gnuradio.eng_option import eng_option
 from gnuradio.filter import firdes
 from optparse import OptionParser
 import math
+import orbit
 import sip
+import time
 
 
 class apt_rx(gr.top_block, Qt.QWidget):
 
-    def __init__(self):
+    def __init__(self, decimation_chain='fir', input_file="/Users/bjmclaug/Downloads/noaa-12_256k.dat", output_file="/Users/bjmclaug/source/stem_station/noaa12_sample.dat", start_time='', station_alt=0.0, station_lat=0.0, station_lon=0.0, tle_file=''):
         gr.top_block.__init__(self, "NOAA APT Satellite Receiver")
         Qt.QWidget.__init__(self)
         self.setWindowTitle("NOAA APT Satellite Receiver")
@@ -66,22 +69,43 @@ class apt_rx(gr.top_block, Qt.QWidget):
 
         self._lock = threading.RLock()
 
+        ##################################################
+        # Parameters
+        ##################################################
+        self.decimation_chain = decimation_chain
+        self.input_file = input_file
+        self.output_file = output_file
+        self.start_time = start_time
+        self.station_alt = station_alt
+        self.station_lat = station_lat
+        self.station_lon = station_lon
+        self.tle_file = tle_file
+
         ##################################################
         # Variables
         ##################################################
         self.satellite_select = satellite_select = 137.62
+        self.processing_rate = processing_rate = 256000
+        self.satellite_name = satellite_name = {137.62: 'NOAA-15', 137.9125: 'NOAA-18', 137.1: 'NOAA-19'}[satellite_select]
+        self.doppler_predictor = doppler_predictor = orbit.doppler_predictor(tle_file, satellite_name, station_lat, station_lon, station_alt) if tle_file else None
+        self.recording_start = recording_start = orbit.recording_start(input_file, processing_rate, start_time) if tle_file else 0
+        self.elapsed_samples = elapsed_samples = 0
+        self.doppler_offset = doppler_offset = doppler_predictor(recording_start + elapsed_samples / float(processing_rate)) if tle_file else 0
         self.valid_gains = valid_gains = [0.0, 0.9, 1.4, 2.7, 3.7, 7.7, 8.7, 12.5, 14.4, 15.7, 16.6, 19.7, 20.7, 22.9, 25.4, 28.0, 29.7, 32.8, 33.8, 36.4, 37.2, 38.6, 40.2, 42.1, 43.4, 43.9, 44.5, 48.0, 49.6]
         self.satellite_frequency = satellite_frequency = satellite_select * 1e6
         self.rf_samp_rate = rf_samp_rate = 2.048e6
-        self.max_doppler = max_doppler = 3000
+        self.max_doppler = max_doppler = 500 if tle_file else 3000
         self.fsk_deviation_hz = fsk_deviation_hz = 17000
         self.am_carrier = am_carrier = 2400
         self.tuner_frequency = tuner_frequency = satellite_frequency - (rf_samp_rate / 4)
         self.rf_gain = rf_gain = valid_gains[-1]
         self.rail_level = rail_level = 0.5
-        self.processing_rate = processing_rate = 256000
         self.fm_bandwidth = fm_bandwidth = (2 * (fsk_deviation_hz + am_carrier)) + max_doppler
         self.baud_rate = baud_rate = 4160
+        self.demod_rate = demod_rate = processing_rate // (4 if decimation_chain == 'polyphase' else 2)
+        self.channel_decimation = channel_decimation = 2 if decimation_chain == 'polyphase' else 1
+        self.front_end_taps = front_end_taps = firdes.low_pass(1, processing_rate, processing_rate / 4, processing_rate / 4, firdes.WIN_HAMMING, 6.76) if decimation_chain == 'polyphase' else firdes.low_pass(1, processing_rate, 60e3, 15e3, firdes.WIN_HAMMING, 6.76)
+        self.channel_taps = channel_taps = firdes.low_pass(1, processing_rate // 2, (fm_bandwidth / 2) + 5e3, 10e3, firdes.WIN_HAMMING, 6.76) if decimation_chain == 'polyphase' else firdes.low_pass(1, processing_rate // 2, fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76)
 
         ##################################################
         # Blocks
@@ -160,7 +184,7 @@ class apt_rx(gr.top_block, Qt.QWidget):
         	1024, #size
         	firdes.WIN_BLACKMAN_hARRIS, #wintype
         	satellite_frequency, #fc
-        	processing_rate // 2, #bw
+        	demod_rate, #bw
         	"", #name
                 1 #number of inputs
         )
@@ -239,7 +263,7 @@ class apt_rx(gr.top_block, Qt.QWidget):
         self.tabs_apt_data_layout_0.addWidget(self._qtgui_time_sink_x_0_0_win)
         self.qtgui_time_sink_x_0 = qtgui.time_sink_c(
         	1024, #size
-        	processing_rate // 2, #samp_rate
+        	demod_rate, #samp_rate
         	"", #name
         	1 #number of inputs
         )
@@ -398,23 +422,34 @@ class apt_rx(gr.top_block, Qt.QWidget):
         
         self._qtgui_freq_sink_x_1_win = sip.wrapinstance(self.qtgui_freq_sink_x_1.pyqwidget(), Qt.QWidget)
         self.tabs_rf_layout_0.addWidget(self._qtgui_freq_sink_x_1_win)
-        self.low_pass_filter_0_0 = filter.fir_filter_ccf(1, firdes.low_pass(
-        	1, processing_rate // 2, fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76))
-        self.low_pass_filter_0 = filter.fir_filter_ccf(2, firdes.low_pass(
-        	1, processing_rate, 60e3, 15e3, firdes.WIN_HAMMING, 6.76))
+        self.low_pass_filter_0_0 = filter.fir_filter_ccf(channel_decimation, channel_taps)
+        self.low_pass_filter_0_0.declare_sample_delay(0)
+        self.freq_xlating_fir_filter_xxx_1 = filter.freq_xlating_fir_filter_ccf(2, front_end_taps, doppler_offset, processing_rate)
+        
+        def _elapsed_samples_probe():
+            while True:
+                val = self.freq_xlating_fir_filter_xxx_1.nitems_read(0)
+                try:
+                    self.set_elapsed_samples(val)
+                except AttributeError:
+                    pass
+                time.sleep(1.0 / (1))
+        _elapsed_samples_thread = threading.Thread(target=_elapsed_samples_probe)
+        _elapsed_samples_thread.daemon = True
+        _elapsed_samples_thread.start()
         self.blocks_throttle_0 = blocks.throttle(gr.sizeof_gr_complex*1, processing_rate,True)
         self.blocks_float_to_complex_0 = blocks.float_to_complex(1)
-        self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, "/Users/bjmclaug/Downloads/noaa-12_256k.dat", False)
-        self.blocks_file_meta_sink_0 = blocks.file_meta_sink(gr.sizeof_float*1, "/Users/bjmclaug/source/stem_station/noaa12_sample.dat", baud_rate, 1, blocks.GR_FILE_FLOAT, False, baud_rate * (60 * 20), "", True)
+        self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, input_file, False)
+        self.blocks_file_meta_sink_0 = blocks.file_meta_sink(gr.sizeof_float*1, output_file, baud_rate, 1, blocks.GR_FILE_FLOAT, False, baud_rate * (60 * 20), "", True)
         self.blocks_file_meta_sink_0.set_unbuffered(False)
         self.blocks_complex_to_float_0 = blocks.complex_to_float(1)
         self.apt_am_demod_0 = apt_am_demod(
             parameter_apt_gain=1,
-            parameter_samp_rate=processing_rate / 2,
+            parameter_samp_rate=demod_rate,
         )
         self.analog_rail_ff_0_0 = analog.rail_ff(-rail_level, rail_level)
         self.analog_rail_ff_0 = analog.rail_ff(-rail_level, rail_level)
-        self.analog_quadrature_demod_cf_0 = analog.quadrature_demod_cf((processing_rate // 2)/(2*math.pi*fsk_deviation_hz/8.0))
+        self.analog_quadrature_demod_cf_0 = analog.quadrature_demod_cf(demod_rate/(2*math.pi*fsk_deviation_hz/8.0))
         self.analog_agc3_xx_0 = analog.agc3_cc(0.25, 0.5, 0.9, 1.0, 1)
         self.analog_agc3_xx_0.set_max_gain(1)
 
@@ -432,9 +467,9 @@ class apt_rx(gr.top_block, Qt.QWidget):
         self.connect((self.blocks_complex_to_float_0, 1), (self.analog_rail_ff_0_0, 0))    
         self.connect((self.blocks_file_source_0, 0), (self.blocks_throttle_0, 0))    
         self.connect((self.blocks_float_to_complex_0, 0), (self.low_pass_filter_0_0, 0))    
-        self.connect((self.blocks_throttle_0, 0), (self.low_pass_filter_0, 0))    
-        self.connect((self.low_pass_filter_0, 0), (self.analog_agc3_xx_0, 0))    
-        self.connect((self.low_pass_filter_0, 0), (self.qtgui_freq_sink_x_1, 0))    
+        self.connect((self.blocks_throttle_0, 0), (self.freq_xlating_fir_filter_xxx_1, 0))    
+        self.connect((self.freq_xlating_fir_filter_xxx_1, 0), (self.analog_agc3_xx_0, 0))    
+        self.connect((self.freq_xlating_fir_filter_xxx_1, 0), (self.qtgui_freq_sink_x_1, 0))    
         self.connect((self.low_pass_filter_0_0, 0), (self.analog_quadrature_demod_cf_0, 0))    
         self.connect((self.low_pass_filter_0_0, 0), (self.qtgui_freq_sink_x_1, 1))    
         self.connect((self.low_pass_filter_0_0, 0), (self.qtgui_time_sink_x_0, 0))    
@@ -452,9 +487,50 @@ class apt_rx(gr.top_block, Qt.QWidget):
     def set_satellite_select(self, satellite_select):
         with self._lock:
             self.satellite_select = satellite_select
+            self.set_satellite_name({137.62: 'NOAA-15', 137.9125: 'NOAA-18', 137.1: 'NOAA-19'}[self.satellite_select])
             self.set_satellite_frequency(self.satellite_select * 1e6)
             self._satellite_select_callback(self.satellite_select)
 
+    def get_satellite_name(self):
+        return self.satellite_name
+
+    def set_satellite_name(self, satellite_name):
+        with self._lock:
+            self.satellite_name = satellite_name
+            self.set_doppler_predictor(orbit.doppler_predictor(self.tle_file, self.satellite_name, self.station_lat, self.station_lon, self.station_alt) if self.tle_file else None)
+
+    def get_doppler_predictor(self):
+        return self.doppler_predictor
+
+    def set_doppler_predictor(self, doppler_predictor):
+        with self._lock:
+            self.doppler_predictor = doppler_predictor
+            self.set_doppler_offset(self.doppler_predictor(self.recording_start + self.elapsed_samples / float(self.processing_rate)) if self.tle_file else 0)
+
+    def get_recording_start(self):
+        return self.recording_start
+
+    def set_recording_start(self, recording_start):
+        with self._lock:
+            self.recording_start = recording_start
+            self.set_doppler_offset(self.doppler_predictor(self.recording_start + self.elapsed_samples / float(self.processing_rate)) if self.tle_file else 0)
+
+    def get_elapsed_samples(self):
+        return self.elapsed_samples
+
+    def set_elapsed_samples(self, elapsed_samples):
+        with self._lock:
+            self.elapsed_samples = elapsed_samples
+            self.set_doppler_offset(self.doppler_predictor(self.recording_start + self.elapsed_samples / float(self.processing_rate)) if self.tle_file else 0)
+
+    def get_doppler_offset(self):
+        return self.doppler_offset
+
+    def set_doppler_offset(self, doppler_offset):
+        with self._lock:
+            self.doppler_offset = doppler_offset
+            self.freq_xlating_fir_filter_xxx_1.set_center_freq(self.doppler_offset)
+
     def get_valid_gains(self):
         return self.valid_gains
 
@@ -471,7 +547,78 @@ class apt_rx(gr.top_block, Qt.QWidget):
             self.satellite_frequency = satellite_frequency
             self.set_tuner_frequency(self.satellite_frequency - (self.rf_samp_rate / 4))
             self.qtgui_freq_sink_x_1.set_frequency_range(self.satellite_frequency, self.processing_rate // 2)
-            self.qtgui_waterfall_sink_x_0.set_frequency_range(self.satellite_frequency, self.processing_rate // 2)
+            self.qtgui_waterfall_sink_x_0.set_frequency_range(self.satellite_frequency, self.demod_rate)
+
+    def get_decimation_chain(self):
+        return self.decimation_chain
+
+    def set_decimation_chain(self, decimation_chain):
+        with self._lock:
+            self.decimation_chain = decimation_chain
+            self.set_demod_rate(self.processing_rate // (4 if self.decimation_chain == 'polyphase' else 2))
+            self.set_channel_decimation(2 if self.decimation_chain == 'polyphase' else 1)
+            self.set_front_end_taps(firdes.low_pass(1, self.processing_rate, self.processing_rate / 4, self.processing_rate / 4, firdes.WIN_HAMMING, 6.76) if self.decimation_chain == 'polyphase' else firdes.low_pass(1, self.processing_rate, 60e3, 15e3, firdes.WIN_HAMMING, 6.76))
+            self.set_channel_taps(firdes.low_pass(1, self.processing_rate // 2, (self.fm_bandwidth / 2) + 5e3, 10e3, firdes.WIN_HAMMING, 6.76) if self.decimation_chain == 'polyphase' else firdes.low_pass(1, self.processing_rate // 2, self.fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76))
+
+    def get_input_file(self):
+        return self.input_file
+
+    def set_input_file(self, input_file):
+        with self._lock:
+            self.input_file = input_file
+            self.set_recording_start(orbit.recording_start(self.input_file, self.processing_rate, self.start_time) if self.tle_file else 0)
+            self.blocks_file_source_0.open(self.input_file, False)
+
+    def get_output_file(self):
+        return self.output_file
+
+    def set_output_file(self, output_file):
+        with self._lock:
+            self.output_file = output_file
+
+    def get_start_time(self):
+        return self.start_time
+
+    def set_start_time(self, start_time):
+        with self._lock:
+            self.start_time = start_time
+            self.set_recording_start(orbit.recording_start(self.input_file, self.processing_rate, self.start_time) if self.tle_file else 0)
+
+    def get_station_alt(self):
+        return self.station_alt
+
+    def set_station_alt(self, station_alt):
+        with self._lock:
+            self.station_alt = station_alt
+            self.set_doppler_predictor(orbit.doppler_predictor(self.tle_file, self.satellite_name, self.station_lat, self.station_lon, self.station_alt) if self.tle_file else None)
+
+    def get_station_lat(self):
+        return self.station_lat
+
+    def set_station_lat(self, station_lat):
+        with self._lock:
+            self.station_lat = station_lat
+            self.set_doppler_predictor(orbit.doppler_predictor(self.tle_file, self.satellite_name, self.station_lat, self.station_lon, self.station_alt) if self.tle_file else None)
+
+    def get_station_lon(self):
+        return self.station_lon
+
+    def set_station_lon(self, station_lon):
+        with self._lock:
+            self.station_lon = station_lon
+            self.set_doppler_predictor(orbit.doppler_predictor(self.tle_file, self.satellite_name, self.station_lat, self.station_lon, self.station_alt) if self.tle_file else None)
+
+    def get_tle_file(self):
+        return self.tle_file
+
+    def set_tle_file(self, tle_file):
+        with self._lock:
+            self.tle_file = tle_file
+            self.set_doppler_predictor(orbit.doppler_predictor(self.tle_file, self.satellite_name, self.station_lat, self.station_lon, self.station_alt) if self.tle_file else None)
+            self.set_recording_start(orbit.recording_start(self.input_file, self.processing_rate, self.start_time) if self.tle_file else 0)
+            self.set_doppler_offset(self.doppler_predictor(self.recording_start + self.elapsed_samples / float(self.processing_rate)) if self.tle_file else 0)
+            self.set_max_doppler(500 if self.tle_file else 3000)
+
 
     def get_rf_samp_rate(self):
         return self.rf_samp_rate
@@ -496,7 +643,7 @@ class apt_rx(gr.top_block, Qt.QWidget):
         with self._lock:
             self.fsk_deviation_hz = fsk_deviation_hz
             self.set_fm_bandwidth((2 * (self.fsk_deviation_hz + self.am_carrier)) + self.max_doppler)
-            self.analog_quadrature_demod_cf_0.set_gain((self.processing_rate // 2)/(2*math.pi*self.fsk_deviation_hz/8.0))
+            self.analog_quadrature_demod_cf_0.set_gain(self.demod_rate/(2*math.pi*self.fsk_deviation_hz/8.0))
 
     def get_am_carrier(self):
         return self.am_carrier
@@ -538,22 +685,55 @@ class apt_rx(gr.top_block, Qt.QWidget):
     def set_processing_rate(self, processing_rate):
         with self._lock:
             self.processing_rate = processing_rate
-            self.analog_quadrature_demod_cf_0.set_gain((self.processing_rate // 2)/(2*math.pi*self.fsk_deviation_hz/8.0))
-            self.low_pass_filter_0.set_taps(firdes.low_pass(1, self.processing_rate, 60e3, 15e3, firdes.WIN_HAMMING, 6.76))
-            self.low_pass_filter_0_0.set_taps(firdes.low_pass(1, self.processing_rate // 2, self.fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76))
+            self.set_recording_start(orbit.recording_start(self.input_file, self.processing_rate, self.start_time) if self.tle_file else 0)
+            self.set_doppler_offset(self.doppler_predictor(self.recording_start + self.elapsed_samples / float(self.processing_rate)) if self.tle_file else 0)
+            self.set_demod_rate(self.processing_rate // (4 if self.decimation_chain == 'polyphase' else 2))
+            self.set_front_end_taps(firdes.low_pass(1, self.processing_rate, self.processing_rate / 4, self.processing_rate / 4, firdes.WIN_HAMMING, 6.76) if self.decimation_chain == 'polyphase' else firdes.low_pass(1, self.processing_rate, 60e3, 15e3, firdes.WIN_HAMMING, 6.76))
+            self.set_channel_taps(firdes.low_pass(1, self.processing_rate // 2, (self.fm_bandwidth / 2) + 5e3, 10e3, firdes.WIN_HAMMING, 6.76) if self.decimation_chain == 'polyphase' else firdes.low_pass(1, self.processing_rate // 2, self.fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76))
             self.qtgui_freq_sink_x_1.set_frequency_range(self.satellite_frequency, self.processing_rate // 2)
-            self.qtgui_time_sink_x_0.set_samp_rate(self.processing_rate // 2)
-            self.qtgui_waterfall_sink_x_0.set_frequency_range(self.satellite_frequency, self.processing_rate // 2)
-            self.apt_am_demod_0.set_parameter_samp_rate(self.processing_rate / 2)
             self.blocks_throttle_0.set_sample_rate(self.processing_rate)
 
+    def get_demod_rate(self):
+        return self.demod_rate
+
+    def set_demod_rate(self, demod_rate):
+        with self._lock:
+            self.demod_rate = demod_rate
+            self.analog_quadrature_demod_cf_0.set_gain(self.demod_rate/(2*math.pi*self.fsk_deviation_hz/8.0))
+            self.qtgui_time_sink_x_0.set_samp_rate(self.demod_rate)
+            self.qtgui_waterfall_sink_x_0.set_frequency_range(self.satellite_frequency, self.demod_rate)
+            self.apt_am_demod_0.set_parameter_samp_rate(self.demod_rate)
+
+    def get_channel_decimation(self):
+        return self.channel_decimation
+
+    def set_channel_decimation(self, channel_decimation):
+        with self._lock:
+            self.channel_decimation = channel_decimation
+
+    def get_front_end_taps(self):
+        return self.front_end_taps
+
+    def set_front_end_taps(self, front_end_taps):
+        with self._lock:
+            self.front_end_taps = front_end_taps
+            self.freq_xlating_fir_filter_xxx_1.set_taps(self.front_end_taps)
+
+    def get_channel_taps(self):
+        return self.channel_taps
+
+    def set_channel_taps(self, channel_taps):
+        with self._lock:
+            self.channel_taps = channel_taps
+            self.low_pass_filter_0_0.set_taps(self.channel_taps)
+
     def get_fm_bandwidth(self):
         return self.fm_bandwidth
 
     def set_fm_bandwidth(self, fm_bandwidth):
         with self._lock:
             self.fm_bandwidth = fm_bandwidth
-            self.low_pass_filter_0_0.set_taps(firdes.low_pass(1, self.processing_rate // 2, self.fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76))
+            self.set_channel_taps(firdes.low_pass(1, self.processing_rate // 2, (self.fm_bandwidth / 2) + 5e3, 10e3, firdes.WIN_HAMMING, 6.76) if self.decimation_chain == 'polyphase' else firdes.low_pass(1, self.processing_rate // 2, self.fm_bandwidth + 1e3, 1e3, firdes.WIN_HAMMING, 6.76))
 
     def get_baud_rate(self):
         return self.baud_rate
@@ -565,7 +745,38 @@ class apt_rx(gr.top_block, Qt.QWidget):
             self.qtgui_time_raster_sink_x_0.set_num_cols(self.baud_rate // 2)
 
 
+def argument_parser():
+    parser = OptionParser(usage="%prog: [options]", option_class=eng_option)
+    parser.add_option(
+        "-c", "--decimation-chain", dest="decimation_chain", type="string", default='fir',
+        help="Set Decimation Chain [default=%default]")
+    parser.add_option(
+        "-i", "--input-file", dest="input_file", type="string", default="/Users/bjmclaug/Downloads/noaa-12_256k.dat",
+        help="Set Input File [default=%default]")
+    parser.add_option(
+        "-o", "--output-file", dest="output_file", type="string", default="/Users/bjmclaug/source/stem_station/noaa12_sample.dat",
+        help="Set Output File [default=%default]")
+    parser.add_option(
+        "", "--start-time", dest="start_time", type="string", default='',
+        help="Set Start Time [default=%default]")
+    parser.add_option(
+        "", "--station-alt", dest="station_alt", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set Station Altitude [default=%default]")
+    parser.add_option(
+        "", "--station-lat", dest="station_lat", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set Station Latitude [default=%default]")
+    parser.add_option(
+        "", "--station-lon", dest="station_lon", type="eng_float", default=eng_notation.num_to_str(0.0),
+        help="Set Station Longitude [default=%default]")
+    parser.add_option(
+        "-t", "--tle-file", dest="tle_file", type="string", default='',
+        help="Set TLE File [default=%default]")
+    return parser
+
+
 def main(top_block_cls=apt_rx, options=None):
+    if options is None:
+        options, _ = argument_parser().parse_args()
 
     from distutils.version import StrictVersion
     if StrictVersion(Qt.qVersion()) >= StrictVersion("4.5.0"):
@@ -573,7 +784,7 @@ def main(top_block_cls=apt_rx, options=None):
         Qt.QApplication.setGraphicsSystem(style)
     qapp = Qt.QApplication(sys.argv)
 
-    tb = top_block_cls()
+    tb = top_block_cls(decimation_chain=options.decimation_chain, input_file=options.input_file, output_file=options.output_file, start_time=options.start_time, station_alt=options.station_alt, station_lat=options.station_lat, station_lon=options.station_lon, tle_file=options.tle_file)
     tb.start()
     tb.show()
 
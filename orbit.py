@@ -0,0 +1,495 @@
+'''Orbit prediction for the APT satellites from two-line element sets
+
+Propagates TLEs with SGP4 (the optional sgp4 package, pip install sgp4)
+entirely offline and works out where a satellite is relative to the
+ground station: Doppler correction for the receive flowgraphs, pass
+windows and elevation profiles for the scheduler and sub-satellite
+tracks for georeferencing decoded images.
+
+Whole arrays of times are served from ephemerides: Earth fixed states on
+a one minute grid, computed with the vectorized SGP4 a UTC day at a time
+per TLE epoch, kept in memory and cached on disk (least recently used
+days are evicted), and interpolated to any time with cubic Hermite
+splines (well under a metre off SGP4 at LEO speeds).
+
+Usage:
+    python orbit.py weather.txt NOAA-19 --lat 38.9 --lon -77.0
+'''
+from __future__ import division
+
+import argparse
+import calendar
+import collections
+import datetime
+import numpy as np
+import os
+import os.path
+import re
+import time
+
+try:
+    from sgp4.api import Satrec, SGP4_ERRORS
+except ImportError:
+    Satrec = None
+
+################################################################################
+# Function Definitions
+################################################################################
+def normalize_name(name):
+    '''Reduces a satellite name to a key that ignores spacing and status flags
+
+    'NOAA 19 [+]', 'NOAA-19' and 'noaa19' all become 'NOAA19'.
+    '''
+    return re.sub(r'[^A-Z0-9]', '', re.sub(r'\[.*?\]', '', name.upper()))
+
+def load_tles(tle_file):
+    '''Reads a file of named (three line) TLEs, e.g. the Celestrak weather.txt
+
+    Args:
+        tle_file: Path of the TLE file
+
+    Returns:
+        A dict of normalized satellite name to its (line1, line2) tuple.
+    '''
+    with open(tle_file) as handle:
+        lines = [line.rstrip() for line in handle if line.strip()]
+
+    tles = {}
+    for index, line in enumerate(lines):
+        if line.startswith('1 ') and index + 1 < len(lines) and lines[index + 1].startswith('2 '):
+            name = lines[index - 1] if index and not lines[index - 1][:2] in ('1 ', '2 ') else line[2:7]
+            tles[normalize_name(name)] = (line, lines[index + 1])
+    return tles
+
+def satellite(tles, name):
+    '''Builds the SGP4 model of a satellite
+
+    Args:
+        tles: Dict from load_tles
+        name: Satellite name, e.g. 'NOAA-19'
+
+    Returns:
+        An sgp4 Satrec for the satellite.
+    '''
+    if Satrec is None:
+        raise ImportError('Orbit prediction needs the sgp4 package (pip install sgp4)')
+    key = normalize_name(name)
+    if key not in tles:
+        raise ValueError('No TLE for {} (have {})'.format(name, ', '.join(sorted(tles))))
+    return Satrec.twoline2rv(*tles[key])
+
+def julian_date(unix_time):
+    '''Splits a Unix time into the (whole, fraction) Julian date SGP4 takes'''
+    days = unix_time / SECONDS_PER_DAY
+    whole = np.floor(days)
+    return UNIX_EPOCH_JD + whole, days - whole
+
+def propagate(sat, unix_time):
+    '''Position and velocity of a satellite in the TEME frame
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        unix_time: Time in seconds since the Unix epoch (UTC)
+
+    Returns:
+        A (position, velocity) tuple of 3 element arrays in km and km/s.
+    '''
+    jd, fr = julian_date(unix_time)
+    error, position, velocity = sat.sgp4(jd, fr)
+    if error:
+        raise RuntimeError('SGP4 propagation failed: {}'.format(SGP4_ERRORS[error]))
+    return np.array(position), np.array(velocity)
+
+def gmst(jd, fr):
+    '''Greenwich mean sidereal time (IAU 1982) in radians'''
+    centuries = ((jd - 2451545.0) + fr) / 36525
+    seconds = (67310.54841 + (876600 * 3600 + 8640184.812866) * centuries
+               + 0.093104 * centuries ** 2 - 6.2e-6 * centuries ** 3)
+    return np.radians((seconds % SECONDS_PER_DAY) / 240)
+
+def teme_to_ecef(position, velocity, unix_time):
+    '''Rotates a TEME state into the Earth fixed frame
+
+    Polar motion is ignored, which is well below the accuracy of a TLE.
+
+    Args:
+        position: TEME position in km
+        velocity: TEME velocity in km/s
+        unix_time: Time of the state in seconds since the Unix epoch
+
+    Returns:
+        An Earth fixed (position, velocity) tuple in km and km/s.
+    '''
+    theta = gmst(*julian_date(unix_time))
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    x = cos_theta * position[0] + sin_theta * position[1]
+    y = -sin_theta * position[0] + cos_theta * position[1]
+    vx = cos_theta * velocity[0] + sin_theta * velocity[1] + EARTH_ROTATION * y
+    vy = -sin_theta * velocity[0] + cos_theta * velocity[1] - EARTH_ROTATION * x
+    return np.array([x, y, position[2]]), np.array([vx, vy, velocity[2]])
+
+def station_ecef(latitude, longitude, altitude=0.0):
+    '''Earth fixed position of a ground station on the WGS-84 ellipsoid
+
+    Args:
+        latitude: Geodetic latitude in degrees (north positive)
+        longitude: Longitude in degrees (east positive)
+        altitude: Height above the ellipsoid in metres
+
+    Returns:
+        A 3 element array in km.
+    '''
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    e2 = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+    radius = EARTH_RADIUS / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    height = altitude / 1000
+    return np.array([(radius + height) * np.cos(lat) * np.cos(lon),
+                     (radius + height) * np.cos(lat) * np.sin(lon),
+                     (radius * (1 - e2) + height) * np.sin(lat)])
+
+def range_rate(sat, station, unix_time):
+    '''Rate the distance from the station to the satellite is changing
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        station: Earth fixed station position from station_ecef
+        unix_time: Time in seconds since the Unix epoch
+
+    Returns:
+        The range rate in km/s, positive when the satellite is receding.
+    '''
+    position, velocity = teme_to_ecef(*propagate(sat, unix_time), unix_time=unix_time)
+    line_of_sight = position - station
+    return np.dot(line_of_sight, velocity) / np.linalg.norm(line_of_sight)
+
+def doppler_offset(sat, station, unix_time, frequency):
+    '''Doppler shift of a satellite downlink as heard at the station
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        station: Earth fixed station position from station_ecef
+        unix_time: Time in seconds since the Unix epoch
+        frequency: Transmitted frequency in Hz
+
+    Returns:
+        The received minus transmitted frequency in Hz, i.e. the offset to
+        tune to (or translate down from) to keep the signal centred.
+    '''
+    return -frequency * range_rate(sat, station, unix_time) / SPEED_OF_LIGHT
+
+def doppler_predictor(tle_file, spacecraft, latitude, longitude, altitude=0.0):
+    '''Builds a function giving the Doppler offset of an APT downlink
+
+    The TLEs are read once here, so the returned function only propagates
+    and is cheap enough to call many times a second from a flowgraph.
+
+    Args:
+        tle_file: File of named TLEs
+        spacecraft: Spacecraft to track, one of APT_FREQUENCIES
+        latitude: Station latitude in degrees (north positive)
+        longitude: Station longitude in degrees (east positive)
+        altitude: Station altitude in metres
+
+    Returns:
+        A function of Unix time returning the Doppler offset in Hz.
+    '''
+    sat = satellite(load_tles(tle_file), spacecraft)
+    station = station_ecef(latitude, longitude, altitude)
+    frequency = APT_FREQUENCIES[spacecraft]
+    return lambda unix_time: doppler_offset(sat, station, unix_time, frequency)
+
+def recording_start(recording, sample_rate, start_time='', sample_size=8):
+    '''Unix time of the first sample of an IQ recording
+
+    Args:
+        recording: Path of the recording
+        sample_rate: Sample rate of the recording
+        start_time: UTC start as YYYY-MM-DDTHH:MM:SS, or '' to take the
+            recording as ending at its modification time
+        sample_size: Bytes per sample (8 for complex64)
+
+    Returns:
+        The start time in seconds since the Unix epoch.
+    '''
+    if start_time:
+        return calendar.timegm(datetime.datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S').timetuple())
+    return os.path.getmtime(recording) - os.path.getsize(recording) / (sample_size * sample_rate)
+
+def ephemeris_chunk(sat, day, cache_dir=None):
+    '''Earth fixed states of a satellite over one UTC day on the ephemeris grid
+
+    Chunks are memoized in ephemeris_chunks and, with a cache directory,
+    saved as <satnum>_<epoch>_<day>.npz so other runs (the scheduler, p.py)
+    reuse them. Only the newest EPHEMERIS_CACHE_FILES are kept on disk.
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        day: Days since the Unix epoch
+        cache_dir: Directory to cache chunks in, or None for memory only
+
+    Returns:
+        A (positions, velocities) tuple of (3, EPHEMERIS_POINTS) arrays in km
+        and km/s, NaN where SGP4 fails. Point i is at day * 86400 +
+        i * EPHEMERIS_STEP.
+    '''
+    key = '{}_{:.8f}_{}'.format(sat.satnum, sat.jdsatepoch + sat.jdsatepochF, day)
+    if key in ephemeris_chunks:
+        ephemeris_chunks[key] = ephemeris_chunks.pop(key)
+        return ephemeris_chunks[key]
+
+    cache_file = os.path.join(cache_dir, key + '.npz') if cache_dir else None
+    chunk = None
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                chunk = (cache['positions'], cache['velocities'])
+            os.utime(cache_file, None)
+        except (IOError, ValueError, KeyError):
+            chunk = None
+
+    if chunk is None:
+        times = day * SECONDS_PER_DAY + np.arange(EPHEMERIS_POINTS) * EPHEMERIS_STEP
+        jd, fr = julian_date(times.astype(np.float64))
+        errors, positions, velocities = sat.sgp4_array(jd, fr)
+        positions[errors != 0] = np.nan
+        velocities[errors != 0] = np.nan
+        chunk = teme_to_ecef(positions.T, velocities.T, times)
+        if cache_file:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            temp_file = '{}.{}.tmp.npz'.format(cache_file[:-len('.npz')], os.getpid())
+            np.savez(temp_file, positions=chunk[0], velocities=chunk[1])
+            os.rename(temp_file, cache_file)
+            evict_ephemeris_cache(cache_dir)
+
+    ephemeris_chunks[key] = chunk
+    while len(ephemeris_chunks) > EPHEMERIS_MEMORY_CHUNKS:
+        ephemeris_chunks.popitem(last=False)
+    return chunk
+
+def evict_ephemeris_cache(cache_dir, max_files=None):
+    '''Removes the least recently used ephemeris chunks beyond max_files
+
+    Chunks still being written by another process (.tmp.npz) are left
+    alone, and chunks another process removes first are skipped.
+
+    Args:
+        cache_dir: Ephemeris cache directory
+        max_files: Number of chunks to keep (default EPHEMERIS_CACHE_FILES)
+    '''
+    chunks = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npz') or '.tmp.' in name:
+            continue
+        try:
+            chunks.append((os.path.getmtime(os.path.join(cache_dir, name)), os.path.join(cache_dir, name)))
+        except OSError:
+            pass
+    chunks.sort(reverse=True)
+    for _, stale in chunks[max_files or EPHEMERIS_CACHE_FILES:]:
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+def ephemeris(sat, unix_times, cache_dir=None):
+    '''Earth fixed position and velocity of a satellite for an array of times
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        unix_times: Array of times in seconds since the Unix epoch
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        A (positions, velocities) tuple of (3, n) arrays in km and km/s.
+    '''
+    unix_times = np.atleast_1d(np.asarray(unix_times, dtype=np.float64))
+    first_day = int(np.floor(np.min(unix_times) / SECONDS_PER_DAY))
+    last_day = int(np.floor(np.max(unix_times) / SECONDS_PER_DAY))
+    chunks = [ephemeris_chunk(sat, day, cache_dir) for day in range(first_day, last_day + 1)]
+    grid_positions = np.concatenate([chunk[0][:, :-1] for chunk in chunks] + [chunks[-1][0][:, -1:]], axis=1)
+    grid_velocities = np.concatenate([chunk[1][:, :-1] for chunk in chunks] + [chunks[-1][1][:, -1:]], axis=1)
+
+    offset = (unix_times - first_day * SECONDS_PER_DAY) / EPHEMERIS_STEP
+    index = np.minimum(offset.astype(np.int64), grid_positions.shape[1] - 2)
+    s = offset - index
+    h = EPHEMERIS_STEP
+    p0, p1 = grid_positions[:, index], grid_positions[:, index + 1]
+    v0, v1 = grid_velocities[:, index], grid_velocities[:, index + 1]
+    positions = ((2 * s ** 3 - 3 * s ** 2 + 1) * p0 + (s ** 3 - 2 * s ** 2 + s) * h * v0
+                 + (-2 * s ** 3 + 3 * s ** 2) * p1 + (s ** 3 - s ** 2) * h * v1)
+    velocities = ((6 * s ** 2 - 6 * s) / h * p0 + (3 * s ** 2 - 4 * s + 1) * v0
+                  + (-6 * s ** 2 + 6 * s) / h * p1 + (3 * s ** 2 - 2 * s) * v1)
+    return positions, velocities
+
+def look_angles(sat, station, unix_times, cache_dir=None):
+    '''Where a satellite appears from the station at an array of times
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        station: (latitude, longitude, altitude) of the station in degrees
+            and metres
+        unix_times: Array of times in seconds since the Unix epoch
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        An (azimuth, elevation, distance, range_rate) tuple of arrays in
+        degrees, km and km/s (range rate positive when receding).
+    '''
+    positions, velocities = ephemeris(sat, unix_times, cache_dir)
+    lat, lon = np.radians(station[0]), np.radians(station[1])
+    east = np.array([-np.sin(lon), np.cos(lon), 0.0])
+    north = np.array([-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)])
+    up = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+    line_of_sight = positions - station_ecef(*station)[:, np.newaxis]
+    distance = np.sqrt(np.sum(line_of_sight ** 2, axis=0))
+    azimuth = np.degrees(np.arctan2(np.dot(east, line_of_sight), np.dot(north, line_of_sight))) % 360
+    elevation = np.degrees(np.arcsin(np.dot(up, line_of_sight) / distance))
+    return azimuth, elevation, distance, np.sum(line_of_sight * velocities, axis=0) / distance
+
+def elevation_profile(sat, station, start, end, step=1.0, cache_dir=None):
+    '''Elevation of a satellite above the station over a span of time
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        station: (latitude, longitude, altitude) of the station
+        start: Start time (Unix time)
+        end: End time (Unix time)
+        step: Seconds between samples
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        A (times, elevation) tuple of arrays, elevation in degrees.
+    '''
+    times = np.arange(start, end + step / 2, step, dtype=np.float64)
+    return times, look_angles(sat, station, times, cache_dir)[1]
+
+def pass_windows(sat, station, start, end, horizon=0.0, step=60, cache_dir=None):
+    '''Finds the passes of a satellite over the station
+
+    A coarse grid finds the passes, then bisection (rise and set) and
+    ternary search (culmination), each step evaluated for every pass at
+    once, refine them to about a second. Passes already up at start or
+    still up at end are left out, as are passes short enough to fall
+    between two grid points (only a few degrees high at best).
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        station: (latitude, longitude, altitude) of the station
+        start: Start of the prediction window (Unix time)
+        end: End of the prediction window (Unix time)
+        horizon: Elevation in degrees the satellite must rise above
+        step: Coarse grid spacing in seconds
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        A list of pass dicts with aos, los and tca (Unix times),
+        max_elevation and direction ('north' or 'south').
+    '''
+    elevation_at = lambda times: look_angles(sat, station, times, cache_dir)[1]
+    times = np.arange(start, end + step, step, dtype=np.float64)
+    elevation = elevation_at(times)
+    above = elevation > horizon
+    edges = np.flatnonzero(above[1:] != above[:-1])
+    rises = edges[:-1][~above[edges[:-1]] & above[edges[1:]]] if len(edges) > 1 else edges[:0]
+    sets = edges[np.searchsorted(edges, rises) + 1]
+    if not len(rises):
+        return []
+
+    # Bisect each horizon crossing down to under a second, all passes at once
+    low = np.concatenate((times[rises], times[sets]))
+    high = low + step
+    was_above = np.concatenate((np.zeros(len(rises), dtype=bool), np.ones(len(sets), dtype=bool)))
+    for _ in range(int(np.ceil(np.log2(step)))):
+        middle = (low + high) / 2
+        same = (elevation_at(middle) > horizon) == was_above
+        low = np.where(same, middle, low)
+        high = np.where(same, high, middle)
+    crossings = (low + high) / 2
+
+    # Ternary search for culmination around the highest grid point of each pass
+    peaks = np.array([rise + 1 + np.argmax(elevation[rise + 1:set_index + 1])
+                      for rise, set_index in zip(rises, sets)], dtype=np.int64)
+    low, high = times[peaks] - step, times[peaks] + step
+    while np.max(high - low) > 1:
+        first, second = low + (high - low) / 3, high - (high - low) / 3
+        values = elevation_at(np.concatenate((first, second)))
+        rising = values[:len(peaks)] < values[len(peaks):]
+        low = np.where(rising, first, low)
+        high = np.where(rising, high, second)
+    tca = (low + high) / 2
+    max_elevation = elevation_at(tca)
+    northward = ephemeris(sat, tca, cache_dir)[1][2] > 0
+
+    return [{'aos': float(crossings[index]), 'los': float(crossings[len(rises) + index]),
+             'tca': float(tca[index]), 'max_elevation': float(max_elevation[index]),
+             'direction': 'north' if northward[index] else 'south'} for index in range(len(rises))]
+
+def subsatellite_track(sat, unix_times, cache_dir=None):
+    '''Geodetic latitude and longitude of the point beneath the satellite
+
+    Args:
+        sat: sgp4 Satrec from satellite()
+        unix_times: Array of times in seconds since the Unix epoch
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        A (latitude, longitude) tuple of arrays in degrees, longitude in
+        -180 to 180.
+    '''
+    positions, _ = ephemeris(sat, unix_times, cache_dir)
+    x, y, z = positions
+    e2 = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+    polar = EARTH_RADIUS * (1 - EARTH_FLATTENING)
+    distance = np.sqrt(x ** 2 + y ** 2)
+
+    # Bowring's formula, exact to well under a metre at satellite altitudes
+    theta = np.arctan2(z * EARTH_RADIUS, distance * polar)
+    latitude = np.arctan2(z + e2 / (1 - e2) * polar * np.sin(theta) ** 3,
+                          distance - e2 * EARTH_RADIUS * np.cos(theta) ** 3)
+    return np.degrees(latitude), np.degrees(np.arctan2(y, x))
+
+################################################################################
+# Define some constants
+################################################################################
+SECONDS_PER_DAY = 86400
+UNIX_EPOCH_JD = 2440587.5
+
+EARTH_RADIUS = 6378.137                 # km, WGS-84 equatorial radius
+EARTH_FLATTENING = 1 / 298.257223563
+EARTH_ROTATION = 7.292115e-5            # rad/s
+SPEED_OF_LIGHT = 299792.458             # km/s
+
+APT_FREQUENCIES = {'NOAA-15': 137.62e6, 'NOAA-18': 137.9125e6, 'NOAA-19': 137.1e6}
+
+EPHEMERIS_STEP = 60                     # s between ephemeris grid points
+EPHEMERIS_POINTS = SECONDS_PER_DAY // EPHEMERIS_STEP + 1
+EPHEMERIS_MEMORY_CHUNKS = 64
+EPHEMERIS_CACHE_FILES = 512             # about 70 kB each
+EPHEMERIS_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'stem_station', 'ephemeris')
+
+ephemeris_chunks = collections.OrderedDict()
+
+################################################################################
+# Command Line
+################################################################################
+def main():
+    parser = argparse.ArgumentParser(description='Print the Doppler offset of an APT satellite')
+    parser.add_argument('tle_file', help='File of named TLEs, e.g. Celestrak weather.txt')
+    parser.add_argument('spacecraft', choices=sorted(APT_FREQUENCIES), help='Spacecraft to track')
+    parser.add_argument('--lat', type=float, required=True, help='Station latitude in degrees (north positive)')
+    parser.add_argument('--lon', type=float, required=True, help='Station longitude in degrees (east positive)')
+    parser.add_argument('--alt', type=float, default=0.0, help='Station altitude in metres')
+    parser.add_argument('--minutes', type=int, default=0, help='Also print the offset every minute for this long')
+    args = parser.parse_args()
+
+    predict = doppler_predictor(args.tle_file, args.spacecraft, args.lat, args.lon, args.alt)
+    now = time.time()
+    for minute in range(args.minutes + 1):
+        when = now + 60 * minute
+        print('{} {:+8.1f} Hz'.format(datetime.datetime.utcfromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S'),
+                                      predict(when)))
+
+if __name__ == '__main__':
+    main()
@@ -1,105 +1,367 @@
 from __future__ import division
 
 import argparse
+import concurrent.futures
+import contextlib
+import cProfile
 import datetime
+import glob
+import hashlib
 import json
-import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
+import orbit
 import os.path
 import pmt
+import re
 import scipy.stats
+import sqlite3
 import struct
 import sys
+import time
+import zlib
 
 from gnuradio.blocks import parse_file_metadata
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
 from PIL import Image, ImageOps
-from itertools import izip_longest
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 ################################################################################
 # Function Definitions
 ################################################################################
-def grouper(n, iterable, fillvalue=None):
-    '''Collect data into fixed-length chunks or blocks
+def frame_lines(samples, fillvalue=0, pad_front=False):
+    '''Reshapes a run of samples into a 2-D frame of full APT lines
 
-    Breaks a list (iterable) into groups of n. The last list is filled with
-    fillvalue to get to the n size if it is less than n. Sourced from:
-    https://docs.python.org/2/library/itertools.html
+    The samples are copied once into a new contiguous array of shape
+    (lines, FULL_LINE_WIDTH). A final partial line is padded out with
+    fillvalue.
 
     Args:
-        n: Number of items in each resultant list
-        iterable: List of items to break into smaller lists
-        fillevalue: Optional parameter defines fill items for final list
+        samples: 1-D array of samples
+        fillvalue: Value used to pad the partial line
+        pad_front: Pad at the start of the samples rather than the end, so
+            the last sample ends a line (used for data ahead of a sync)
 
     Returns:
-        A list of lists where the input list is broken into lists of length n.
-        For example:
-            grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx
+        A (lines, FULL_LINE_WIDTH) array with the dtype of samples.
     '''
-    args = [iter(iterable)] * n
-    return izip_longest(fillvalue=fillvalue, *args)
+    samples = np.asarray(samples)
+    lines = -(-len(samples) // FULL_LINE_WIDTH)
+    frame = np.empty((lines, FULL_LINE_WIDTH), dtype=samples.dtype)
+    flat = frame.reshape(-1)
+    pad = flat.size - len(samples)
+    if pad_front:
+        flat[:pad] = fillvalue
+        flat[pad:] = samples
+    else:
+        flat[:len(samples)] = samples
+        flat[len(samples):] = fillvalue
 
-def scale_pixels(pixels, out_min=0, out_max=255):
-    in_max = max([max(line) for line in pixels])
-    in_min = min([min(line) for line in pixels])
-    for i, line in enumerate(pixels):
-        for j, pixel in enumerate(line):
-            pixels[i][j] = (pixel - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    return frame
 
-            pixels[i][j] = int(round(pixels[i][j]))
+def align_lines(samples, headers, return_offsets=False):
+    '''Lays out the capture as lines that start at each header segment
 
-    return pixels
+    Every segment written by the file_meta_sink starts on a SyncA tag, so
+    each one is framed on its own. The last line of a segment is padded
+    with the segment's final sample and dropped if it holds nothing else.
 
-def process_tlm(tlm_strip):
-    tlm = [int(round(sum(line)/len(line))) for line in tlm_strip]
-    deltas = []
-    for i, point in enumerate(tlm):
-        if i != 0:
-            difference = abs(tlm[i] - tlm[i-1])
-        else:
-            difference = 0
-        deltas.append(difference)
-    frame_center = np.argmax(deltas)
-    frame_start = frame_center - 64
-    frame_end = frame_start + 128
-    tlm_frame = tlm[frame_start:frame_end]
-    tlm_points = [int(sum(point)/len(point)) for point in grouper(8, tlm_frame, tlm_frame[-1])]
-    return tlm_points, tlm
-
-def process_tlm2(tlm_strip):
-    # plt.imshow(tlm_strip)
-    # plt.show()
-    tlm = [sum(line)/len(line) for line in tlm_strip]
-    deltas = []
-    for i, point in enumerate(tlm):
-        if i != 0:
-            difference = abs(tlm[i] - tlm[i-1])
-        else:
-            difference = 0
-        deltas.append(difference)
-    frame_center = np.argmax(deltas)
-    frame_start = frame_center - 64
-    frame_end = frame_start + 128
-    tlm_frame = tlm[frame_start:frame_end]
-    tlm_points = [sum(point)/len(point) for point in grouper(8, tlm_frame, tlm_frame[-1])]
-    return tlm_points, tlm
-
-def space_view(space_mark_strip):
-    raw_strips = [int(round(sum(line)/len(line))) for line in space_mark_strip]
-    # space_view_pixels = [pixel for line in space_mark_strip for pixel in line]
-    hist = np.histogram(raw_strips, bins=256)
-    hist_max = np.argmax(hist[0])
-    if hist_max > 127:
-        data = raw_strips
-        for i, point in enumerate(data):
-            if point < 127 and i is not 0:
-                data[i] = data[i-1]
+    Args:
+        samples: 1-D array of samples for the whole capture
+        headers: Header index from load_header_index
+        return_offsets: Also return the sample each line starts at
+
+    Returns:
+        A contiguous (lines, FULL_LINE_WIDTH) array of aligned lines, and
+        with return_offsets an int64 array of the sample number of the
+        start of each line.
+    '''
+    max_lines = int(np.sum(-(-headers['nitems'] // FULL_LINE_WIDTH)))
+    frame = np.empty((max_lines, FULL_LINE_WIDTH), dtype=samples.dtype)
+    line_offsets = np.empty(max_lines, dtype=np.int64)
+    line_count = 0
+    for offset, nitems in zip(headers['offset'], headers['nitems']):
+        segment = samples[offset:offset + nitems]
+        if not len(segment):
+            continue
+        lines = -(-len(segment) // FULL_LINE_WIDTH)
+        flat = frame[line_count:line_count + lines].reshape(-1)
+        flat[:len(segment)] = segment
+        flat[len(segment):] = segment[-1]
+        line_offsets[line_count:line_count + lines] = offset + np.arange(lines) * FULL_LINE_WIDTH
+        if np.all(frame[line_count + lines - 1] == frame[line_count + lines - 1, 0]):
+            lines -= 1
+        line_count += lines
+
+    if return_offsets:
+        return frame[:line_count], line_offsets[:line_count]
+    return frame[:line_count]
+
+def resample_lines(samples, sync_positions, degree=3, smoothing=32, block_lines=256):
+    '''Interpolates every line onto an exact FULL_LINE_WIDTH sample grid
+
+    Doppler and sample-clock error stretch the lines of a capture, so the
+    syncs do not land exactly FULL_LINE_WIDTH samples apart and the image
+    shears. The sync positions are fitted against their line numbers with
+    a low-order polynomial plus a moving average of what the polynomial
+    leaves over, rejecting syncs that sit far off the fit. Each line
+    between two fitted line starts is then linearly interpolated onto
+    FULL_LINE_WIDTH samples. That is done for block_lines lines at a time
+    with array indexing, with no per-line Python work.
+
+    Args:
+        samples: 1-D array of samples for the whole capture
+        sync_positions: Sorted sample numbers where synced lines start
+        degree: Degree of the polynomial fitted over the pass
+        smoothing: Number of syncs averaged when following what the
+            polynomial misses
+        block_lines: Number of lines interpolated per batch
+
+    Returns:
+        A contiguous (lines, FULL_LINE_WIDTH) float32 array of lines, the
+        first starting at the first sync. Captures with too few syncs to fit
+        are returned unresampled, laid out from the first sync.
+    '''
+    positions = np.asarray(sync_positions, dtype=np.float64)
+    line_steps = np.rint(np.diff(positions) / FULL_LINE_WIDTH)
+    keep = np.concatenate(([True], line_steps > 0))
+    positions = positions[keep]
+    line_numbers = np.concatenate(([0], np.cumsum(line_steps[line_steps > 0])))
+    if len(positions) < 2 * (degree + 1):
+        start = int(positions[0]) if len(positions) else 0
+        return frame_lines(samples[start:], 0)
+
+    fitted = np.ones(len(positions), dtype=bool)
+    for _ in range(3):
+        trend = np.polynomial.Polynomial.fit(line_numbers[fitted], positions[fitted], degree)
+        residual = positions - trend(line_numbers)
+        spread = max(3 * np.std(residual[fitted]), 2.0)
+        fitted = np.abs(residual) <= spread
+
+    window = min(smoothing, int(np.sum(fitted)))
+    kernel = np.ones(window) / window
+    weights = np.convolve(fitted.astype(np.float64), kernel, mode='same')
+    wander = np.convolve(np.where(fitted, residual, 0.0), kernel, mode='same')
+    wander = wander / np.maximum(weights, 1e-9)
+
+    total_lines = int(line_numbers[-1]) + 1
+    line_edges = np.arange(total_lines + 1, dtype=np.float64)
+    line_starts = trend(line_edges) + np.interp(line_edges, line_numbers[fitted], wander[fitted])
+    last_samples = line_starts[1:] - np.diff(line_starts) / FULL_LINE_WIDTH
+    total_lines = int(np.sum(last_samples <= len(samples) - 1))
+
+    frame = np.empty((total_lines, FULL_LINE_WIDTH), dtype=np.float32)
+    fraction = np.arange(FULL_LINE_WIDTH, dtype=np.float64) / FULL_LINE_WIDTH
+    for first in range(0, total_lines, block_lines):
+        last = min(first + block_lines, total_lines)
+        starts = line_starts[first:last]
+        lengths = line_starts[first + 1:last + 1] - starts
+        grid = starts[:, np.newaxis] + lengths[:, np.newaxis] * fraction
+        np.clip(grid, 0, len(samples) - 1.000001, out=grid)
+        index = grid.astype(np.int64)
+        grid -= index
+        low = samples[index]
+        frame[first:last] = low + (samples[index + 1] - low) * grid
+
+    return frame
+
+def align_capture(samples, syncs, resample=True, show_all=False):
+    '''Cuts a capture with syncs into lines and finds where each line starts
+
+    Args:
+        samples: 1-D array of samples for the whole capture
+        syncs: Header index of the capture (read or from sync_index) with at
+            least one SyncA segment
+        resample: Resample the lines between the syncs onto an exact grid
+            (resample_lines) rather than framing each header segment on its
+            own (align_lines)
+        show_all: When resampling, also keep the lines before the first
+            sync. align_lines already frames them from the first segment.
+
+    Returns:
+        A (lines, sync_count, line_offsets) tuple. lines is the
+        (lines, FULL_LINE_WIDTH) array, sync_count the number of syncs that
+        start a line that was kept and line_offsets the sample number each
+        line starts at (negative for the padded lines before the first
+        sync), for timing the lines.
+    '''
+    sync_offsets = syncs['offset'][syncs['has_SyncA']]
+    if not resample:
+        lines, line_offsets = align_lines(samples, syncs, return_offsets=True)
+        return lines, len(np.intersect1d(sync_offsets, line_offsets)), line_offsets
+
+    lines = resample_lines(samples, sync_offsets)
+    line_offsets = sync_offsets[0] + np.arange(len(lines), dtype=np.int64) * FULL_LINE_WIDTH
+
+    # Only count the syncs that start a line that was kept
+    sync_lines = np.rint((sync_offsets - sync_offsets[0]) / FULL_LINE_WIDTH)
+    sync_count = len(np.unique(sync_lines[sync_lines < len(lines)]))
+
+    if show_all:
+        pre_syncs = frame_lines(samples[0:sync_offsets[0]], 0, pad_front=True)
+        lines = np.concatenate((pre_syncs, lines))
+        line_offsets = np.concatenate((sync_offsets[0] - np.arange(len(pre_syncs), 0, -1) * FULL_LINE_WIDTH, line_offsets))
+
+    return lines, sync_count, line_offsets
+
+def scale_pixels(pixels, out_min=0, out_max=255, out=None, percentiles=None, in_range=None):
+    '''Linearly rescales pixels into an output range
+
+    The input range is taken from the data itself, either the absolute
+    min/max or a pair of percentiles so a few noise spikes do not wash out
+    the rest of the image. The arithmetic is done in one float temporary of
+    the input's precision (float32 for captures) and written to out.
+
+    Args:
+        pixels: Array of pixels of any numeric dtype
+        out_min: Output value for the low end of the input range
+        out_max: Output value for the high end of the input range
+        out: Optional preallocated array to write into. Integer outputs are
+            rounded half up, as round() did, and clipped to the range.
+            Defaults to a new uint8 array.
+        percentiles: Optional (low, high) percentiles to use as the input
+            range instead of the min/max. Pixels outside are clipped.
+        in_range: Optional fixed (low, high) input range, used as-is in
+            place of anything derived from the data. Pixels outside are
+            clipped.
+
+    Returns:
+        The scaled pixels (out, if it was given).
+    '''
+    pixels = np.asarray(pixels)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.uint8)
+
+    if in_range is not None:
+        in_min, in_max = in_range
+    elif percentiles is not None:
+        in_min, in_max = np.percentile(pixels, percentiles)
     else:
-        data = raw_strips
-        for i, point in enumerate(data):
-            if point > 127 and i is not 0:
-                data[i] = data[i-1]
+        in_min, in_max = pixels.min(), pixels.max()
+
+    if in_max == in_min:
+        out[...] = out_min
+        return out
+
+    work = np.subtract(pixels, in_min, dtype=np.result_type(pixels.dtype, np.float32))
+    work *= (out_max - out_min) / (in_max - in_min)
+    work += out_min
+    if out.dtype.kind in 'iu':
+        work += 0.5
+        np.floor(work, out=work)
+    if percentiles is not None or in_range is not None or out.dtype.kind in 'iu':
+        np.clip(work, out_min, out_max, out=work)
+    np.copyto(out, work, casting='unsafe')
+
+    return out
+
+def extract_wedges(tlm_strip):
+    '''Splits a telemetry strip into every complete telemetry frame in the pass
+
+    The frame phase is found by folding the line-to-line drops of the whole
+    strip onto one frame period; the biggest drop is the step from wedge 8
+    (full scale) down to the zero modulation reference. Every complete frame
+    from that phase on is then reduced to its 16 wedge means in one reshape.
+
+    Args:
+        tlm_strip: 2D array of the telemetry columns of each line
+
+    Returns:
+        A (frames, tlm) tuple. frames is an (n, 16) array with the mean of
+        every wedge of every complete frame and tlm is the mean of each line.
+
+    Raises:
+        ValueError: If the strip does not hold a complete telemetry frame.
+    '''
+    tlm = np.mean(tlm_strip, axis=1)
+    drops = -np.diff(tlm)
+    phase_drops = np.bincount(np.arange(1, len(tlm)) % TLM_FRAME_LINES, weights=drops,
+                              minlength=TLM_FRAME_LINES)
+    frame_start = (np.argmax(phase_drops) - TLM_ZERO_MOD_WEDGE * TLM_WEDGE_LINES) % TLM_FRAME_LINES
+    frame_count = (len(tlm) - frame_start) // TLM_FRAME_LINES
+    if frame_count < 1:
+        raise ValueError('No complete {} line telemetry frame in a strip of {} lines'.format(TLM_FRAME_LINES, len(tlm)))
+    frame_lines = tlm[frame_start:frame_start + frame_count * TLM_FRAME_LINES]
+    frames = frame_lines.reshape(frame_count, TLM_WEDGES, TLM_WEDGE_LINES).mean(axis=2)
+    return frames, tlm
+
+def combine_wedges(frames, threshold=3.0):
+    '''Averages the wedges of every frame, rejecting outlying frames
+
+    A wedge value is rejected when it is more than threshold scaled median
+    absolute deviations from the median of that wedge over all frames, so
+    frames hit by noise bursts or dropouts do not skew the calibration.
+
+    Args:
+        frames: (n, 16) array of wedge values from extract_wedges
+        threshold: Rejection threshold in (normal scaled) MADs
+
+    Returns:
+        Array of the 16 robust wedge means.
+    '''
+    median = np.median(frames, axis=0)
+    deviation = np.abs(frames - median)
+    spread = np.maximum(1.4826 * np.median(deviation, axis=0), 1.0)
+    inliers = deviation <= threshold * spread
+    return np.sum(frames * inliers, axis=0) / np.sum(inliers, axis=0)
+
+def running_median(values, window_size):
+    '''Centred running median, with the edges padded by reflection
+
+    Reflecting (rather than repeating the end values) keeps a single
+    outlier in the first or last line from filling half the window and
+    becoming the median there.
+
+    Args:
+        values: 1D array
+        window_size: Number of values in each median (odd)
+
+    Returns:
+        Array of the median of the window around each value.
+    '''
+    values = np.asarray(values, dtype=float)
+    half = window_size // 2
+    padded = np.pad(values, half, mode='reflect')
+    windows = np.lib.stride_tricks.as_strided(padded, shape=(len(values), 2 * half + 1),
+                                              strides=(padded.strides[0], padded.strides[0]))
+    return np.median(windows, axis=1)
+
+def space_view(space_mark_strip, window_size=31, threshold=3.0):
+    '''Estimates the space view counts of a channel line by line
+
+    Each line of the space mark strip is averaged, then a Hampel filter
+    replaces lines more than threshold scaled MADs from the running median
+    (lost lines, noise bursts) with that median.
+
+    Args:
+        space_mark_strip: 2D array of the space mark columns of each line
+        window_size: Lines in the running median (odd)
+        threshold: Rejection threshold in (normal scaled) MADs
+
+    Returns:
+        A (space, data, rolling) tuple. space is the mean space count of the
+        pass, data the filtered space count of each line and rolling the
+        running median space count of each line, which follows any drift
+        along the pass.
+    '''
+    raw_strips = np.mean(space_mark_strip, axis=1)
+    rolling = running_median(raw_strips, window_size)
+    deviation = np.abs(raw_strips - rolling)
+    spread = np.maximum(1.4826 * running_median(deviation, window_size), 1.0)
+    data = np.where(deviation > threshold * spread, rolling, raw_strips)
     data_avg = int(round(np.mean(data)))
-    return data_avg, data
+    return data_avg, data, rolling
 
 def closest(val, l):
     '''Determines the closest value from a list to a value
@@ -120,18 +382,22 @@ def closest(val, l):
 def avhrr_prt_cal(x, a, eight_bits=True):
     '''NOAA AVHRR PRT Calibration Formula
 
+    The polynomial is evaluated in Horner form. x may be a scalar with a
+    single row of coefficients, or an array of counts (one per PRT) with one
+    row of coefficients each.
+
     Args:
-        x: Raw counts value
-        a: PRT calibration table for a specific AVHRR
+        x: Raw counts value(s)
+        a: PRT calibration table for a specific AVHRR, shape (5,) or (n, 5)
 
     Returns:
         Value of x as a temperature (Kelvin) for a specific AVHRR calibration
         table provided in a.
     '''
     if eight_bits:
-        x = x * 4
+        x = np.multiply(x, 4)
 
-    return sum([a[j] * x ** j for j in range(0, 5)])
+    return np.polynomial.polynomial.polyval(x, np.asarray(a, dtype=float).T, tensor=False)
 
 def avhrr_bb_temp(T, b):
     '''NOAA AVHRR Blackbody Calibration Formula
@@ -144,68 +410,1006 @@ def avhrr_bb_temp(T, b):
         Returns a blackbody temperature (Kelvin) based on the calibrated
         weighting for a specific AVHRR.
     '''
-    return sum([T[i] * b[i] for i in range(0, 4)])
+    return float(np.dot(T, b))
+
+def planck_radiance(temperature, planck):
+    '''Radiance of a blackbody as seen by an AVHRR IR channel
+
+    Args:
+        temperature: Scene temperature(s) in Kelvin
+        planck: Channel dict with the central wavenumber (cm^-1) and the band
+            correction coefficients a and b
+
+    Returns:
+        Radiance(s) in mW/(m^2 sr cm^-1).
+    '''
+    effective = planck['a'] + planck['b'] * np.asarray(temperature, dtype=float)
+    return PLANCK_C1 * planck['wavenumber'] ** 3 / np.expm1(PLANCK_C2 * planck['wavenumber'] / effective)
+
+def planck_temperature(radiance, planck):
+    '''Brightness temperature of a radiance seen by an AVHRR IR channel
+
+    The inverse of planck_radiance. Radiances at or below zero (colder than
+    the space view) have no temperature and come back as NaN.
+
+    Args:
+        radiance: Radiance(s) in mW/(m^2 sr cm^-1)
+        planck: Channel dict as for planck_radiance
+
+    Returns:
+        Temperature(s) in Kelvin.
+    '''
+    radiance = np.asarray(radiance, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effective = PLANCK_C2 * planck['wavenumber'] / np.log1p(PLANCK_C1 * planck['wavenumber'] ** 3 / radiance)
+    return np.where(radiance > 0, (effective - planck['a']) / planck['b'], np.nan)
+
+def ir_temperature_lut(planck, bb_temp, bb_counts, space_counts):
+    '''Lookup table from 8 bit IR counts to brightness temperature
+
+    Uses the two point calibration of the AVHRR: the space view is zero
+    radiance and the blackbody is the radiance of the blackbody reference
+    temperature, with radiance linear in counts between (and beyond) them.
+
+    Args:
+        planck: Channel dict as for planck_radiance
+        bb_temp: Blackbody reference temperature in Kelvin
+        bb_counts: Counts of the blackbody view (back scan wedge)
+        space_counts: Counts of the space view, or an array of them per line
+
+    Returns:
+        A 256 entry float32 array of Kelvin (one row per line for an array
+        of space counts), NaN for counts with no temperature.
+    '''
+    space_counts = np.asarray(space_counts, dtype=float)[..., np.newaxis]
+    span = bb_counts - space_counts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = np.where(span != 0, planck_radiance(bb_temp, planck) / span, np.nan)
+    radiance = gain * (np.arange(256) - space_counts)
+    return planck_temperature(radiance, planck).astype(np.float32)
+
+def calibrate_ir(image, lut):
+    '''Maps an 8 bit IR image to brightness temperatures
+
+    Args:
+        image: uint8 image array
+        lut: Lookup table from ir_temperature_lut, 256 entries or one row
+            of 256 per image line
+
+    Returns:
+        A float32 array of Kelvin the shape of image.
+    '''
+    if lut.ndim == 2:
+        return lut[np.arange(len(image))[:, np.newaxis], image]
+
+    return lut[image]
+
+def thermal_ramp(kelvin, low, high):
+    '''Colours temperatures along the THERMAL_PALETTE ramp
+
+    Args:
+        kelvin: Array of temperatures in Kelvin
+        low: Temperature at the cold (violet) end of the ramp
+        high: Temperature at the warm (red) end of the ramp
+
+    Returns:
+        Array of RGB values in 0-1 with a trailing axis of 3. Temperatures
+        that are NaN come out mid grey.
+    '''
+    position = (np.asarray(kelvin, dtype=float) - low) / (high - low)
+    stops = np.linspace(0, 1, len(THERMAL_PALETTE))
+    rgb = np.stack([np.interp(np.nan_to_num(position), stops, [colour[i] for colour in THERMAL_PALETTE])
+                    for i in range(3)], axis=-1)
+    rgb[np.isnan(position)] = 0.5
+    return rgb
+
+def composite_thermal(visible, kelvin):
+    '''Thermal colour ramp of the IR frame over the range of Earth scenes'''
+    return thermal_ramp(np.broadcast_to(kelvin, np.broadcast(visible, kelvin).shape), 190.0, 320.0)
+
+def composite_vis_ir(visible, kelvin):
+    '''Natural looking land, sea and cloud from the visible and IR frames
+
+    Dark warm pixels are sea, brighter warm ones land, and clouds (bright or
+    cold) fade to white the colder they are.
+    '''
+    cold = np.clip((285.0 - np.where(np.isnan(kelvin), 180.0, kelvin)) / 60.0, 0, 1)
+    cloud = np.maximum(np.clip((visible - 0.35) / 0.45, 0, 1), cold)[..., np.newaxis]
+    sea = np.array([0.05, 0.12, 0.35]) + visible[..., np.newaxis] * np.array([0.2, 0.3, 0.5])
+    land = np.array([0.25, 0.35, 0.15]) + visible[..., np.newaxis] * np.array([0.6, 0.4, 0.3])
+    surface = np.where((visible < 0.12)[..., np.newaxis], sea, land)
+    white = (0.6 + 0.4 * np.maximum(visible, cold))[..., np.newaxis]
+    return surface * (1 - cloud) + white * cloud
+
+def composite_sst(visible, kelvin):
+    '''Sea surface temperature tint over a grey IR cloud and land image
+
+    Pixels dark in the visible frame and between freezing sea water and the
+    warmest sea surface are coloured by temperature.
+    '''
+    kelvin = np.broadcast_to(np.where(np.isnan(kelvin), 180.0, kelvin), np.broadcast(visible, kelvin).shape)
+    grey = np.clip((320.0 - kelvin) / 130.0, 0, 1)[..., np.newaxis]
+    sea = (visible < 0.2) & (kelvin >= SST_RANGE[0]) & (kelvin <= SST_RANGE[1])
+    return np.where(sea[..., np.newaxis], thermal_ramp(kelvin, SST_RANGE[0], SST_RANGE[1]), grey * np.ones(3))
+
+def kelvin_bins(kelvin):
+    '''Quantizes brightness temperatures to the Kelvin bins of composite_lut
+
+    Args:
+        kelvin: Array of temperatures in Kelvin
+
+    Returns:
+        An intp array of bin indices the shape of kelvin, KELVIN_BINS (the
+        last bin) for NaN. Temperatures outside KELVIN_RANGE go to the end
+        bins.
+    '''
+    kelvin = np.asarray(kelvin, dtype=float)
+    bins = np.rint((np.nan_to_num(kelvin) - KELVIN_RANGE[0]) / KELVIN_STEP)
+    bins = np.clip(bins, 0, KELVIN_BINS - 1).astype(np.intp)
+    bins[np.isnan(kelvin)] = KELVIN_BINS
+    return bins
+
+def composite_lut(product):
+    '''Precomputes the RGB lookup table of a false colour product, once per process
+
+    Args:
+        product: Name of the product in COMPOSITES
+
+    Returns:
+        A (256, KELVIN_BINS + 1, 3) uint8 table indexed by [visible count,
+        Kelvin bin from kelvin_bins].
+    '''
+    if product not in composite_luts:
+        visible = np.arange(256)[:, np.newaxis] / 255.0
+        kelvin = np.append(KELVIN_RANGE[0] + np.arange(KELVIN_BINS) * KELVIN_STEP, np.nan)[np.newaxis, :]
+        rgb = COMPOSITES[product](visible, kelvin)
+        composite_luts[product] = np.floor(np.clip(rgb, 0, 1) * 255 + 0.5).astype(np.uint8)
+    return composite_luts[product]
+
+def render_composite(product, visible_frame, ir_frame, kelvin_lut):
+    '''Renders a false colour product from the aligned visible and IR frames
+
+    The IR counts are binned through the per line Kelvin table of the IR
+    frame, so the product uses the same space view calibration as the
+    temperatures saved with the pass, and then looked up in composite_lut.
+
+    Args:
+        product: Name of the product in COMPOSITES
+        visible_frame: uint8 visible (or near IR) image, or None for the
+            products in IR_COMPOSITES when there is no visible frame
+        ir_frame: uint8 IR image of the same lines
+        kelvin_lut: Count to Kelvin table of the IR frame from
+            ir_temperature_lut, 256 entries or one row of 256 per line
+
+    Returns:
+        A (lines, width, 3) uint8 RGB image.
+    '''
+    bins = calibrate_ir(ir_frame, kelvin_bins(kelvin_lut))
+    return composite_lut(product)[0 if visible_frame is None else visible_frame, bins]
 
 def moving_average(l, window_size, pad=True):
-    smoothed = list(np.convolve(l, np.ones((window_size,))/window_size, mode='valid')[(window_size-1):])
+    '''Trailing moving average of a whole strip
 
-    if pad:
-        pad_data = [smoothed[0]] * ((window_size-1) * 2)
-        smoothed = pad_data + smoothed
+    Args:
+        l: 1D array (or list) of values
+        window_size: Number of values averaged
+        pad: Keep the leading values that average fewer than window_size
+            values, so the result is as long as l
+
+    Returns:
+        Array of the mean of each value and the window_size - 1 before it.
+    '''
+    smoothed, _ = moving_average_chunk(l, window_size)
+    if not pad:
+        smoothed = smoothed[window_size-1:]
 
     return smoothed
 
-def parse_gnuradio_header(header_file, verbose=False):
-    headers = []
-    index = 0
-    rx_time = datetime.timedelta(seconds = 0)
-    with open(header_file, 'rb') as handle:
-        file_length = os.path.getsize(header_file)
-        while True:
-            if file_length - handle.tell() < parse_file_metadata.HEADER_LENGTH:
-                break
+def moving_average_chunk(values, window_size, state=None):
+    '''Trailing moving average of one chunk of a stream
 
-            header_str = handle.read(parse_file_metadata.HEADER_LENGTH)
+    Uses a cumulative sum over the chunk and the carried over tail of the
+    previous one, so it is O(n) in the chunk whatever the window and the
+    sums never run long enough to lose precision. Feeding a strip through in
+    chunks gives the same result as moving_average on the whole strip.
+
+    Args:
+        values: 1D array of the next values of the stream
+        window_size: Number of values averaged
+        state: State returned for the previous chunk, None at the start
+
+    Returns:
+        A (smoothed, state) tuple of the averages for this chunk and the
+        state to pass with the next one.
+    '''
+    history = np.zeros(0) if state is None else state
+    stream = np.concatenate((history, np.asarray(values, dtype=float)))
+    sums = np.concatenate(([0.0], np.cumsum(stream)))
+    ends = np.arange(len(history) + 1, len(stream) + 1)
+    starts = np.maximum(ends - window_size, 0)
+    smoothed = (sums[ends] - sums[starts]) / (ends - starts)
+    return smoothed, stream[len(stream) - (window_size - 1):]
+
+def load_samples(data_file):
+    '''Memory-maps a demodulated APT capture as an array of samples
+
+    The capture is never read into memory as a whole. The OS pages samples in
+    as the array is touched, so load time and resident memory stay flat no
+    matter how long the recording is.
+
+    Args:
+        data_file: Raw float32 file written by the GNU Radio file_meta_sink
+
+    Returns:
+        A read-only numpy.memmap of little-endian float32 samples. A trailing
+        partial sample, if any, is ignored.
+    '''
+    samples_found = os.path.getsize(data_file) // BYTES_PER_FLOAT
+    if samples_found == 0:
+        return np.zeros(0, dtype=SAMPLE_DTYPE)
+
+    return np.memmap(data_file, dtype=SAMPLE_DTYPE, mode='r', shape=(samples_found,))
+
+def read_gnuradio_headers(handle, verbose=False):
+    '''Reads header chunks from the current position of a detached header
+
+    Reading stops quietly at the first incomplete or corrupt chunk, so a
+    header file that is still being written can be read again later starting
+    from the offset of the last chunk returned.
+
+    Args:
+        handle: Binary file handle of a .hdr file written by file_meta_sink
+        verbose: Passed through to the GNU Radio metadata parsers
+
+    Yields:
+        (offset, info) tuples, offset being the file position of the chunk
+        and info the parsed header dict including any extras.
+    '''
+    file_length = os.fstat(handle.fileno()).st_size
+    while True:
+        offset = handle.tell()
+        if file_length - offset < parse_file_metadata.HEADER_LENGTH:
+            break
+
+        header_str = handle.read(parse_file_metadata.HEADER_LENGTH)
+
+        try:
+            header = pmt.deserialize_str(header_str)
+        except RuntimeError:
+            break
+
+        info = parse_file_metadata.parse_header(header, verbose)
+
+        if info['nbytes'] == 0:
+            break
+
+        if(info['extra_len'] > 0):
+            extra_str = handle.read(info['extra_len'])
+            if(len(extra_str) < info['extra_len']):
+                break
 
             try:
-                header = pmt.deserialize_str(header_str)
+                extra = pmt.deserialize_str(extra_str)
             except RuntimeError:
                 break
 
-            info = parse_file_metadata.parse_header(header, verbose)
+            parse_file_metadata.parse_extra_dict(extra, info, verbose)
 
-            if info['nbytes'] == 0:
-                break
+        yield offset, info
+
+def index_gnuradio_header(header_file, verbose=False):
+    '''Builds a compact index of the segments in a detached header
+
+    Every chunk is deserialized once and reduced to a row of
+    HEADER_INDEX_DTYPE. Sample offsets and rx_time (seconds from the start of
+    the capture, accumulated from nitems / rx_rate) are derived with
+    cumulative sums over the whole index.
 
-            if(info['extra_len'] > 0):
-                extra_str = handle.read(info['extra_len'])
-                if(len(extra_str) == 0):
-                    break
+    Args:
+        header_file: Detached .hdr file written by the file_meta_sink
+        verbose: Passed through to the GNU Radio metadata parsers
+
+    Returns:
+        A structured array with one HEADER_INDEX_DTYPE row per segment.
+    '''
+    nitems = []
+    rx_rate = []
+    has_sync = []
+    with open(header_file, 'rb') as handle:
+        for _, info in read_gnuradio_headers(handle, verbose):
+            nitems.append(info['nitems'])
+            rx_rate.append(info['rx_rate'])
+            has_sync.append('SyncA' in info)
 
-                try:
-                    extra = pmt.deserialize_str(extra_str)
-                except RuntimeError:
-                    break
+    return build_header_index(nitems, rx_rate, has_sync)
 
-                parse_file_metadata.parse_extra_dict(extra, info, verbose)
+def build_header_index(nitems, rx_rate, has_sync):
+    '''Assembles a header index from per-segment sizes, rates and sync flags
 
+    Args:
+        nitems: Number of samples in each segment
+        rx_rate: Sample rate of each segment (or one rate for all of them)
+        has_sync: Whether each segment starts on a SyncA
+
+    Returns:
+        A structured array with one HEADER_INDEX_DTYPE row per segment.
+    '''
+    index = np.zeros(len(nitems), dtype=HEADER_INDEX_DTYPE)
+    index['nitems'] = nitems
+    index['rx_rate'] = rx_rate
+    index['has_SyncA'] = has_sync
+    index['offset'][1:] = np.cumsum(index['nitems'])[:-1]
+    index['rx_time'][1:] = np.cumsum(index['nitems'] / index['rx_rate'])[:-1]
+
+    return index
+
+def load_header_index(header_file, verbose=False):
+    '''Loads the segment index of a detached header, building it if needed
+
+    The index is cached next to the header as <header_file>.idx.npz together
+    with the size and modification time of the header it came from. As long
+    as those still match, reopening a capture does no deserializing at all.
+
+    Args:
+        header_file: Detached .hdr file written by the file_meta_sink
+        verbose: Passed through to the GNU Radio metadata parsers
+
+    Returns:
+        A structured array with one HEADER_INDEX_DTYPE row per segment.
+    '''
+    cache_file = header_file + '.idx.npz'
+    header_stat = os.stat(header_file)
+    source = np.array([header_stat.st_size, header_stat.st_mtime], dtype=np.float64)
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                if np.array_equal(cache['source'], source) and cache['index'].dtype == HEADER_INDEX_DTYPE:
+                    return cache['index']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    index = index_gnuradio_header(header_file, verbose)
+    try:
+        with open(cache_file + '.tmp', 'wb') as handle:
+            np.savez(handle, index=index, source=source)
+        os.rename(cache_file + '.tmp', cache_file)
+    except (IOError, OSError):
+        pass
+
+    return index
+
+def validate_calibration(cal):
+    '''Checks calibration data has everything the decoder relies on
+
+    Args:
+        cal: Calibration data as loaded from avhrr.json
+
+    Raises:
+        ValueError: Describing the first problem found.
+    '''
+    for key in ('AVHRR_CHANNELS', 'CAL_DATA'):
+        if key not in cal:
+            raise ValueError('Calibration data has no {}'.format(key))
+
+    for channel, info in cal['AVHRR_CHANNELS'].items():
+        for key in ('channel_id', 'type', 'description'):
+            if key not in info:
+                raise ValueError('AVHRR channel {} has no {}'.format(channel, key))
+
+    for spacecraft, data in cal['CAL_DATA'].items():
+        if np.shape(data.get('a')) != (4, 5):
+            raise ValueError('{} PRT coefficients must be 4 rows of 5'.format(spacecraft))
+        if np.shape(data.get('b')) != (4,):
+            raise ValueError('{} PRT weights must be 4 values'.format(spacecraft))
+        for channel, planck in data.get('planck', {}).items():
+            if not all(key in planck for key in ('wavenumber', 'a', 'b')) or planck['wavenumber'] <= 0 or planck['b'] <= 0:
+                raise ValueError('{} channel {} has invalid Planck constants'.format(spacecraft, channel))
+
+def compile_calibration(cal):
+    '''Precompiles calibration data into arrays and count lookup tables
+
+    Args:
+        cal: Validated calibration data as loaded from avhrr.json
+
+    Returns:
+        A calibration registry dict. 'channels' is AVHRR_CHANNELS as is and
+        'spacecraft' maps each spacecraft to its PRT coefficients 'a' (4, 5),
+        weights 'b' (4,), the PRT count to Kelvin table 'prt_lut' (4, 256)
+        and its per channel 'planck' constants.
+    '''
+    registry = {'channels': cal['AVHRR_CHANNELS'], 'spacecraft': {}}
+    for spacecraft, data in cal['CAL_DATA'].items():
+        a = np.array(data['a'], dtype=np.float64)
+        registry['spacecraft'][spacecraft] = {
+            'a': a,
+            'b': np.array(data['b'], dtype=np.float64),
+            'prt_lut': avhrr_prt_cal(np.arange(256)[:, np.newaxis], a).T,
+            'planck': data.get('planck', {})}
 
-            if len(headers) > 0:
-                last_rx_time = headers[-1]['rx_time']
-                samples_delta = headers[-1]['nitems'] / headers[-1]['rx_rate']
-                samples_delta = datetime.timedelta(seconds=samples_delta)
-                info['rx_time'] = last_rx_time + samples_delta
+    return registry
 
-                info['index'] = index
-                index = index + info['nitems']
+def load_calibration(cal_file=None):
+    '''Loads the calibration registry, once per process and calibration file
+
+    The compiled registry is cached next to the calibration file as
+    <cal_file>.cache.npz, keyed by the SHA-1 of the JSON it came from, so
+    only the first decode after the JSON changes parses and validates it.
+
+    Args:
+        cal_file: Calibration JSON, calibration/avhrr.json next to p.py by
+            default
+
+    Returns:
+        The calibration registry from compile_calibration.
+    '''
+    cal_file = cal_file or CAL_FILE
+    with open(cal_file, 'rb') as handle:
+        source = handle.read()
+    digest = hashlib.sha1(source).hexdigest()
+    if digest in calibration_registry:
+        return calibration_registry[digest]
+
+    cache_file = cal_file + '.cache.npz'
+    registry = None
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                if str(cache['hash']) == digest:
+                    registry = {'channels': json.loads(str(cache['channels'])), 'spacecraft': {}}
+                    for spacecraft in cache['spacecraft']:
+                        spacecraft = str(spacecraft)
+                        registry['spacecraft'][spacecraft] = {
+                            'a': cache[spacecraft + '/a'],
+                            'b': cache[spacecraft + '/b'],
+                            'prt_lut': cache[spacecraft + '/prt_lut'],
+                            'planck': json.loads(str(cache[spacecraft + '/planck']))}
+        except (IOError, ValueError, KeyError):
+            registry = None
+
+    if registry is None:
+        cal = json.loads(source.decode('utf-8'))
+        validate_calibration(cal)
+        registry = compile_calibration(cal)
+        arrays = {'hash': np.array(digest),
+                  'channels': np.array(json.dumps(registry['channels'])),
+                  'spacecraft': np.array(sorted(registry['spacecraft']))}
+        for spacecraft, data in registry['spacecraft'].items():
+            arrays[spacecraft + '/a'] = data['a']
+            arrays[spacecraft + '/b'] = data['b']
+            arrays[spacecraft + '/prt_lut'] = data['prt_lut']
+            arrays[spacecraft + '/planck'] = np.array(json.dumps(data['planck']))
+        temporary_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        try:
+            with open(temporary_file, 'wb') as handle:
+                np.savez(handle, **arrays)
+            os.rename(temporary_file, cache_file)
+        except (IOError, OSError):
+            pass
+
+    calibration_registry[digest] = registry
+    return registry
+
+def sync_template():
+    '''Builds the zero-mean Sync A / Sync B correlation template
+
+    Sync A opens channel A and Sync B opens channel B half a line later, so
+    one template holding both patterns FULL_CHANNEL_WIDTH apart scores a
+    whole line start at once. Each pattern is made zero-mean so the score
+    ignores the DC level of the signal.
+
+    Returns:
+        A float64 template FULL_CHANNEL_WIDTH + SYNC_WIDTH samples long.
+    '''
+    template = np.zeros(FULL_CHANNEL_WIDTH + SYNC_WIDTH)
+    for channel, pattern in (('A', SYNC_A_PATTERN), ('B', SYNC_B_PATTERN)):
+        pattern = np.array(pattern, dtype=np.float64)
+        template[SYNC_RANGE[channel][0]:SYNC_RANGE[channel][1]] = pattern - pattern.mean()
+
+    return template
+
+def correlate_sync(samples, block_size=2**14, batch_blocks=16):
+    '''Cross-correlates samples with the sync template using FFTs
+
+    The correlation is computed overlap-save style: the samples are cut into
+    overlapping blocks of block_size, batch_blocks of them are transformed
+    together as one 2-D rfft, multiplied by the conjugate template spectrum
+    and transformed back. Only one batch is held in memory at a time.
+
+    Args:
+        samples: 1-D array of demodulated samples
+        block_size: FFT length, a power of two well above the template size
+        batch_blocks: Number of blocks transformed per batch
+
+    Returns:
+        A float32 array where element i scores a line starting at sample i
+        ('valid' correlation, len(samples) - template length + 1 long).
+    '''
+    template = sync_template()
+    out_length = len(samples) - len(template) + 1
+    if out_length <= 0:
+        return np.zeros(0, dtype=np.float32)
+
+    step = block_size - len(template) + 1
+    kernel = np.conj(np.fft.rfft(template, block_size))
+    correlation = np.empty(out_length, dtype=np.float32)
+    batch_length = step * batch_blocks
+    for start in range(0, out_length, batch_length):
+        count = min(batch_length, out_length - start)
+        blocks = -(-count // step)
+        segment = np.zeros((blocks - 1) * step + block_size, dtype=np.float32)
+        available = samples[start:start + len(segment)]
+        segment[:len(available)] = available
+        framed = np.lib.stride_tricks.as_strided(segment, shape=(blocks, block_size),
+                                                 strides=(step * segment.itemsize, segment.itemsize))
+        spectrum = np.fft.rfft(framed, axis=1)
+        spectrum *= kernel
+        scores = np.fft.irfft(spectrum, block_size, axis=1)[:, :step]
+        correlation[start:start + count] = scores.ravel()[:count]
+
+    return correlation
+
+def detect_syncs(samples, threshold=4.0, chunk_lines=32, tolerance=8):
+    '''Finds the start of every APT line in a capture without sync tags
+
+    The sync correlation is searched one line period at a time. For each
+    chunk of chunk_lines lines the correlation is folded on the line period
+    to find the line phase, then every line's peak is picked from a window
+    one line long centred on that phase. Because the phase is re-estimated
+    per chunk, slow sample-clock drift is followed across the pass.
+
+    A peak only counts as a sync if it stands threshold standard deviations
+    above its chunk's correlation, and if it sits within tolerance samples
+    of a whole number of lines from a neighbouring sync.
+
+    Args:
+        samples: 1-D array of demodulated samples
+        threshold: Minimum peak height in correlation standard deviations
+        chunk_lines: Number of lines sharing one phase estimate
+        tolerance: Allowed deviation in samples from the line period
+
+    Returns:
+        Sorted int64 array of the samples where synced lines start.
+    '''
+    correlation = correlate_sync(samples)
+    chunk_length = chunk_lines * FULL_LINE_WIDTH
+    chunks = -(-len(correlation) // chunk_length)
+    if not chunks:
+        return np.zeros(0, dtype=np.int64)
+
+    padded = np.zeros((chunks + 1) * chunk_length, dtype=np.float32)
+    padded[FULL_CHANNEL_WIDTH:FULL_CHANNEL_WIDTH + len(correlation)] = correlation
+    positions = []
+    for chunk in range(chunks):
+        base = chunk * chunk_length
+        folded = padded[base + FULL_CHANNEL_WIDTH:base + FULL_CHANNEL_WIDTH + chunk_length]
+        phase = np.argmax(folded.reshape(chunk_lines, FULL_LINE_WIDTH).sum(axis=0))
+        windows = padded[base + phase:base + phase + chunk_length].reshape(chunk_lines, FULL_LINE_WIDTH)
+        peaks = np.argmax(windows, axis=1)
+        heights = windows[np.arange(chunk_lines), peaks]
+        valid = heights > threshold * np.std(folded)
+        line_starts = base + phase + np.arange(chunk_lines) * FULL_LINE_WIDTH
+        positions.append((line_starts + peaks - FULL_CHANNEL_WIDTH)[valid])
+
+    positions = np.unique(np.concatenate(positions))
+    positions = positions[(positions >= 0) & (positions < len(correlation))]
+    if len(positions) < 2:
+        return positions.astype(np.int64)
+
+    spacing = np.diff(positions)
+    off_period = np.abs(spacing - np.rint(spacing / FULL_LINE_WIDTH) * FULL_LINE_WIDTH)
+    periodic = (off_period <= tolerance) & (spacing >= FULL_LINE_WIDTH - tolerance)
+    keep = np.zeros(len(positions), dtype=bool)
+    keep[1:] |= periodic
+    keep[:-1] |= periodic
+
+    return positions[keep].astype(np.int64)
+
+def sync_index(positions, total_samples):
+    '''Builds a header index from detected sync positions
+
+    The result has the same layout as a header index read from a .hdr file,
+    so detected captures go through the same alignment as tagged ones.
+
+    Args:
+        positions: Sorted sample numbers of the detected syncs
+        total_samples: Number of samples in the capture
+
+    Returns:
+        A structured HEADER_INDEX_DTYPE array: a leading segment without a
+        sync when the first sync is not at sample 0, then one segment per
+        sync.
+    '''
+    nitems = np.diff(np.concatenate(([0], positions, [total_samples])))
+    has_sync = np.ones(len(nitems), dtype=bool)
+    has_sync[0] = False
+    if len(positions) and positions[0] == 0:
+        nitems, has_sync = nitems[1:], has_sync[1:]
+
+    return build_header_index(nitems, SAMPLE_RATE, has_sync)
+
+def follow_lines(data_file, header_file=None, poll_interval=1.0, idle_timeout=10.0):
+    '''Yields blocks of whole APT lines from a capture that is still growing
+
+    The data file (and its detached header, if given) are polled for new
+    samples. With a header, lines are laid out per header segment the same
+    way align_lines does, and a segment is only consumed once the next
+    header shows where it ends. Without a header the stream is simply cut
+    into lines. Only the samples of the lines being returned are ever held
+    in memory.
+
+    The capture is considered finished once neither file has grown for
+    idle_timeout seconds, at which point the open segment is flushed.
+
+    Args:
+        data_file: Raw float32 file being written by the file_meta_sink
+        header_file: Optional detached header being written alongside it
+        poll_interval: Seconds to wait between polls when nothing is new
+        idle_timeout: Seconds without growth before the capture is over
+
+    Yields:
+        (lines, FULL_LINE_WIDTH) float32 arrays of newly completed lines.
+    '''
+    segments = []
+    last_offset = 0
+    segment = 0
+    position = 0
+    last_sizes = None
+    idle = 0.0
+    header_handle = open(header_file, 'rb') if header_file else None
+    try:
+        with open(data_file, 'rb') as data:
+            while True:
+                available = os.fstat(data.fileno()).st_size // BYTES_PER_FLOAT
+                if header_handle is not None:
+                    header_handle.seek(last_offset)
+                    chunks = list(read_gnuradio_headers(header_handle))
+                    if chunks:
+                        if segments:
+                            segments.pop()
+                        for offset, info in chunks:
+                            start = segments[-1][0] + segments[-1][1] if segments else 0
+                            segments.append((start, info['nitems']))
+                        last_offset = chunks[-1][0]
+                    sizes = (available, os.fstat(header_handle.fileno()).st_size)
+                else:
+                    segments = [(0, available)]
+                    sizes = (available,)
+
+                idle = idle + poll_interval if sizes == last_sizes else 0.0
+                last_sizes = sizes
+                final = idle >= idle_timeout
+
+                blocks = []
+                while segment < len(segments):
+                    start, nitems = segments[segment]
+                    closed = segment < len(segments) - 1
+                    if closed:
+                        end = min(start + nitems, available)
+                    elif final or header_handle is None:
+                        end = available
+                    else:
+                        break
+
+                    full_lines = (end - position) // FULL_LINE_WIDTH
+                    if full_lines > 0:
+                        data.seek(position * BYTES_PER_FLOAT)
+                        samples = np.fromfile(data, dtype=SAMPLE_DTYPE, count=full_lines * FULL_LINE_WIDTH)
+                        blocks.append(samples.reshape(full_lines, FULL_LINE_WIDTH))
+                        position += full_lines * FULL_LINE_WIDTH
+
+                    if not (closed or final):
+                        break
+
+                    if end > position:
+                        data.seek(position * BYTES_PER_FLOAT)
+                        samples = np.fromfile(data, dtype=SAMPLE_DTYPE, count=end - position)
+                        tail = frame_lines(samples, samples[-1])
+                        if not np.all(tail[-1] == tail[-1, 0]):
+                            blocks.append(tail)
+
+                    segment += 1
+                    if segment < len(segments):
+                        position = segments[segment][0]
+
+                if blocks:
+                    yield np.concatenate(blocks)
+
+                if final:
+                    return
+
+                if not blocks:
+                    time.sleep(poll_interval)
+    finally:
+        if header_handle is not None:
+            header_handle.close()
+
+def stream_decode(data_file, header_file, output_base, direction='north',
+                  ring_lines=None, refresh_lines=20, refresh_share=0.1,
+                  poll_interval=1.0, idle_timeout=10.0, tiles=False):
+    '''Decodes a capture into PNGs while it is still being recorded
+
+    Lines from follow_lines are scaled to 8 bits as they arrive and appended
+    to a <base><image>.png.lines file beside each image, and the images are
+    rewritten from those as they grow and once more when the recording
+    stops. A north pass is flipped, so its newest line is the first row of
+    the PNG and a rewrite has to encode the whole image again. Rewrites are
+    therefore spaced out so they take at most refresh_share of the time,
+    which keeps the total cost linear in the length of the pass rather than
+    quadratic. The scaling range follows the telemetry wedges seen in a
+    ring of the most recent raw lines; a block whose range is flat keeps
+    the last good range. Only the ring and the newest block are held in
+    memory whatever the length of the pass, and the .png.lines files are
+    removed once the final images are written. This is a quick-look
+    product; the regular decode still does the full wedge calibration.
+
+    Args:
+        data_file: Raw float32 file being written by the file_meta_sink
+        header_file: Detached header file, or None for an unaligned stream
+        output_base: Path prefix for the F/A/B PNG files
+        direction: Pass to the 'north' or 'south'
+        ring_lines: Number of raw lines kept to track the scaling range,
+            two telemetry frames by default
+        refresh_lines: Minimum number of new lines between image rewrites
+        refresh_share: Fraction of the time the image rewrites may take; the
+            wait after a rewrite is its duration over refresh_share
+        poll_interval: Seconds to wait between polls when nothing is new
+        idle_timeout: Seconds without growth before the capture is over
+        tiles: Also build a tile pyramid of each image as lines arrive
+
+    Returns:
+        The number of lines decoded.
+    '''
+    if ring_lines is None:
+        ring_lines = 2 * TLM_FRAME_LINES
+    ring = np.empty((ring_lines, FULL_LINE_WIDTH), dtype=SAMPLE_DTYPE)
+    ring_fill = 0
+    ring_position = 0
+    in_range = None
+    image_columns = {'F': (0, FULL_LINE_WIDTH)}
+    if header_file:
+        image_columns['A'] = IMAGE_RANGE['A']
+        image_columns['B'] = IMAGE_RANGE['B']
+    line_files = dict((image_id, open(output_base + image_id + '.png.lines', 'wb')) for image_id in image_columns)
+    pyramids = {}
+    if tiles:
+        for image_id, columns in image_columns.items():
+            pyramids[image_id] = start_tile_pyramid(output_base + image_id + '_tiles', columns[1] - columns[0], direction)
+    total_lines = 0
+    pending_lines = 0
+    next_refresh = 0
+
+    try:
+        for block in follow_lines(data_file, header_file, poll_interval, idle_timeout):
+            newest = block[-ring_lines:]
+            ring[(ring_position + np.arange(len(newest))) % ring_lines] = newest
+            ring_position = (ring_position + len(newest)) % ring_lines
+            ring_fill = min(ring_fill + len(block), ring_lines)
+            recent = ring[:ring_fill]
+
+            if ring_fill >= TLM_FRAME_LINES:
+                tlm = np.concatenate((np.mean(recent[:, TLM_FRAME_RANGE['A'][0]:TLM_FRAME_RANGE['A'][1]], axis=1),
+                                      np.mean(recent[:, TLM_FRAME_RANGE['B'][0]:TLM_FRAME_RANGE['B'][1]], axis=1)))
+                block_range = (tlm.min(), tlm.max())
             else:
-                info['rx_time'] = datetime.timedelta(seconds=0.0)
-                info['index'] = 0
-                index = info['nitems']
+                block_range = tuple(np.percentile(recent, (1, 99)))
+            if block_range[1] > block_range[0] or in_range is None:
+                in_range = block_range
+
+            scaled = scale_pixels(block, in_range=in_range)
+            for image_id, columns in image_columns.items():
+                lines = scaled[:, columns[0]:columns[1]]
+                lines.tofile(line_files[image_id])
+                if image_id in pyramids:
+                    add_tile_lines(pyramids[image_id], lines)
+            total_lines += len(block)
+            pending_lines += len(block)
+
+            if pending_lines >= refresh_lines and time.time() >= next_refresh:
+                started = time.time()
+                write_stream_images(line_files, image_columns, total_lines, output_base, direction)
+                for pyramid in pyramids.values():
+                    write_tile_manifest(pyramid)
+                pending_lines = 0
+                next_refresh = time.time() + (time.time() - started) / refresh_share
+
+        if pending_lines:
+            write_stream_images(line_files, image_columns, total_lines, output_base, direction)
+        for pyramid in pyramids.values():
+            finish_tile_pyramid(pyramid)
+    finally:
+        for line_file in line_files.values():
+            line_file.close()
+            os.remove(line_file.name)
+
+    return total_lines
+
+def write_stream_images(line_files, image_columns, lines, output_base, direction):
+    '''Writes the lines decoded so far out as PNGs
+
+    Each image is encoded from its lines file with write_png_rows, to a
+    temporary file that is renamed into place so a viewer polling the
+    output never sees a partial PNG.
 
-            headers.append(info)
+    Args:
+        line_files: Dict of image suffix to the open file its uint8 lines
+            are being appended to
+        image_columns: Dict of image suffix to its (first, last) columns
+        lines: Number of lines written to each file so far
+        output_base: Path prefix for the PNG files
+        direction: Pass to the 'north' or 'south'
+    '''
+    for image_id, line_file in line_files.items():
+        line_file.flush()
+        width = image_columns[image_id][1] - image_columns[image_id][0]
+        frame = np.memmap(line_file.name, dtype=np.uint8, mode='r', shape=(lines, width))
+        output_file = output_base + image_id + '.png'
+        write_png_rows(output_file + '.tmp', frame, direction)
+        os.rename(output_file + '.tmp', output_file)
 
-    return headers
+def write_png_rows(output_file, frame, direction, compress_level=6, block_lines=256):
+    '''Writes an 8 bit grayscale frame out as a PNG a block of rows at a time
+
+    The rows are filtered and deflated block_lines at a time straight from
+    frame (which may be a memmap), so memory use stays the same however
+    tall the image is.
+
+    Args:
+        output_file: PNG file to write
+        frame: 2D uint8 array
+        direction: Pass to the 'north' or 'south'; north passes are flipped
+            so north is up
+        compress_level: zlib compression level, 0 (fastest) to 9 (smallest)
+        block_lines: Number of rows compressed at a time
+    '''
+    lines, width = frame.shape
+    compressor = zlib.compressobj(compress_level)
+    rows = np.zeros((block_lines, width + 1), dtype=np.uint8)
+    with open(output_file, 'wb') as handle:
+        handle.write(PNG_SIGNATURE)
+        write_png_chunk(handle, b'IHDR', struct.pack('>IIBBBBB', width, lines, 8, 0, 0, 0, 0))
+        for start in range(0, lines, block_lines):
+            if direction == 'north':
+                block = frame[max(lines - start - block_lines, 0):lines - start][::-1, ::-1]
+            else:
+                block = frame[start:start + block_lines]
+            rows[:len(block), 1:] = block
+            write_png_chunk(handle, b'IDAT', compressor.compress(rows[:len(block)].tobytes()))
+        write_png_chunk(handle, b'IDAT', compressor.flush())
+        write_png_chunk(handle, b'IEND', b'')
+
+def write_png_chunk(handle, tag, data):
+    '''Writes one length, tag, data and CRC chunk of a PNG file'''
+    if not data and tag == b'IDAT':
+        return
+    handle.write(struct.pack('>I', len(data)) + tag + data)
+    handle.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+def write_png(output_file, frame, direction, equalize=False, compress_level=6):
+    '''Writes an 8 bit frame out as a grayscale (or RGB) PNG
+
+    Args:
+        output_file: PNG file to write
+        frame: 2D uint8 array, or 3D with a trailing axis of 3 for RGB
+        direction: Pass to the 'north' or 'south'; north passes are flipped
+            so north is up
+        equalize: Equalize the histogram (for frames with no calibration)
+        compress_level: zlib compression level, 0 (fastest) to 9 (smallest)
+    '''
+    if direction == 'north':
+        frame = frame[::-1, ::-1]
+    image = Image.fromarray(frame, GRAYSCALE if frame.ndim == 2 else RGB)
+    if equalize:
+        image = ImageOps.equalize(image)
+    image.save(output_file, format='PNG', compress_level=compress_level)
+
+def start_tile_pyramid(output_dir, width, direction, tile_size=256):
+    '''Starts a tiled image pyramid that is filled in block by block
+
+    Level 0 is full resolution and every level above halves it, up to the
+    first level that fits in a single column of tiles. Tiles are written as
+    <output_dir>/<level>/<row>_<column>.png once all their lines are in, so
+    a viewer can fetch them while a pass (or a mosaic) is still growing.
+
+    Rows are numbered in the order lines were received. For north passes
+    each tile is flipped and the columns mirrored, so north is up when rows
+    are stacked from the bottom; tiles.json records this as its origin.
+
+    Args:
+        output_dir: Directory for the pyramid
+        width: Width of the frame in pixels
+        direction: Pass to the 'north' or 'south'
+        tile_size: Width and height of a tile in pixels
+
+    Returns:
+        Pyramid state to pass to add_tile_lines and finish_tile_pyramid.
+    '''
+    level_count = 1
+    while -(-width // 2 ** (level_count - 1)) > tile_size:
+        level_count += 1
+
+    levels = []
+    for level in range(level_count):
+        level_width = -(-width // 2 ** level)
+        levels.append({'width': level_width, 'columns': -(-level_width // tile_size), 'rows': 0,
+                       'pending': np.zeros((0, level_width), dtype=np.uint8),
+                       'carry': np.zeros((0, level_width), dtype=np.uint8)})
+        if not os.path.isdir(os.path.join(output_dir, str(level))):
+            os.makedirs(os.path.join(output_dir, str(level)))
+
+    return {'output_dir': output_dir, 'direction': direction, 'tile_size': tile_size, 'levels': levels}
+
+def add_tile_lines(pyramid, block, final=False):
+    '''Adds a block of lines to a tile pyramid, writing every completed tile
+
+    Args:
+        pyramid: State from start_tile_pyramid
+        block: 2D uint8 array of the next lines of the frame
+        final: Also write the partial last row of tiles of every level
+    '''
+    tile_size = pyramid['tile_size']
+    lines = block
+    for level, state in enumerate(pyramid['levels']):
+        pending = np.concatenate((state['pending'], lines))
+        complete = len(pending) if final else len(pending) // tile_size * tile_size
+        for start in range(0, complete, tile_size):
+            write_tile_row(pyramid, level, state['rows'], pending[start:start + tile_size])
+            state['rows'] += 1
+        state['pending'] = pending[complete:]
+
+        # Halve the lines for the next level, keeping an odd one for later
+        lines = np.concatenate((state['carry'], lines))
+        if final and len(lines) % 2:
+            lines = np.concatenate((lines, lines[-1:]))
+        pairs = len(lines) // 2 * 2
+        state['carry'] = lines[pairs:]
+        lines = lines[:pairs].astype(np.uint16)
+        if lines.shape[1] % 2:
+            lines = np.concatenate((lines, lines[:, -1:]), axis=1)
+        lines = ((lines[0::2, 0::2] + lines[0::2, 1::2] + lines[1::2, 0::2] + lines[1::2, 1::2] + 2) // 4).astype(np.uint8)
+
+def write_tile_row(pyramid, level, row, lines):
+    '''Writes one row of tiles of a pyramid level
+
+    Args:
+        pyramid: State from start_tile_pyramid
+        level: Pyramid level of the lines
+        row: Row number of the tiles
+        lines: uint8 lines of the row, tile_size of them except at the end
+    '''
+    tile_size = pyramid['tile_size']
+    columns = pyramid['levels'][level]['columns']
+    for column in range(columns):
+        tile = lines[:, column * tile_size:(column + 1) * tile_size]
+        if pyramid['direction'] == 'north':
+            tile = tile[::-1, ::-1]
+            column = columns - 1 - column
+        tile_file = os.path.join(pyramid['output_dir'], str(level), '{}_{}.png'.format(row, column))
+        Image.fromarray(tile, GRAYSCALE).save(tile_file + '.tmp', format='PNG')
+        os.rename(tile_file + '.tmp', tile_file)
+
+def finish_tile_pyramid(pyramid):
+    '''Writes the last partial tiles of a pyramid and its tiles.json
+
+    Args:
+        pyramid: State from start_tile_pyramid
+    '''
+    add_tile_lines(pyramid, np.zeros((0, pyramid['levels'][0]['width']), dtype=np.uint8), final=True)
+    write_tile_manifest(pyramid)
+
+def write_tile_manifest(pyramid):
+    '''Writes tiles.json describing the tiles of a pyramid written so far
+
+    Args:
+        pyramid: State from start_tile_pyramid
+    '''
+    manifest = {'tile_size': pyramid['tile_size'],
+                'origin': 'bottom' if pyramid['direction'] == 'north' else 'top',
+                'levels': [{'width': state['width'], 'columns': state['columns'], 'rows': state['rows']}
+                           for state in pyramid['levels']]}
+    manifest_file = os.path.join(pyramid['output_dir'], 'tiles.json')
+    with open(manifest_file + '.tmp', 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+    os.rename(manifest_file + '.tmp', manifest_file)
 
 ################################################################################
 # Define some constants and useful derived constants
@@ -216,8 +1420,18 @@ SYNC_WIDTH = 39
 SPACE_MARK_WIDTH = 47
 IMAGE_WIDTH = 909
 TLM_FRAME_WIDTH = 45
+TLM_FRAME_LINES = 128
+TLM_WEDGES = 16
+TLM_WEDGE_LINES = TLM_FRAME_LINES // TLM_WEDGES
+TLM_ZERO_MOD_WEDGE = 8
 FULL_CHANNEL_WIDTH = SYNC_WIDTH + SPACE_MARK_WIDTH + IMAGE_WIDTH + TLM_FRAME_WIDTH
 FULL_LINE_WIDTH = FULL_CHANNEL_WIDTH * 2
+LINES_PER_SECOND = 2
+SAMPLE_RATE = FULL_LINE_WIDTH * LINES_PER_SECOND
+
+# Sync A is 7 cycles of a 1040 Hz square wave, Sync B 7 pulses at 832 pps
+SYNC_A_PATTERN = (0, 0, 0, 0) + (1, 1, 0, 0) * 7 + (0,) * 7
+SYNC_B_PATTERN = (0, 0, 0, 0) + (1, 1, 1, 0, 0) * 7
 
 SYNC_RANGE = {'A':(0, SYNC_WIDTH),
               'B':(FULL_CHANNEL_WIDTH, FULL_CHANNEL_WIDTH + SYNC_WIDTH)}
@@ -229,296 +1443,776 @@ TLM_FRAME_RANGE = {'A':(IMAGE_RANGE['A'][1], IMAGE_RANGE['A'][1] + TLM_FRAME_WID
                    'B':(IMAGE_RANGE['B'][1], IMAGE_RANGE['B'][1] + TLM_FRAME_WIDTH)}
 
 BYTES_PER_FLOAT = 4
+SAMPLE_DTYPE = np.dtype('<f4')
+HEADER_INDEX_DTYPE = np.dtype([('offset', '<i8'), ('nitems', '<i8'), ('rx_rate', '<f8'),
+                               ('rx_time', '<f8'), ('has_SyncA', '?')])
 GRAYSCALE = 'L'
+RGB = 'RGB'
+TILE_SIZE = 256
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+PLANCK_C1 = 1.1910427e-5
+PLANCK_C2 = 1.4387752
+
+# Cold to warm colour stops of the thermal ramp, evenly spaced
+THERMAL_PALETTE = ((1.0, 1.0, 1.0), (0.6, 0.0, 0.8), (0.0, 0.0, 1.0), (0.0, 0.8, 1.0),
+                   (0.0, 0.8, 0.0), (1.0, 1.0, 0.0), (1.0, 0.5, 0.0), (0.8, 0.0, 0.0))
+SST_RANGE = (271.0, 305.0)
+KELVIN_RANGE = (150.0, 350.0)                   # Kelvin covered by the composite tables
+KELVIN_STEP = 0.25
+KELVIN_BINS = int(round((KELVIN_RANGE[1] - KELVIN_RANGE[0]) / KELVIN_STEP)) + 1
+COMPOSITES = {'thermal': composite_thermal, 'vis-ir': composite_vis_ir, 'sst': composite_sst}
+IR_COMPOSITES = ('thermal',)
+
+PASS_COLUMNS = [('input_file', 'TEXT PRIMARY KEY'), ('spacecraft', 'TEXT'), ('direction', 'TEXT'),
+                ('recorded', 'TEXT'), ('decoded', 'TEXT'), ('duration_s', 'REAL'), ('lines', 'INTEGER'),
+                ('syncs', 'INTEGER'), ('sync_ratio', 'REAL'), ('linearity', 'REAL'), ('zero_mod', 'INTEGER'),
+                ('bb_temp', 'REAL'), ('patch_temp', 'REAL'), ('a_channel', 'TEXT'), ('a_min_k', 'REAL'),
+                ('a_max_k', 'REAL'), ('b_channel', 'TEXT'), ('b_min_k', 'REAL'), ('b_max_k', 'REAL'),
+                ('record', 'TEXT')]
+CAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration', 'avhrr.json')
+DEFAULT_SPACECRAFT = 'NOAA-19'
+DEFAULT_DIRECTION = 'north'
+SPACECRAFT_PATTERN = re.compile(r'(?<![a-z])(?:noaa|n)[-_ ]?(1[2-9])(?!\d)', re.IGNORECASE)
+DIRECTION_PATTERN = re.compile(r'(?<![a-z])(north|south)(?![a-z])', re.IGNORECASE)
+
+# Compiled calibration registries by SHA-1 of their JSON, see load_calibration
+calibration_registry = {}
+composite_luts = {}
 
 ################################################################################
-# Parse CLI Arguments
+# Decoding
 ################################################################################
-parser = argparse.ArgumentParser()
-parser.add_argument('input_file', help='Raw APT demodulated data file')
-parser.add_argument('-s', '--spacecraft', default='NOAA-19', help='Spacecraft captured (for calibration)')
-parser.add_argument('-d', '--direction', default='north', help='Pass to the \'north\' or \'south\'')
-parser.add_argument('-a', '--all', action='store_true', default=False, help='Show all data lines, not just aligned')
-args = parser.parse_args()
-
-input_file_directory = os.path.dirname(args.input_file) + '/'
-input_filename_base, _ = os.path.splitext(os.path.basename(args.input_file))
-header_file = input_file_directory + os.path.basename(args.input_file) + '.hdr'
-
-with open('calibration/avhrr.json') as avhrr_cal_json:
-    avhrr_cal = json.load(avhrr_cal_json)
-
-CAL_DATA = avhrr_cal['CAL_DATA']
-AVHRR_CHANNELS = avhrr_cal['AVHRR_CHANNELS']
-
-spacecraft = args.spacecraft
-if spacecraft not in CAL_DATA:
-    print('Warning spacecraft {} not found in calibration data. Defaulting to NOAA-19'.format(spacecraft))
-    spacecraft = 'NOAA-19'
-
-# Parse the header file to find the SyncA markers
-has_header = os.path.isfile(header_file)
-syncs = []
-if has_header:
-    print('Opening {}'.format(header_file))
-
-    headers = parse_gnuradio_header(header_file)
-    start = datetime.datetime.now()
-    # time_marks = [start + header['rx_time'] for header in headers]
-    # for mark in time_marks:
-    #     print mark
-    last_rx_time = headers[-1]['rx_time']
-    samples_delta = headers[-1]['nitems'] / headers[-1]['rx_rate']
-    samples_delta = datetime.timedelta(seconds=samples_delta)
-    end = start + (last_rx_time + samples_delta)
-    capture_duration = end - start
-    # print 'Capture Start:    {}'.format(start)
-    # print 'Capture Finish:   {}'.format(end)
-    # print 'Capture Duration: {}'.format(end - start)
-    syncs = headers
-    # debug = False
-    # current_position = 0
-    # with open(header_file, 'rb') as handle:
-    #     file_length = os.path.getsize(header_file)
-    #     while True:
-    #
-    #         if (file_length - handle.tell()) < parse_file_metadata.HEADER_LENGTH:
-    #             break
-    #
-    #         header_str = handle.read(parse_file_metadata.HEADER_LENGTH)
-    #
-    #         try:
-    #             header = pmt.deserialize_str(header_str)
-    #         except RuntimeError:
-    #             sys.stderr.write('Could not deserialize header: invalid or corrupt data file.\n')
-    #             sys.exit(1)
-    #
-    #         info = parse_file_metadata.parse_header(header, debug)
-    #         if info['nbytes'] == 0:
-    #             break
-    #
-    #         if(info['extra_len'] > 0):
-    #             extra_str = handle.read(info['extra_len'])
-    #             if(len(extra_str) == 0):
-    #                 break
-    #
-    #             try:
-    #                 extra = pmt.deserialize_str(extra_str)
-    #             except RuntimeError:
-    #                 sys.stderr.write('Could not deserialize extras: invalid or corrupt data file.\n')
-    #                 sys.exit(1)
-    #
-    #             extra_info = parse_file_metadata.parse_extra_dict(extra, info, debug)
-    #
-    #         if 'SyncA' in info:
-    #             info['index'] = current_position - SYNC_WIDTH
-    #             syncs.append(info)
-    #
-    #         current_position = current_position + info['nitems']
-
-else:
-    print('No Header File Found - Raw Processing')
-
-# sys.exit(1)
-
-
-print('Opening {}'.format(args.input_file))
-with open(args.input_file, 'rb') as raw_data:
-    raw_bytes = bytearray(raw_data.read())
-
-samples_found = len(raw_bytes) // BYTES_PER_FLOAT
-
-unpack_format = '<' + ('f' * samples_found)
-pixels = list(struct.unpack(unpack_format, raw_bytes))
-
-file_duration = datetime.timedelta(seconds = len(pixels) / (FULL_LINE_WIDTH * 2))
-print('Capture Duration: {}'.format(capture_duration))
-
-print('Aligning Sync Signals')
-sync_ratio = 0
-
-if len(syncs):
-    pre_syncs = []
-    new_pixels = []
-    sync_lines = []
-    # print syncs[1]
-    # print next(header for header in syncs if 'SyncA' in header)
-    first_sync = next(header for header in syncs if 'SyncA' in header)
-    print first_sync
-    pre_syncs = pixels[0:first_sync['index']]
-    # pre_syncs = pixels[0:syncs[0]['index']]
-    additional_pixels = FULL_LINE_WIDTH - (len(pre_syncs) % FULL_LINE_WIDTH)
-    pre_syncs = ([0] * additional_pixels) + pre_syncs
-    pre_syncs = [list(line) for line in grouper(FULL_LINE_WIDTH, pre_syncs, 0)]
-
-    i = 0
-    for sync in syncs:
-        sync_lines.append(i)
-        pixel_set = pixels[sync['index']:sync['index'] + sync['nitems']]
-        pixel_set = [list(line) for line in grouper(FULL_LINE_WIDTH, pixel_set, pixel_set[-1])]
-        if all(x == pixel_set[-1][0] for x in pixel_set[-1]):
-            del pixel_set[-1]
-        i += len(pixel_set)
-        new_pixels.extend(pixel_set)
-
-    aligned_start = len(pre_syncs)
-    pixels = new_pixels
-    sync_ratio = len(syncs)/float(len(pixels))
-    if args.all:
-        pixels = pre_syncs + new_pixels
-
-else:
-    print('No Syncs Found - Minimal Processing')
-    pixels = [list(line) for line in grouper(FULL_LINE_WIDTH, pixels, 0)]
-    pixels = scale_pixels(pixels)
-
-
-plt.imshow(pixels)
-plt.show()
-sync_ratio = len(syncs)/float(len(pixels))
-
-if sync_ratio > 0.05:
-    print('Telemetry Processing - Find Analog to Digital Range From Wedges'.format(spacecraft))
-    a_tlm = [line[TLM_FRAME_RANGE['A'][0]:TLM_FRAME_RANGE['A'][1]] for line in pixels]
-    b_tlm = [line[TLM_FRAME_RANGE['B'][0]:TLM_FRAME_RANGE['B'][1]] for line in pixels]
-    a_telemetry, _ = process_tlm2(a_tlm)
-    b_telemetry, _ = process_tlm2(b_tlm)
-    unified_tlm = [sum(x)/2 for x in zip(a_telemetry[0:14], b_telemetry[0:14])]
-    telemetry = {'wedges':unified_tlm[0:8], 'zero_mod':unified_tlm[8]}
-
-    print('Scaling to wedge calibration')
-    pixels = [np.clip(line, telemetry['zero_mod'], telemetry['wedges'][-1]) for line in pixels]
-    pixels = scale_pixels(pixels)
-
-    print('Reprocessing of Telemetry for {}'.format(spacecraft))
-    a_tlm = [line[TLM_FRAME_RANGE['A'][0]:TLM_FRAME_RANGE['A'][1]] for line in pixels]
-    b_tlm = [line[TLM_FRAME_RANGE['B'][0]:TLM_FRAME_RANGE['B'][1]] for line in pixels]
-    a_telemetry, tlm_a_strip = process_tlm(a_tlm)
-    b_telemetry, tlm_b_strip = process_tlm(b_tlm)
-    unified_tlm = [int(round(sum(x)/2)) for x in zip(a_telemetry[0:14], b_telemetry[0:14])]
-    telemetry = {'wedges':unified_tlm[0:8], 'zero_mod':unified_tlm[8],
-                 'bb_thermistors':unified_tlm[9:13], 'patch_thermistor':unified_tlm[13],
-                 'a_bb':a_telemetry[14], 'a_channel':a_telemetry[15], 'a_space':0,
-                 'b_bb':b_telemetry[14], 'b_channel':b_telemetry[15], 'b_space':0}
-
-    ideal_curve = [int(255 * (i / len(telemetry['wedges']))) for i in range(len(telemetry['wedges'])+ 1)]
-    initial_curve = [telemetry['zero_mod']] + telemetry['wedges']
-    data_fit = scipy.stats.linregress(ideal_curve, initial_curve)
-    telemetry['a_channel'] = closest(telemetry['a_channel'], telemetry['wedges'])+1
-    telemetry['b_channel'] = closest(telemetry['b_channel'], telemetry['wedges'])+1
-    telemetry['prt_temps'] = [avhrr_prt_cal(telemetry['bb_thermistors'][j], CAL_DATA[spacecraft]['a'][j]) for j in range(0, 4)]
-    telemetry['bb_temp'] = avhrr_bb_temp(telemetry['prt_temps'], CAL_DATA[spacecraft]['b'])
-    telemetry['patch_temp'] = (0.124 * telemetry['patch_thermistor']) + 90.113
-    a_info = AVHRR_CHANNELS[str(telemetry['a_channel'])]
-    b_info = AVHRR_CHANNELS[str(telemetry['b_channel'])]
-
-    a_space_mark = [line[SPACE_MARK_RANGE['A'][0]:SPACE_MARK_RANGE['A'][1]] for line in pixels]
-    b_space_mark = [line[SPACE_MARK_RANGE['B'][0]:SPACE_MARK_RANGE['B'][1]] for line in pixels]
-    telemetry['a_space'], raw_a_space_mark_strip = space_view(a_space_mark)
-    telemetry['b_space'], raw_b_space_mark_strip = space_view(b_space_mark)
-
-    print('Image Information:')
-    print('\tFrame A: AVHRR Channel {} - {} - {}'.format(a_info['channel_id'], a_info['type'], a_info['description']))
-    print('\tFrame B: AVHRR Channel {} - {} - {}'.format(b_info['channel_id'], b_info['type'], b_info['description']))
-    print('\tWedges: {}'.format(telemetry['wedges']))
-    print('\tZero Mod Ref: {}'.format(telemetry['zero_mod']))
-    print('\tA Blackbody/Space: {:3} / {:3}'.format(telemetry['a_bb'], telemetry['a_space']))
-    print('\tB Blackbody/Space: {:3} / {:3}'.format(telemetry['b_bb'], telemetry['b_space']))
-    print('\tPRTs (counts): {}'.format(' '.join(['{:<9.0f}'.format(samp) for samp in telemetry['bb_thermistors']])))
-    print('\tPRTs (Kelvin): {}'.format('  '.join(['{:.2f} K'.format(temp) for temp in telemetry['prt_temps']])))
-    print('\tBlackbody Ref Temp: {:.2f} K'.format(telemetry['bb_temp']))
-    print('\tPatch Temp: {:.0f} cnts -- {:.2f} K'.format(telemetry['patch_thermistor'], telemetry['patch_temp']))
-
-    print('Image Reception Quality:')
-    print('\tSyncs ({})/Lines ({}) Ratio: {:.2%}'.format(len(syncs), len(pixels), sync_ratio))
-    print('\tCalibration Linearity: {:.4%}'.format(data_fit.rvalue))
+@contextlib.contextmanager
+def stage(report, name, samples=0):
+    '''Records the time and memory a stage of the pipeline takes
 
-    print('Generating Calibration Curve Plots')
-    # plt.style.use('dark_background')
-    plt.suptitle(spacecraft, fontsize=15, fontweight='bold')
-
-    plt.figure(0, figsize=(8.5, 11))
-    plt.suptitle(spacecraft, fontsize=15, fontweight='bold')
-    # plt.subplot(411)
-    plt.subplot2grid((3,2), (0,1))
-    handle_ideal, = plt.plot(ideal_curve, ideal_curve, 'g-', label='Ideal')
-    handle_initial, _ = plt.plot(ideal_curve, initial_curve, 'r-', ideal_curve, initial_curve, 'r^', label='Received')
-    plt.axis([0, 255, 0, 255])
-    plt.xlabel('Ideal Curve Points')
-    plt.ylabel('Received Curve Points')
-    plt.title('Analog to Digital Cal Curve')
-    plt.legend(handles=[handle_ideal, handle_initial], loc=4)
-    plt.grid(b=True, which='major', color='grey', linestyle='--')
-    plt.xticks(ideal_curve)
-    plt.yticks(ideal_curve)
-    # plt.savefig(input_file_directory + 'plot_cal_curves.png')
-
-    # print('Generating Telemetry Text-Only Plot')
-    # plt.figure(3, figsize=(10, 5))
-    # plt.subplot(412)
-    plt.subplot2grid((3,2), (0,0))
-    plt.axis('off')
-    plt.text(0, 0.95, 'Frame A: AVHRR Channel {} - {} - {}'.format(a_info['channel_id'], a_info['type'], a_info['description']))
-    plt.text(0, 0.90, 'Frame B: AVHRR Channel {} - {} - {}'.format(b_info['channel_id'], b_info['type'], b_info['description']))
-    plt.text(0, 0.85, 'PRTs: {}'.format('  '.join(['{:.2f} K'.format(temp) for temp in telemetry['prt_temps']])))
-    plt.text(0, 0.80, 'Blackbody Ref Temp: {:.2f} K'.format(telemetry['bb_temp']))
-    plt.text(0, 0.75, 'Patch Temp: {:.2f} K'.format(telemetry['patch_temp']))
+    Appends a span to report['stages'] with the wall and CPU seconds, the
+    growth of the peak RSS and, when tracemalloc is tracing (e.g. with
+    PYTHONTRACEMALLOC=1), the traced memory added and the traced peak.
+
+    Args:
+        report: Run report dict from start_report
+        name: Name of the stage
+        samples: Number of samples (or pixels) the stage works through
+
+    Yields:
+        The span dict, so the sample count can be filled in once known.
+    '''
+    span = {'name': name, 'samples': samples}
+    tracing = tracemalloc is not None and tracemalloc.is_tracing()
+    if tracing:
+        traced_start, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+    rss_start = peak_rss()
+    cpu_start = sum(os.times()[:2])
+    wall_start = time.time()
+    try:
+        yield span
+    finally:
+        span['wall_s'] = time.time() - wall_start
+        span['cpu_s'] = sum(os.times()[:2]) - cpu_start
+        span['peak_rss_kb'] = peak_rss()
+        span['peak_rss_growth_kb'] = span['peak_rss_kb'] - rss_start
+        if tracing:
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            span['traced_kb'] = (traced - traced_start) // 1024
+            span['traced_peak_kb'] = (traced_peak - traced_start) // 1024
+        report['stages'].append(span)
+
+def peak_rss():
+    '''Peak resident set size of the process so far in kB (0 if unknown)'''
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+def start_report(input_file):
+    '''Starts the run report of a decode
+
+    Args:
+        input_file: Raw APT demodulated data file being decoded
+
+    Returns:
+        A report dict to record stages in and finish with finish_report.
+    '''
+    return {'input_file': input_file, 'started': datetime.datetime.utcnow().isoformat() + 'Z',
+            'stages': [], 'wall_start': time.time(), 'cpu_start': sum(os.times()[:2])}
+
+def finish_report(report, report_file=None):
+    '''Totals a run report and optionally writes it out as JSON
 
+    Args:
+        report: Run report dict from start_report
+        report_file: JSON file to write the report to, or None
+    '''
+    report['wall_s'] = time.time() - report.pop('wall_start')
+    report['cpu_s'] = sum(os.times()[:2]) - report.pop('cpu_start')
+    report['peak_rss_kb'] = peak_rss()
+    if report_file:
+        with open(report_file, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+
+def capture_output_base(input_file):
+    '''Path prefix the F/A/B images of a capture are written with
+
+    Args:
+        input_file: Raw APT demodulated data file
+
+    Returns:
+        The capture's path without its extension, e.g. passes/n19.dat ->
+        passes/n19 (written as passes/n19F.png and so on).
+    '''
+    return os.path.splitext(input_file)[0]
+
+def pass_info(input_file, spacecraft=None, direction=None):
+    '''Works out the spacecraft and pass direction of a capture
+
+    Values that are supplied win. Anything missing is inferred from the
+    capture's file name (e.g. noaa18_north.dat or N19_south_0412.dat) and
+    then falls back to DEFAULT_SPACECRAFT / DEFAULT_DIRECTION.
+
+    Args:
+        input_file: Raw APT demodulated data file
+        spacecraft: Spacecraft name, e.g. 'NOAA-19', or None to infer
+        direction: 'north' or 'south', or None to infer
+
+    Returns:
+        A (spacecraft, direction) tuple.
+    '''
+    name = os.path.basename(input_file)
+    if spacecraft is None:
+        match = SPACECRAFT_PATTERN.search(name)
+        spacecraft = 'NOAA-' + match.group(1) if match else DEFAULT_SPACECRAFT
+    if direction is None:
+        match = DIRECTION_PATTERN.search(name)
+        direction = match.group(1).lower() if match else DEFAULT_DIRECTION
+
+    return spacecraft, direction
+
+def outputs_up_to_date(input_file, tiles=False, composites=(), plot=False, report=False):
+    '''Checks whether a capture's outputs are newer than everything they use
+
+    The outputs checked are the ones listed in the capture's quality record
+    by the last decode as well as the ones the given decode() options ask
+    for. A composite or telemetry plot the last decode was also asked for
+    but did not write (both frames IR, no telemetry) is not required, as
+    decoding again would not write it either.
+
+    Args:
+        input_file: Raw APT demodulated data file
+        tiles: Require the tile pyramid of the full frame
+        composites: Names of the false colour products to require
+        plot: Require the telemetry plot
+        report: Require the stage timing report
+
+    Returns:
+        True if every output exists and is newer than the capture, its
+        header (if any) and the calibration data.
+    '''
+    output_base = capture_output_base(input_file)
+    quality = load_quality(input_file) or {}
+    requested = quality.get('options', {})
+    output_files = [os.path.join(os.path.dirname(input_file), name) for name in quality.get('outputs', [])]
+    output_files.append(output_base + 'F.png')
+    if tiles:
+        output_files.append(output_base + 'F_tiles')
+    output_files += [output_base + '_' + product + '.png' for product in composites
+                     if product not in requested.get('composites', [])]
+    if plot and not requested.get('plot'):
+        output_files.append(output_base + '_telemetry.png')
+    if report:
+        output_files.append(output_base + '_report.json')
+    if not all(os.path.exists(output_file) for output_file in output_files):
+        return False
+
+    sources = [input_file, input_file + '.hdr', CAL_FILE]
+    newest_source = max(os.path.getmtime(source) for source in sources if os.path.isfile(source))
+    return min(os.path.getmtime(output_file) for output_file in output_files) >= newest_source
+
+def quality_file(input_file):
+    '''Path of the JSON pass quality record written alongside a capture's images'''
+    return capture_output_base(input_file) + '_quality.json'
+
+def finite_or_none(value):
+    '''Replaces the NaN and infinite floats in a JSON record with None
+
+    Calibrations without valid telemetry (a blackbody reading no different
+    from space, no calibrated pixels) give NaN, which json writes as a bare
+    NaN that is not JSON.
+
+    Args:
+        value: Dict, list or scalar of a record, nested to any depth
+
+    Returns:
+        A copy of value with every non-finite float replaced by None.
+    '''
+    if isinstance(value, dict):
+        return dict((key, finite_or_none(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [finite_or_none(item) for item in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def load_quality(input_file):
+    '''Loads the pass quality record of an already decoded capture
+
+    Args:
+        input_file: Raw APT demodulated data file
+
+    Returns:
+        The quality record dict written by decode(), or None if there is none.
+    '''
+    try:
+        with open(quality_file(input_file)) as handle:
+            return json.load(handle)
+    except (IOError, ValueError):
+        return None
+
+def pass_row(quality):
+    '''Flattens a pass quality record into a PASS_COLUMNS database row
+
+    Args:
+        quality: Quality record dict from decode()
+
+    Returns:
+        A tuple of values in PASS_COLUMNS order, with the whole record as
+        JSON in the last column.
+    '''
+    telemetry = quality['telemetry'] or {}
+    frames = quality['frames']
+    values = dict(quality, bb_temp=telemetry.get('bb_temp'), patch_temp=telemetry.get('patch_temp'),
+                  zero_mod=telemetry.get('zero_mod'), record=json.dumps(finite_or_none(quality), sort_keys=True, allow_nan=False))
+    for frame in ('A', 'B'):
+        info = frames.get(frame, {})
+        for key in ('channel', 'min_k', 'max_k'):
+            values[frame.lower() + '_' + key] = info.get(key)
+    return tuple(values[column] for column, _ in PASS_COLUMNS)
+
+def record_passes(database, records):
+    '''Adds pass quality records to a SQLite pass database
+
+    The passes table is created if needed and keyed on the capture path, so
+    decoding a capture again replaces its row.
+
+    Args:
+        database: Path of the SQLite database file
+        records: Iterable of quality record dicts from decode()
+
+    Returns:
+        The number of passes written.
+    '''
+    rows = [pass_row(quality) for quality in records if quality]
+    connection = sqlite3.connect(database, timeout=30)
+    try:
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS passes ({})'.format(
+                ', '.join('{} {}'.format(column, kind) for column, kind in PASS_COLUMNS)))
+            connection.executemany('INSERT OR REPLACE INTO passes VALUES ({})'.format(
+                ', '.join('?' * len(PASS_COLUMNS))), rows)
+    finally:
+        connection.close()
+    return len(rows)
+
+def plot_telemetry(output_file, spacecraft, telemetry, a_info, b_info, ideal_curve, initial_curve,
+                   tlm_strips, space_strips):
+    '''Renders the calibration, telemetry and space view summary of a pass
+
+    Drawn on an Agg canvas with the object-oriented API so it works without a
+    display and leaves no pyplot state behind between passes.
+
+    Args:
+        output_file: PNG file to write the figure to
+        spacecraft: Spacecraft name used as the title
+        telemetry: Telemetry dict from decode()
+        a_info: AVHRR channel information for frame A
+        b_info: AVHRR channel information for frame B
+        ideal_curve: Ideal wedge counts
+        initial_curve: Received wedge counts (zero mod ref and wedges)
+        tlm_strips: (A, B) telemetry strip means per line
+        space_strips: (A, B) space view means per line
+    '''
+    tlm_a_strip, tlm_b_strip = tlm_strips
+    raw_a_space_mark_strip, raw_b_space_mark_strip = space_strips
+    strip_length = max(len(tlm_a_strip), len(tlm_b_strip))
+    line_ticks = np.arange(0, len(tlm_a_strip), 16*8)
+
+    figure = Figure(figsize=(8.5, 11))
+    FigureCanvasAgg(figure)
+    figure.suptitle(spacecraft, fontsize=15, fontweight='bold')
+    grid = GridSpec(3, 2)
+
+    print('Generating Calibration Curve Plots')
+    axes = figure.add_subplot(grid[0, 1])
+    handle_ideal, = axes.plot(ideal_curve, ideal_curve, 'g-', label='Ideal')
+    handle_initial, _ = axes.plot(ideal_curve, initial_curve, 'r-', ideal_curve, initial_curve, 'r^', label='Received')
+    axes.axis([0, 255, 0, 255])
+    axes.set_xlabel('Ideal Curve Points')
+    axes.set_ylabel('Received Curve Points')
+    axes.set_title('Analog to Digital Cal Curve')
+    axes.legend(handles=[handle_ideal, handle_initial], loc=4)
+    axes.grid(True, which='major', color='grey', linestyle='--')
+    axes.set_xticks(ideal_curve)
+    axes.set_yticks(ideal_curve)
+
+    axes = figure.add_subplot(grid[0, 0])
+    axes.axis('off')
+    axes.text(0, 0.95, 'Frame A: AVHRR Channel {} - {} - {}'.format(a_info['channel_id'], a_info['type'], a_info['description']))
+    axes.text(0, 0.90, 'Frame B: AVHRR Channel {} - {} - {}'.format(b_info['channel_id'], b_info['type'], b_info['description']))
+    axes.text(0, 0.85, 'PRTs: {}'.format('  '.join(['{:.2f} K'.format(temp) for temp in telemetry['prt_temps']])))
+    axes.text(0, 0.80, 'Blackbody Ref Temp: {:.2f} K'.format(telemetry['bb_temp']))
+    axes.text(0, 0.75, 'Patch Temp: {:.2f} K'.format(telemetry['patch_temp']))
 
     print('Generating Plot of Raw Telemetry Strips')
-    # plt.figure(1, figsize=(12, 5))
-    # plt.subplot(413)
-    plt.subplot2grid((3,2), (1,0), colspan=2)
-    plt.axis([0, max(len(tlm_a_strip), len(tlm_b_strip)), 0, 255])
-    plt.xlabel('Line Number')
-    plt.ylabel('Counts')
-    plt.title('Telemetry Strips')
-    plt.plot(tlm_a_strip, 'g', label='Channel A')
-    plt.plot(tlm_b_strip, 'b', label='Channel B')
-    plt.grid(b=True, which='major', color='grey', linestyle='--')
-    plt.xticks(np.arange(0, len(tlm_a_strip), 16*8))
-    plt.yticks(ideal_curve)
-    # plt.savefig(input_file_directory + 'plot_tlm_strips.png')
+    axes = figure.add_subplot(grid[1, :])
+    axes.axis([0, strip_length, 0, 255])
+    axes.set_xlabel('Line Number')
+    axes.set_ylabel('Counts')
+    axes.set_title('Telemetry Strips')
+    axes.plot(tlm_a_strip, 'g', label='Channel A')
+    axes.plot(tlm_b_strip, 'b', label='Channel B')
+    axes.grid(True, which='major', color='grey', linestyle='--')
+    axes.set_xticks(line_ticks)
+    axes.set_yticks(ideal_curve)
 
     print('Generating Plot of Space View')
-    # plt.figure(2, figsize=(12, 5))
-    # plt.subplot(414)
-    plt.subplot2grid((3,2), (2,0), colspan=2)
-    plt.axis([0, max(len(tlm_a_strip), len(tlm_b_strip)), 0, 255])
-    plt.xlabel('Line Number')
-    plt.ylabel('Counts')
-    plt.title('Space View Strips')
-    raw_a_space_smoothed = moving_average(raw_a_space_mark_strip, 30)
-    raw_b_space_smoothed = moving_average(raw_b_space_mark_strip, 30)
-    plt.plot(raw_a_space_mark_strip, 'g', label='Channel A')
-    plt.plot(raw_a_space_smoothed, 'r--')
-    plt.plot(raw_b_space_mark_strip, 'b', label='Channel B')
-    plt.plot(raw_b_space_smoothed, 'r--')
-    plt.legend(loc='center right')
-    plt.xticks(np.arange(0, len(tlm_a_strip), 16*8))
-    plt.yticks(ideal_curve)
-    plt.grid(b=True, which='major', color='grey', linestyle='--')
-    # plt.savefig(input_file_directory + 'plot_space_view.png')
-    plt.savefig(input_file_directory + 'plot_telemetry.png')
-# else:
-
-
-raw_images = {}
-raw_images['F'] = pixels
-if len(syncs):
-    raw_images['A'] = [line[IMAGE_RANGE['A'][0]:IMAGE_RANGE['A'][1]] for line in pixels]
-    raw_images['B'] = [line[IMAGE_RANGE['B'][0]:IMAGE_RANGE['B'][1]] for line in pixels]
-
-for image in raw_images:
-    lines = len(raw_images[image])
-    width = len(raw_images[image][0])
-    pixels = [item for sublist in raw_images[image] for item in sublist]
-
-    output_file = input_file_directory + input_filename_base + image + '.png'
-    image = Image.new(GRAYSCALE, (width, lines))
-    image.putdata(pixels)
-    if args.direction == 'north':
-        image = image.rotate(180)
+    axes = figure.add_subplot(grid[2, :])
+    axes.axis([0, strip_length, 0, 255])
+    axes.set_xlabel('Line Number')
+    axes.set_ylabel('Counts')
+    axes.set_title('Space View Strips')
+    axes.plot(raw_a_space_mark_strip, 'g', label='Channel A')
+    axes.plot(moving_average(raw_a_space_mark_strip, 30), 'r--')
+    axes.plot(raw_b_space_mark_strip, 'b', label='Channel B')
+    axes.plot(moving_average(raw_b_space_mark_strip, 30), 'r--')
+    axes.legend(loc='center right')
+    axes.set_xticks(line_ticks)
+    axes.set_yticks(ideal_curve)
+    axes.grid(True, which='major', color='grey', linestyle='--')
+
+    figure.savefig(output_file)
+
+def decode(input_file, spacecraft=None, direction=None, show_all=False, resample=True, show=False, plot=False,
+           compress_level=6, tiles=False, composites=(), report=False, profile=False, tle_file=None):
+    '''Decodes a demodulated APT capture into images and telemetry
+
+    Args:
+        input_file: Raw APT demodulated data file
+        spacecraft: Spacecraft captured (for calibration), None to infer
+        direction: Pass to the 'north' or 'south', None to infer
+        show_all: Keep the lines before the first sync as well
+        resample: Resample lines onto an exact grid to correct drift
+        show: Display the raw frame in a matplotlib window (needs a display)
+        plot: Render the telemetry summary as <base>_telemetry.png
+        compress_level: PNG zlib compression level, 0 (fastest) to 9
+        tiles: Also write each image as a tile pyramid in <base>F_tiles etc.
+        composites: Names of false colour products (see COMPOSITES) to write
+            as <base>_<name>.png. When both frames are IR only the products
+            in IR_COMPOSITES are written.
+        report: Write the timings of each stage to <base>_report.json
+        profile: Write cProfile statistics of the decode to <base>.prof
+        tle_file: TLE file to georeference the lines with. The capture is
+            taken to end at the data file's modification time (as when
+            file_meta_sink wrote it), the sub-satellite point of every line
+            is saved as <base>_track.npy (latitude, longitude rows in
+            image order) and, unless given or in the file name, the pass
+            direction is taken from the track.
+
+    Returns:
+        A dict summarising the decode: input_file, spacecraft, direction,
+        lines, sync_ratio, the run report, the quality record and the list
+        of outputs written. The quality record (reception quality,
+        telemetry and the outputs written) is also saved as
+        <base>_quality.json. IR frames with
+        Planck constants in the calibration data also get a float32
+        brightness temperature array saved as <base>A_kelvin.npy etc.
+    '''
+    output_base = capture_output_base(input_file)
+    header_file = input_file + '.hdr'
+    direction_known = direction is not None or DIRECTION_PATTERN.search(os.path.basename(input_file)) is not None
+    run_report = start_report(input_file)
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    calibration = load_calibration()
+    AVHRR_CHANNELS = calibration['channels']
+
+    spacecraft, direction = pass_info(input_file, spacecraft, direction)
+    if spacecraft not in calibration['spacecraft']:
+        print('Warning spacecraft {} not found in calibration data. Defaulting to NOAA-19'.format(spacecraft))
+        spacecraft = 'NOAA-19'
+    spacecraft_cal = calibration['spacecraft'][spacecraft]
+
+    with stage(run_report, 'load') as span:
+        # Parse the header file to find the SyncA markers
+        has_header = os.path.isfile(header_file)
+        syncs = []
+        if has_header:
+            print('Opening {}'.format(header_file))
+
+            headers = load_header_index(header_file)
+            capture_duration = datetime.timedelta(seconds=float(np.sum(headers['nitems'] / headers['rx_rate'])))
+            if headers['has_SyncA'].any():
+                syncs = headers
+        else:
+            print('No Header File Found - Raw Processing')
+
+        print('Opening {}'.format(input_file))
+        pixels = load_samples(input_file)
+
+        file_duration = datetime.timedelta(seconds = len(pixels) / SAMPLE_RATE)
+        if not has_header:
+            capture_duration = file_duration
+        print('Capture Duration: {}'.format(capture_duration))
+        span['samples'] = len(pixels)
+
     if not len(syncs):
-        image = ImageOps.equalize(image)
-    image.save(output_file)
+        with stage(run_report, 'sync detection', len(pixels)):
+            print('Searching for Sync Signals')
+            sync_positions = detect_syncs(pixels)
+            if len(sync_positions):
+                print('\tFound {} syncs'.format(len(sync_positions)))
+                syncs = sync_index(sync_positions, len(pixels))
+
+    with stage(run_report, 'alignment', len(pixels)):
+        print('Aligning Sync Signals')
+        sync_count = 0
+
+        if len(syncs):
+            pixels, sync_count, line_offsets = align_capture(pixels, syncs, resample, show_all)
+
+        else:
+            print('No Syncs Found - Minimal Processing')
+            pixels = frame_lines(pixels, 0)
+            line_offsets = np.arange(len(pixels), dtype=np.int64) * FULL_LINE_WIDTH
+            pixels = scale_pixels(pixels)
+
+
+    if show:
+        import matplotlib.pyplot as plt
+        plt.imshow(pixels)
+        plt.show()
+    sync_ratio = sync_count/float(len(pixels))
+    temperatures = {}
+    kelvin_luts = {}
+    composite_images = {}
+    quality = {'input_file': os.path.abspath(input_file), 'spacecraft': spacecraft, 'direction': direction,
+               'recorded': datetime.datetime.utcfromtimestamp(os.path.getmtime(input_file)).isoformat() + 'Z',
+               'decoded': run_report['started'], 'duration_s': capture_duration.total_seconds(),
+               'lines': len(pixels), 'syncs': sync_count, 'sync_ratio': sync_ratio,
+               'linearity': None, 'telemetry': None, 'frames': {},
+               'options': {'tiles': tiles, 'composites': sorted(composites), 'plot': plot, 'report': report}}
+    output_files = []
+
+    track = None
+    if tle_file:
+        with stage(run_report, 'georeference', len(pixels)):
+            capture_start = os.path.getmtime(input_file) - file_duration.total_seconds()
+            line_times = capture_start + line_offsets / SAMPLE_RATE
+            try:
+                sat = orbit.satellite(orbit.load_tles(tle_file), spacecraft)
+                track = np.column_stack(orbit.subsatellite_track(sat, line_times, orbit.EPHEMERIS_CACHE)).astype(np.float32)
+            except (ImportError, IOError, ValueError) as error:
+                print('Warning could not georeference the capture: {}'.format(error))
+
+        if track is not None:
+            if not direction_known:
+                direction = 'north' if track[-1, 0] > track[0, 0] else 'south'
+                quality['direction'] = direction
+            print('Sub-satellite Track: {:.2f}, {:.2f} to {:.2f}, {:.2f} ({})'.format(
+                track[0, 0], track[0, 1], track[-1, 0], track[-1, 1], direction))
+            quality['track'] = {'start': track[0].tolist(), 'end': track[-1].tolist()}
+            np.save(output_base + '_track.npy', track[::-1] if direction == 'north' else track)
+            output_files.append(output_base + '_track.npy')
+
+    # Two frames of lines hold at least one complete telemetry frame whatever its phase
+    if sync_ratio > 0.05 and len(pixels) >= 2 * TLM_FRAME_LINES:
+        with stage(run_report, 'wedge scaling', pixels.size):
+            print('Telemetry Processing - Find Analog to Digital Range From Wedges'.format(spacecraft))
+            a_tlm = pixels[:, TLM_FRAME_RANGE['A'][0]:TLM_FRAME_RANGE['A'][1]]
+            b_tlm = pixels[:, TLM_FRAME_RANGE['B'][0]:TLM_FRAME_RANGE['B'][1]]
+            a_frames, _ = extract_wedges(a_tlm)
+            b_frames, _ = extract_wedges(b_tlm)
+            unified_tlm = (combine_wedges(a_frames)[0:14] + combine_wedges(b_frames)[0:14]) / 2
+            telemetry = {'wedges':unified_tlm[0:8].tolist(), 'zero_mod':unified_tlm[8]}
+
+            print('Scaling to wedge calibration')
+            np.clip(pixels, telemetry['zero_mod'], telemetry['wedges'][-1], out=pixels)
+            pixels = scale_pixels(pixels)
+
+        with stage(run_report, 'telemetry', len(pixels)):
+            print('Reprocessing of Telemetry for {}'.format(spacecraft))
+            a_tlm = pixels[:, TLM_FRAME_RANGE['A'][0]:TLM_FRAME_RANGE['A'][1]]
+            b_tlm = pixels[:, TLM_FRAME_RANGE['B'][0]:TLM_FRAME_RANGE['B'][1]]
+            a_frames, tlm_a_strip = extract_wedges(a_tlm)
+            b_frames, tlm_b_strip = extract_wedges(b_tlm)
+            a_telemetry = combine_wedges(a_frames)
+            b_telemetry = combine_wedges(b_frames)
+            unified_tlm = np.rint((a_telemetry[0:14] + b_telemetry[0:14]) / 2).astype(int).tolist()
+            a_telemetry = np.rint(a_telemetry).astype(int).tolist()
+            b_telemetry = np.rint(b_telemetry).astype(int).tolist()
+            telemetry = {'wedges':unified_tlm[0:8], 'zero_mod':unified_tlm[8],
+                         'bb_thermistors':unified_tlm[9:13], 'patch_thermistor':unified_tlm[13],
+                         'a_bb':a_telemetry[14], 'a_channel':a_telemetry[15], 'a_space':0,
+                         'b_bb':b_telemetry[14], 'b_channel':b_telemetry[15], 'b_space':0}
+
+            ideal_curve = [int(255 * (i / len(telemetry['wedges']))) for i in range(len(telemetry['wedges'])+ 1)]
+            initial_curve = [telemetry['zero_mod']] + telemetry['wedges']
+            data_fit = scipy.stats.linregress(ideal_curve, initial_curve)
+            telemetry['a_channel'] = closest(telemetry['a_channel'], telemetry['wedges'])+1
+            telemetry['b_channel'] = closest(telemetry['b_channel'], telemetry['wedges'])+1
+            telemetry['prt_temps'] = spacecraft_cal['prt_lut'][np.arange(4), telemetry['bb_thermistors']].tolist()
+            telemetry['bb_temp'] = avhrr_bb_temp(telemetry['prt_temps'], spacecraft_cal['b'])
+            telemetry['patch_temp'] = (0.124 * telemetry['patch_thermistor']) + 90.113
+            a_info = AVHRR_CHANNELS[str(telemetry['a_channel'])]
+            b_info = AVHRR_CHANNELS[str(telemetry['b_channel'])]
+
+            a_space_mark = pixels[:, SPACE_MARK_RANGE['A'][0]:SPACE_MARK_RANGE['A'][1]]
+            b_space_mark = pixels[:, SPACE_MARK_RANGE['B'][0]:SPACE_MARK_RANGE['B'][1]]
+            telemetry['a_space'], raw_a_space_mark_strip, a_space_lines = space_view(a_space_mark)
+            telemetry['b_space'], raw_b_space_mark_strip, b_space_lines = space_view(b_space_mark)
+            space_lines = {'A': a_space_lines, 'B': b_space_lines}
+
+        with stage(run_report, 'calibration', len(pixels)):
+            planck = spacecraft_cal['planck']
+            for frame, info in (('A', a_info), ('B', b_info)):
+                if info['channel_id'] not in planck:
+                    continue
+                kelvin_luts[frame] = ir_temperature_lut(planck[info['channel_id']], telemetry['bb_temp'],
+                                                        telemetry[frame.lower() + '_bb'], space_lines[frame])
+                temperatures[frame] = calibrate_ir(pixels[:, IMAGE_RANGE[frame][0]:IMAGE_RANGE[frame][1]], kelvin_luts[frame])
+
+            ir_frames = [frame for frame in ('B', 'A') if frame in temperatures]
+            if composites and ir_frames:
+                ir_frame = ir_frames[0]
+                visible_frame = 'A' if ir_frame == 'B' else 'B'
+                visible = None if visible_frame in temperatures else pixels[:, IMAGE_RANGE[visible_frame][0]:IMAGE_RANGE[visible_frame][1]]
+                for product in composites:
+                    if visible is None and product not in IR_COMPOSITES:
+                        print('Warning both frames are IR, skipping the {} composite'.format(product))
+                        continue
+                    composite_images[product] = render_composite(product, visible, pixels[:, IMAGE_RANGE[ir_frame][0]:IMAGE_RANGE[ir_frame][1]],
+                                                                 kelvin_luts[ir_frame])
+            elif composites:
+                print('Warning no calibrated IR frame, skipping composites')
+
+        print('Image Information:')
+        print('\tFrame A: AVHRR Channel {} - {} - {}'.format(a_info['channel_id'], a_info['type'], a_info['description']))
+        print('\tFrame B: AVHRR Channel {} - {} - {}'.format(b_info['channel_id'], b_info['type'], b_info['description']))
+        print('\tWedges: {}'.format(telemetry['wedges']))
+        print('\tZero Mod Ref: {}'.format(telemetry['zero_mod']))
+        print('\tA Blackbody/Space: {:3} / {:3}'.format(telemetry['a_bb'], telemetry['a_space']))
+        print('\tB Blackbody/Space: {:3} / {:3}'.format(telemetry['b_bb'], telemetry['b_space']))
+        print('\tPRTs (counts): {}'.format(' '.join(['{:<9.0f}'.format(samp) for samp in telemetry['bb_thermistors']])))
+        print('\tPRTs (Kelvin): {}'.format('  '.join(['{:.2f} K'.format(temp) for temp in telemetry['prt_temps']])))
+        print('\tBlackbody Ref Temp: {:.2f} K'.format(telemetry['bb_temp']))
+        print('\tPatch Temp: {:.0f} cnts -- {:.2f} K'.format(telemetry['patch_thermistor'], telemetry['patch_temp']))
+        for frame in sorted(temperatures):
+            print('\tFrame {} Brightness Temp: {:.2f} K to {:.2f} K'.format(frame, np.nanmin(temperatures[frame]),
+                                                                         np.nanmax(temperatures[frame])))
+
+        print('Image Reception Quality:')
+        print('\tSyncs ({})/Lines ({}) Ratio: {:.2%}'.format(sync_count, len(pixels), sync_ratio))
+        print('\tCalibration Linearity: {:.4%}'.format(data_fit.rvalue))
+
+        quality['linearity'] = float(data_fit.rvalue)
+        quality['telemetry'] = dict((key, np.asarray(value).tolist()) for key, value in telemetry.items())
+        for frame, info in (('A', a_info), ('B', b_info)):
+            quality['frames'][frame] = {'channel': info['channel_id'], 'type': info['type']}
+            if frame in temperatures:
+                quality['frames'][frame]['min_k'] = float(np.nanmin(temperatures[frame]))
+                quality['frames'][frame]['max_k'] = float(np.nanmax(temperatures[frame]))
+
+        if plot:
+            with stage(run_report, 'plot'):
+                plot_telemetry(output_base + '_telemetry.png',
+                               spacecraft, telemetry, a_info, b_info, ideal_curve, initial_curve,
+                               (tlm_a_strip, tlm_b_strip), (raw_a_space_mark_strip, raw_b_space_mark_strip))
+                output_files.append(output_base + '_telemetry.png')
+
+    if pixels.dtype != np.uint8:
+        pixels = scale_pixels(pixels)
+
+    raw_images = {}
+    raw_images['F'] = pixels
+    if len(syncs):
+        raw_images['A'] = pixels[:, IMAGE_RANGE['A'][0]:IMAGE_RANGE['A'][1]]
+        raw_images['B'] = pixels[:, IMAGE_RANGE['B'][0]:IMAGE_RANGE['B'][1]]
+
+    with stage(run_report, 'png output', pixels.size):
+        output_files += [output_base + image_id + '.png' for image_id in sorted(raw_images)]
+        output_files += [output_base + '_' + product + '.png' for product in sorted(composite_images)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(raw_images) + len(composite_images)) as executor:
+            writes = [executor.submit(write_png, output_base + image_id + '.png', raw_images[image_id], direction,
+                                      not len(syncs), compress_level) for image_id in raw_images]
+            writes += [executor.submit(write_png, output_base + '_' + product + '.png', composite_images[product],
+                                       direction, False, compress_level) for product in composite_images]
+            for write in writes:
+                write.result()
+
+    if tiles:
+        with stage(run_report, 'tiles', pixels.size):
+            for image_id in sorted(raw_images):
+                frame = raw_images[image_id]
+                if not len(syncs):
+                    frame = np.asarray(ImageOps.equalize(Image.fromarray(frame, GRAYSCALE)))
+                pyramid = start_tile_pyramid(output_base + image_id + '_tiles', frame.shape[1], direction, TILE_SIZE)
+                for start in range(0, len(frame), TILE_SIZE):
+                    add_tile_lines(pyramid, frame[start:start + TILE_SIZE])
+                finish_tile_pyramid(pyramid)
+                output_files.append(pyramid['output_dir'])
+
+    with stage(run_report, 'temperature output'):
+        for frame in temperatures:
+            kelvin = temperatures[frame]
+            if direction == 'north':
+                kelvin = kelvin[::-1, ::-1]
+            output_file = output_base + frame + '_kelvin.npy'
+            output_files.append(output_file)
+            np.save(output_file, kelvin)
+
+    quality['outputs'] = [os.path.basename(output_file) for output_file in output_files]
+    quality = finite_or_none(quality)
+    with open(quality_file(input_file), 'w') as handle:
+        json.dump(quality, handle, indent=2, sort_keys=True, allow_nan=False)
+    output_files.append(quality_file(input_file))
+
+    if profile:
+        profiler.disable()
+        profiler.dump_stats(output_base + '.prof')
+        output_files.append(output_base + '.prof')
+    if report:
+        output_files.append(output_base + '_report.json')
+    finish_report(run_report, output_base + '_report.json' if report else None)
+
+    return {'input_file': input_file, 'spacecraft': spacecraft, 'direction': direction,
+            'lines': len(pixels), 'sync_ratio': sync_ratio, 'outputs': output_files, 'report': run_report,
+            'quality': quality}
+
+def find_captures(paths):
+    '''Expands files, directories and glob patterns into capture files
+
+    Args:
+        paths: Iterable of capture files, directories (searched recursively
+            for *.dat files) or glob patterns
+
+    Returns:
+        A sorted list of unique capture file paths.
+    '''
+    captures = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                captures.update(os.path.join(directory, name) for name in files if name.endswith('.dat'))
+        elif os.path.isfile(path):
+            captures.add(path)
+        else:
+            captures.update(match for match in glob.glob(path) if os.path.isfile(match))
+
+    return sorted(captures)
+
+def batch_decode(paths, spacecraft=None, direction=None, jobs=None, force=False, database=None, **options):
+    '''Decodes many captures in parallel across a process pool
+
+    Captures whose outputs for these options are already up to date are
+    skipped unless force is set. A failure in one capture is reported and
+    does not stop the others. With a database, the quality records of every capture found are
+    added to it, reusing the saved records of the skipped captures rather
+    than decoding them again.
+
+    Args:
+        paths: Capture files, directories or glob patterns
+        spacecraft: Spacecraft for every capture, None to infer per file
+        direction: Pass direction for every capture, None to infer per file
+        jobs: Number of worker processes (default: one per CPU)
+        force: Decode captures even if their outputs are up to date
+        database: SQLite pass database to record the passes in, or None
+        options: Extra keyword arguments passed on to decode()
+
+    Returns:
+        A list of the summary dicts from decode() for every capture decoded.
+    '''
+    captures = find_captures(paths)
+    requested = dict((key, options[key]) for key in ('tiles', 'composites', 'plot', 'report') if key in options)
+    pending = [capture for capture in captures if force or not outputs_up_to_date(capture, **requested)]
+    print('Found {} captures, {} to decode'.format(len(captures), len(pending)))
+
+    results = []
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or multiprocessing.cpu_count()) as executor:
+        futures = dict((executor.submit(decode, capture, spacecraft, direction, **options), capture)
+                       for capture in pending)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append(future.result())
+                print('Decoded {}'.format(futures[future]))
+            except Exception as error:
+                print('Failed to decode {}: {}'.format(futures[future], error))
+
+    elapsed = time.time() - start
+    if results:
+        print('Decoded {} passes in {:.1f} s ({:.1f} passes/minute)'.format(
+            len(results), elapsed, 60 * len(results) / elapsed))
+
+    if database:
+        skipped = [load_quality(capture) for capture in captures if capture not in pending]
+        recorded = record_passes(database, [result['quality'] for result in results] + skipped)
+        print('Recorded {} passes in {}'.format(recorded, database))
+
+    return results
+
+################################################################################
+# Command Line
+################################################################################
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file', nargs='+', help='Raw APT demodulated data file(s), directories or glob patterns')
+    parser.add_argument('-s', '--spacecraft', default=None, help='Spacecraft captured (for calibration), inferred from the file name by default')
+    parser.add_argument('-d', '--direction', default=None, help='Pass to the \'north\' or \'south\', inferred from the file name by default')
+    parser.add_argument('-a', '--all', action='store_true', default=False, help='Show all data lines, not just aligned')
+    parser.add_argument('-n', '--no-resample', action='store_true', default=False, help='Cut lines at the syncs without correcting for drift')
+    parser.add_argument('-f', '--follow', action='store_true', default=False, help='Decode the capture while it is still being recorded')
+    parser.add_argument('--idle-timeout', type=float, default=10.0, help='Seconds without new data before a followed capture is done')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes when decoding several captures (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', default=False, help='Decode captures even if their images are up to date')
+    parser.add_argument('--show', action='store_true', default=False, help='Display the raw frame in a plot window (needs a display)')
+    parser.add_argument('--png-compression', type=int, default=6, choices=range(10), metavar='0-9', help='PNG compression level, lower is faster (default: 6)')
+    parser.add_argument('--tiles', action='store_true', default=False, help='Also write each image as a pyramid of 256x256 tiles for large mosaics')
+    parser.add_argument('-c', '--composite', action='append', default=[], choices=sorted(COMPOSITES), help='False colour product to write, may be repeated')
+    parser.add_argument('--report', action='store_true', default=False, help='Write per-stage timings to <capture>_report.json')
+    parser.add_argument('--profile', action='store_true', default=False, help='Write cProfile statistics to <capture>.prof')
+    parser.add_argument('--tle', default=None, help='TLE file to georeference each line and infer the pass direction from')
+    parser.add_argument('--database', default=None, help='SQLite database to record the quality of each pass in')
+    parser.add_argument('--plot', action='store_true', default=False, help='Also render the telemetry summary as <capture>_telemetry.png')
+    args = parser.parse_args()
+
+    if args.follow:
+        input_file = args.input_file[0]
+        header_file = input_file + '.hdr'
+        _, direction = pass_info(input_file, args.spacecraft, args.direction)
+        print('Following {}'.format(input_file))
+        lines = stream_decode(input_file, header_file if os.path.isfile(header_file) else None,
+                              capture_output_base(input_file),
+                              direction=direction, idle_timeout=args.idle_timeout, tiles=args.tiles)
+        print('Capture complete: {} lines decoded'.format(lines))
+        return
+
+    if len(args.input_file) == 1 and os.path.isfile(args.input_file[0]):
+        summary = decode(args.input_file[0], args.spacecraft, args.direction, show_all=args.all,
+                         resample=not args.no_resample, show=args.show, plot=args.plot,
+                         compress_level=args.png_compression, tiles=args.tiles, composites=args.composite,
+                         report=args.report, profile=args.profile, tle_file=args.tle)
+        if args.database:
+            record_passes(args.database, [summary['quality']])
+        return
+
+    batch_decode(args.input_file, args.spacecraft, args.direction, jobs=args.jobs, force=args.force, database=args.database,
+                 show_all=args.all, resample=not args.no_resample, plot=args.plot,
+                 compress_level=args.png_compression, tiles=args.tiles, composites=args.composite,
+                 report=args.report, profile=args.profile, tle_file=args.tle)
+
+if __name__ == '__main__':
+    main()
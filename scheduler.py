@@ -0,0 +1,272 @@
+'''Pass scheduler for the NOAA APT satellites
+
+Predicts the passes of NOAA-15, 18 and 19 over the station from locally
+stored TLEs, resolves the passes that overlap (NOAA-15 and NOAA-18 often
+do) and can then sit and launch the receive flowgraph for each pass it
+keeps, tuned to the right satellite and named so p.py can infer the
+spacecraft and direction from the capture. The receive flowgraph is
+grc_files/apt_live.py, which demodulates straight from the RTL-SDR with no
+GUI, so it can run unattended.
+
+Pass windows and elevation profiles come from orbit.py, which works on
+whole time arrays from cached, vectorized SGP4 ephemerides.
+
+Usage:
+    python scheduler.py weather.txt --lat 38.9 --lon -77.0 --days 7
+    python scheduler.py weather.txt --lat 38.9 --lon -77.0 --run --output-dir captures
+'''
+from __future__ import division
+
+import argparse
+import bisect
+import datetime
+import numpy as np
+import os.path
+import sqlite3
+import subprocess
+import sys
+import time
+
+import orbit
+
+################################################################################
+# Function Definitions
+################################################################################
+def predict_passes(sat, spacecraft, station, start, end, horizon=0.0, cache_dir=None):
+    '''Predicts the passes of one satellite over the station
+
+    Args:
+        sat: sgp4 Satrec from orbit.satellite()
+        spacecraft: Spacecraft name, e.g. 'NOAA-19'
+        station: (latitude, longitude, altitude) of the station
+        start: Start of the prediction window (Unix time)
+        end: End of the prediction window (Unix time)
+        horizon: Elevation in degrees the satellite must rise above
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        A list of the pass dicts from orbit.pass_windows with the
+        spacecraft, its frequency and usable_s, the seconds spent above
+        QUALITY_ELEVATION, added.
+    '''
+    passes = orbit.pass_windows(sat, station, start, end, horizon, cache_dir=cache_dir)
+    for sat_pass in passes:
+        _, elevation = orbit.elevation_profile(sat, station, sat_pass['aos'], sat_pass['los'], QUALITY_STEP, cache_dir)
+        sat_pass.update(spacecraft=spacecraft, frequency=orbit.APT_FREQUENCIES[spacecraft],
+                        usable_s=float(np.sum(elevation > QUALITY_ELEVATION) * QUALITY_STEP))
+    return passes
+
+def predict_all(tle_file, station, start, end, horizon=0.0, spacecraft=None, cache_dir=None):
+    '''Predicts the passes of every APT satellite, in order of rise time
+
+    Args:
+        tle_file: File of named TLEs
+        station: (latitude, longitude, altitude) of the station
+        start: Start of the prediction window (Unix time)
+        end: End of the prediction window (Unix time)
+        horizon: Elevation in degrees the satellites must rise above
+        spacecraft: Spacecraft names to predict (default: all of
+            orbit.APT_FREQUENCIES)
+        cache_dir: Ephemeris cache directory, or None for memory only
+
+    Returns:
+        A list of pass dicts from predict_passes sorted by aos.
+    '''
+    tles = orbit.load_tles(tle_file)
+    passes = []
+    for name in sorted(spacecraft or orbit.APT_FREQUENCIES):
+        passes += predict_passes(orbit.satellite(tles, name), name, station, start, end, horizon, cache_dir)
+    return sorted(passes, key=lambda sat_pass: sat_pass['aos'])
+
+def spacecraft_quality(database):
+    '''Average sync ratio of each spacecraft's passes in the p.py pass database
+
+    Args:
+        database: SQLite pass database written by p.py --database
+
+    Returns:
+        A dict of spacecraft name to mean sync ratio (empty if the database
+        does not exist yet).
+    '''
+    if not database or not os.path.isfile(database):
+        return {}
+    connection = sqlite3.connect(database)
+    try:
+        rows = connection.execute('SELECT spacecraft, AVG(sync_ratio) FROM passes GROUP BY spacecraft').fetchall()
+    finally:
+        connection.close()
+    return dict((spacecraft, ratio) for spacecraft, ratio in rows if ratio is not None)
+
+def pass_score(sat_pass, priority='elevation', history=None):
+    '''Scores a pass for conflict resolution
+
+    Args:
+        sat_pass: Pass dict from predict_passes
+        priority: 'elevation' to prefer the highest pass, or 'quality' to
+            prefer the most time above QUALITY_ELEVATION, weighted by how
+            well the spacecraft has decoded before
+        history: Dict of spacecraft to mean sync ratio from
+            spacecraft_quality (used with 'quality')
+
+    Returns:
+        The score, higher is better.
+    '''
+    if priority == 'quality':
+        return sat_pass['usable_s'] * (history or {}).get(sat_pass['spacecraft'], 1.0)
+    return sat_pass['max_elevation']
+
+def resolve_conflicts(passes, priority='elevation', history=None, guard=60.0):
+    '''Picks the set of non-overlapping passes with the best total score
+
+    Weighted interval scheduling: passes closer together than the guard
+    time (to stop one capture and retune for the next) conflict, and the
+    kept set maximises the sum of pass_score.
+
+    Args:
+        passes: Pass dicts from predict_passes
+        priority: Scoring passed on to pass_score
+        history: Spacecraft sync ratios passed on to pass_score
+        guard: Seconds needed between one LOS and the next AOS
+
+    Returns:
+        A (kept, dropped) tuple of pass lists, each sorted by aos.
+    '''
+    ordered = sorted(passes, key=lambda sat_pass: sat_pass['los'])
+    ends = [sat_pass['los'] + guard for sat_pass in ordered]
+    best = [0.0] * (len(ordered) + 1)
+    for index, sat_pass in enumerate(ordered):
+        previous = bisect.bisect_right(ends, sat_pass['aos'], 0, index)
+        best[index + 1] = max(best[index], best[previous] + pass_score(sat_pass, priority, history))
+
+    kept = []
+    index = len(ordered)
+    while index:
+        sat_pass = ordered[index - 1]
+        previous = bisect.bisect_right(ends, sat_pass['aos'], 0, index - 1)
+        if best[index] != best[index - 1]:
+            kept.append(sat_pass)
+            index = previous
+        else:
+            index -= 1
+
+    kept.sort(key=lambda sat_pass: sat_pass['aos'])
+    dropped = [sat_pass for sat_pass in passes if sat_pass not in kept]
+    return kept, sorted(dropped, key=lambda sat_pass: sat_pass['aos'])
+
+def capture_name(sat_pass):
+    '''Capture file name for a pass, in the form p.py infers spacecraft and direction from'''
+    return 'noaa{}_{}_{}.dat'.format(sat_pass['spacecraft'].split('-')[-1], sat_pass['direction'],
+                                     datetime.datetime.utcfromtimestamp(sat_pass['aos']).strftime('%Y%m%d_%H%M'))
+
+def receive_command(sat_pass, output_file, rf_gain=49.6, tle_file=None, station=None):
+    '''Command line that runs the receive flowgraph for a pass
+
+    Args:
+        sat_pass: Pass dict from predict_passes
+        output_file: Capture file for the flowgraph to write
+        rf_gain: Receiver RF gain in dB, one of VALID_GAINS
+        tle_file: TLE file for Doppler tracking, or None
+        station: (latitude, longitude, altitude) for Doppler tracking
+
+    Returns:
+        The argument list for subprocess.
+
+    Raises:
+        ValueError: If the RTL-SDR has no gain step of rf_gain
+    '''
+    if rf_gain not in VALID_GAINS:
+        raise ValueError('RF gain {} dB is not one of the tuner gains {}'.format(rf_gain, VALID_GAINS))
+    command = [sys.executable, RECEIVE_FLOWGRAPH, '--satellite-name', sat_pass['spacecraft'],
+               '--rf-gain', '{}'.format(rf_gain), '--output-file', output_file]
+    if tle_file and station:
+        command += ['--tle-file', tle_file, '--station-lat', '{}'.format(station[0]),
+                    '--station-lon', '{}'.format(station[1]), '--station-alt', '{}'.format(station[2])]
+    return command
+
+def run_schedule(schedule, output_dir, lead=30.0, **options):
+    '''Runs the receive flowgraph for each pass in turn
+
+    Sleeps until just before each AOS, starts the flowgraph and stops it
+    just after LOS. Passes that have already set are skipped.
+
+    Args:
+        schedule: Kept pass dicts from resolve_conflicts
+        output_dir: Directory to write the captures to
+        lead: Seconds to start before AOS and stop after LOS
+        options: Extra keyword arguments passed on to receive_command
+
+    Raises:
+        ValueError: From receive_command, before waiting for the first pass
+    '''
+    captures = [(sat_pass, os.path.join(output_dir, capture_name(sat_pass))) for sat_pass in schedule]
+    commands = [receive_command(sat_pass, output_file, **options) for sat_pass, output_file in captures]
+    for (sat_pass, output_file), command in zip(captures, commands):
+        if sat_pass['los'] + lead < time.time():
+            continue
+        time.sleep(max(0.0, sat_pass['aos'] - lead - time.time()))
+        print('Receiving {} ({:.0f} deg max) to {}'.format(sat_pass['spacecraft'], sat_pass['max_elevation'], output_file))
+        receiver = subprocess.Popen(command)
+        try:
+            while receiver.poll() is None and time.time() < sat_pass['los'] + lead:
+                time.sleep(1.0)
+        finally:
+            if receiver.poll() is None:
+                receiver.terminate()
+            receiver.wait()
+
+def format_pass(sat_pass):
+    '''One line summary of a pass for the schedule listing'''
+    return '{}  {}  {:<8} {:<5} {:5.1f} deg  {:4.0f} s usable'.format(
+        datetime.datetime.utcfromtimestamp(sat_pass['aos']).strftime('%Y-%m-%d %H:%M:%S'),
+        datetime.datetime.utcfromtimestamp(sat_pass['los']).strftime('%H:%M:%S'),
+        sat_pass['spacecraft'], sat_pass['direction'], sat_pass['max_elevation'], sat_pass['usable_s'])
+
+################################################################################
+# Define some constants
+################################################################################
+QUALITY_ELEVATION = 20.0
+QUALITY_STEP = 10.0
+RECEIVE_FLOWGRAPH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grc_files', 'apt_live.py')
+# R820T tuner gains in dB, the steps the RTL-SDR accepts (apt_live.VALID_GAINS)
+VALID_GAINS = [0.0, 0.9, 1.4, 2.7, 3.7, 7.7, 8.7, 12.5, 14.4, 15.7, 16.6, 19.7, 20.7, 22.9, 25.4, 28.0, 29.7, 32.8, 33.8, 36.4, 37.2, 38.6, 40.2, 42.1, 43.4, 43.9, 44.5, 48.0, 49.6]
+
+################################################################################
+# Command Line
+################################################################################
+def main():
+    parser = argparse.ArgumentParser(description='Predict, deconflict and receive NOAA APT passes')
+    parser.add_argument('tle_file', help='File of named TLEs, e.g. Celestrak weather.txt')
+    parser.add_argument('--lat', type=float, required=True, help='Station latitude in degrees (north positive)')
+    parser.add_argument('--lon', type=float, required=True, help='Station longitude in degrees (east positive)')
+    parser.add_argument('--alt', type=float, default=0.0, help='Station altitude in metres')
+    parser.add_argument('--days', type=float, default=1.0, help='Days ahead to schedule')
+    parser.add_argument('--horizon', type=float, default=0.0, help='Elevation in degrees that counts as rise and set')
+    parser.add_argument('--min-elevation', type=float, default=20.0, help='Skip passes that culminate below this elevation')
+    parser.add_argument('--priority', choices=['elevation', 'quality'], default='elevation', help='How to pick between overlapping passes')
+    parser.add_argument('--database', default=None, help='p.py pass database to weight quality priority by past sync ratios')
+    parser.add_argument('--no-cache', action='store_true', default=False, help='Do not read or write the on-disk ephemeris cache')
+    parser.add_argument('--rf-gain', type=float, choices=VALID_GAINS, default=49.6, metavar='DB',
+                        help='Receiver RF gain in dB, one of the tuner gain steps: {}'.format(', '.join(map(str, VALID_GAINS))))
+    parser.add_argument('--doppler', action='store_true', default=False, help='Have the flowgraph track Doppler from the TLEs')
+    parser.add_argument('--run', action='store_true', default=False, help='Wait for each pass and run the headless receive flowgraph')
+    parser.add_argument('--output-dir', default='.', help='Directory to write captures to')
+    args = parser.parse_args()
+
+    station = (args.lat, args.lon, args.alt)
+    start = time.time()
+    passes = predict_all(args.tle_file, station, start, start + args.days * orbit.SECONDS_PER_DAY, args.horizon,
+                         cache_dir=None if args.no_cache else orbit.EPHEMERIS_CACHE)
+    passes = [sat_pass for sat_pass in passes if sat_pass['max_elevation'] >= args.min_elevation]
+    kept, dropped = resolve_conflicts(passes, args.priority, spacecraft_quality(args.database))
+    print('Predicted {} passes in {:.2f} s, {} conflicting dropped'.format(len(passes), time.time() - start, len(dropped)))
+    for sat_pass in kept:
+        print(format_pass(sat_pass))
+    for sat_pass in dropped:
+        print('dropped ' + format_pass(sat_pass))
+
+    if args.run:
+        run_schedule(kept, args.output_dir, rf_gain=args.rf_gain,
+                     tle_file=args.tle_file if args.doppler else None, station=station)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os.path
+import sys
+
+# Make p.py importable when running the tests from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
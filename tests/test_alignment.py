@@ -0,0 +1,48 @@
+'''Tests of cutting captures into lines in p.py
+
+Run from the top of the repository with:
+    python -m pytest tests
+'''
+from __future__ import division
+
+import numpy as np
+import pytest
+
+import p
+
+################################################################################
+# Fixtures
+################################################################################
+@pytest.fixture
+def capture():
+    # Sample numbers as values, so each line shows where it was cut from
+    lead_in = 700
+    samples = np.arange(lead_in + LINES * p.FULL_LINE_WIDTH, dtype=np.float32)
+    syncs = p.sync_index(lead_in + np.arange(LINES) * p.FULL_LINE_WIDTH, len(samples))
+    return samples, syncs
+
+################################################################################
+# Tests
+################################################################################
+@pytest.mark.parametrize('show_all', [False, True])
+def test_align_capture_times_lines_from_the_first_segment(capture, show_all):
+    samples, syncs = capture
+    lines, sync_count, line_offsets = p.align_capture(samples, syncs, resample=False, show_all=show_all)
+    # The lead-in segment and then one line per sync, without repeating the lead-in
+    assert len(lines) == LINES + 1
+    assert sync_count == LINES
+    assert line_offsets[0] == syncs['offset'][0]
+    assert np.array_equal(lines[:, 0], line_offsets)
+
+def test_align_capture_resampled_keeps_the_lines_before_the_first_sync(capture):
+    samples, syncs = capture
+    lines, sync_count, line_offsets = p.align_capture(samples, syncs, resample=True, show_all=True)
+    assert len(lines) == LINES + 1
+    assert sync_count == LINES
+    assert line_offsets[0] == 700 - p.FULL_LINE_WIDTH
+    assert np.allclose(lines[1:, 0], line_offsets[1:])
+
+################################################################################
+# Define some constants
+################################################################################
+LINES = 5
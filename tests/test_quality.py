@@ -0,0 +1,50 @@
+'''Tests of the pass quality record written by p.decode
+
+The decode test needs the synthetic captures of benchmarks/synthetic.py,
+which import GNU Radio's pmt, and is skipped without them. Run from the
+top of the repository with:
+    python -m pytest tests
+'''
+from __future__ import division
+
+import json
+import numpy as np
+import os.path
+import pytest
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import p
+
+################################################################################
+# Function Definitions
+################################################################################
+def reject_constant(name):
+    raise ValueError('{} is not JSON'.format(name))
+
+################################################################################
+# Tests
+################################################################################
+def test_finite_or_none():
+    record = {'linearity': float('nan'), 'frames': {'B': {'min_k': np.float64('inf'), 'max_k': 290.0}},
+              'wedges': [1.0, float('-inf')], 'spacecraft': 'NOAA-19'}
+    assert p.finite_or_none(record) == {'linearity': None, 'frames': {'B': {'min_k': None, 'max_k': 290.0}},
+                                        'wedges': [1.0, None], 'spacecraft': 'NOAA-19'}
+
+def test_quality_record_without_valid_telemetry(tmpdir):
+    synthetic = pytest.importorskip('synthetic')
+    # The channel 4 blackbody wedge reads the same as space, so no pixel calibrates
+    samples, _, _ = synthetic.synthesize_apt(3, noise=0.0, lead_in=0)
+    frame = samples.reshape(-1, p.FULL_LINE_WIDTH)
+    blackbody_lines = (np.arange(len(frame)) // p.TLM_WEDGE_LINES) % p.TLM_WEDGES == 14
+    space = frame[p.TLM_WEDGE_LINES, p.SPACE_MARK_RANGE['B'][0]]
+    frame[blackbody_lines, p.TLM_FRAME_RANGE['B'][0]:p.TLM_FRAME_RANGE['B'][1]] = space
+    data_file = str(tmpdir.join('noaa19_north_20160331_1326.dat'))
+    samples.tofile(data_file)
+
+    p.decode(data_file)
+    with open(p.quality_file(data_file)) as handle:
+        quality = json.load(handle, parse_constant=reject_constant)
+    assert quality['frames']['B']['channel'] == '4'
+    assert quality['frames']['B']['min_k'] is None and quality['frames']['B']['max_k'] is None
@@ -0,0 +1,33 @@
+'''Tests of the space view filtering in p.py
+
+Run from the top of the repository with:
+    python -m pytest tests
+'''
+from __future__ import division
+
+import numpy as np
+
+import p
+
+################################################################################
+# Tests
+################################################################################
+def test_running_median_matches_windowed_median():
+    values = np.random.RandomState(0).rand(200)
+    rolling = p.running_median(values, 31)
+    assert rolling.shape == values.shape
+    for line in range(15, 185):
+        assert rolling[line] == np.median(values[line - 15:line + 16])
+
+def test_running_median_reflects_edges():
+    values = np.arange(10, dtype=float)
+    assert np.allclose(p.running_median(values, 5), [1, 1, 2, 3, 4, 5, 6, 7, 8, 8])
+
+def test_space_view_rejects_outliers_in_the_first_lines():
+    # Minute marker in the first two lines of an otherwise steady space view
+    strip = 245 + np.random.RandomState(1).randn(300, p.SPACE_MARK_WIDTH)
+    strip[0:2] = 5.0
+    space, data, rolling = p.space_view(strip)
+    assert np.all(np.abs(data[0:2] - 245) < 2)
+    assert np.all(np.abs(rolling - 245) < 2)
+    assert space == 245